@@ -0,0 +1,79 @@
+"""
+Name: bench_create_rides.py
+Author: Ryan Gascoigne-Jones
+
+Purpose: Compares the DB round trips used to save a park snapshot with
+  one Ride.save() per ride against the bulk upsert in create_rides
+
+Usage: python -m benchmarks.bench_create_rides (from the project
+  directory)
+"""
+
+from .common import benchmark_db, make_rides_lands
+
+import time
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rides.models import Ride
+from rides.utils.api_request import create_rides
+
+
+def save_rides_per_row(park_id: int, rides_lands: list[dict]) -> None:
+  """Saves rides one at a time, as create_rides did before the bulk
+  upsert"""
+
+  for land in rides_lands:
+    for cur_ride in land['rides']:
+      Ride(
+        id = cur_ride['id'],
+        park_id = park_id,
+        name = cur_ride['name'],
+        category = land['name'],
+        open_state = cur_ride['is_open'],
+        wait_time = cur_ride['wait_time'],
+        last_updated = cur_ride['last_updated']
+      ).save()
+
+
+def measure(save, rides_lands: list[dict]) -> tuple[int, float]:
+  """Produces the number of queries and the milliseconds taken to save a
+  park snapshot"""
+
+  with CaptureQueriesContext(connection) as queries:
+    start: float = time.perf_counter()
+    save(park_id=1, rides_lands=rides_lands)
+    elapsed: float = (time.perf_counter() - start) * 1000
+
+  return (len(queries), elapsed)
+
+
+def main() -> None:
+
+  print(f"{'rides':>6} {'write':>7} {'per-row queries':>16} "\
+        f"{'bulk queries':>13} {'per-row ms':>11} {'bulk ms':>8}")
+
+  with benchmark_db():
+    for num_rides in (10, 50, 100):
+      # First pass inserts every ride, second pass updates them
+      for write, wait_offset in (('insert', 0), ('update', 5)):
+        rides_lands: list[dict] = make_rides_lands(num_rides=num_rides,
+                                                   wait_offset=wait_offset)
+
+        if write == 'insert':
+          Ride.objects.all().delete()
+        per_row: tuple[int, float] = measure(save_rides_per_row, rides_lands)
+
+        if write == 'insert':
+          Ride.objects.all().delete()
+        else:
+          # Changes every ride again so the bulk pass has work to do
+          rides_lands = make_rides_lands(num_rides=num_rides,
+                                         wait_offset=wait_offset * 2)
+        bulk: tuple[int, float] = measure(create_rides, rides_lands)
+
+        print(f"{num_rides:>6} {write:>7} {per_row[0]:>16} {bulk[0]:>13} "\
+              f"{per_row[1]:>11.1f} {bulk[1]:>8.1f}")
+
+
+if __name__ == '__main__':
+  main()
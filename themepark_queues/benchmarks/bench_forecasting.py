@@ -0,0 +1,109 @@
+"""
+Name: bench_forecasting.py
+Author: Ryan Gascoigne-Jones
+
+Purpose: Measures the time taken to load a park's wait time history and
+  fit forecasts for all of its rides
+
+Usage: python -m benchmarks.bench_forecasting (from the project
+  directory)
+"""
+
+from .common import benchmark_db
+
+from datetime import datetime, timedelta, timezone as dt_timezone
+import time
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from rides.models import Ride, RideWaitSample
+from rides.utils.forecasting import fit_forecasts, load_history, \
+  save_forecasts
+
+NOW = datetime(2024, 9, 12, 12, 0, tzinfo=dt_timezone.utc)
+
+# Samples are taken every 5 minutes while the park is open 9:00-21:00
+SAMPLE_MINUTES: int = 5
+OPEN_HOURS: range = range(9, 21)
+
+
+def make_history(num_rides: int, days: int) -> pd.DataFrame:
+  """Produces synthetic history of open rides which is busier in the
+  afternoon and at weekends"""
+
+  rng = np.random.default_rng(0)
+
+  times = pd.date_range(NOW - timedelta(days=days), NOW,
+                        freq=f"{SAMPLE_MINUTES}min")
+  times = times[times.hour.isin(OPEN_HOURS)]
+
+  ride_ids: np.ndarray = np.repeat(np.arange(1, num_rides + 1), len(times))
+  timestamps = np.tile(times, num_rides)
+  hours: np.ndarray = np.tile(times.hour, num_rides)
+  weekend: np.ndarray = np.tile(times.dayofweek >= 5, num_rides)
+
+  waits: np.ndarray = (ride_ids % 12) * 5 + 15 * np.sin((hours - 9) / 4) \
+                      + 20 * weekend + rng.normal(0, 5, len(ride_ids))
+
+  return pd.DataFrame({
+    'ride_id': ride_ids,
+    'timestamp': timestamps,
+    'wait_time': np.clip(np.rint(waits), 0, None)
+  })
+
+
+def fit(history: pd.DataFrame) -> pd.DataFrame:
+  return fit_forecasts(history=history, now=NOW,
+                       hours=settings.FORECAST_HOURS,
+                       step_minutes=settings.FORECAST_STEP_MINUTES,
+                       trend_hours=settings.FORECAST_TREND_HOURS,
+                       prior_samples=settings.FORECAST_PRIOR_SAMPLES)
+
+
+def main() -> None:
+
+  days: int = settings.FORECAST_HISTORY_DAYS
+
+  print(f"Fitting {days} days of history, sampled every {SAMPLE_MINUTES} "\
+        "minutes")
+  print(f"{'rides':>6} {'samples':>9} {'fit s':>7}")
+
+  for num_rides in (50, 200):
+    history: pd.DataFrame = make_history(num_rides=num_rides, days=days)
+
+    start: float = time.perf_counter()
+    fit(history)
+    elapsed: float = time.perf_counter() - start
+
+    print(f"{num_rides:>6} {len(history):>9} {elapsed:>7.2f}")
+
+  # A park of 50 rides through the DB
+  history = make_history(num_rides=50, days=days)
+
+  with benchmark_db():
+    Ride.objects.bulk_create([
+      Ride(id=ride_id, park_id=1, name=f"Ride {ride_id}", category='Land',
+           open_state=True, wait_time=0, last_updated=NOW)
+      for ride_id in range(1, 51)])
+    RideWaitSample.objects.bulk_create([
+      RideWaitSample(ride_id=ride_id, timestamp=timestamp,
+                     wait_time=wait_time, open_state=True)
+      for ride_id, timestamp, wait_time in zip(
+        history['ride_id'].tolist(), history['timestamp'],
+        history['wait_time'].astype(int).tolist())], batch_size=5000)
+
+    start = time.perf_counter()
+    loaded: pd.DataFrame = load_history(park_id=1,
+                                        since=NOW - timedelta(days=days))
+    loaded_at: float = time.perf_counter()
+    forecasts: pd.DataFrame = fit(loaded)
+    fitted_at: float = time.perf_counter()
+    save_forecasts(park_id=1, forecasts=forecasts, fitted_at=NOW)
+    saved_at: float = time.perf_counter()
+
+  print(f"\n50 rides from the DB: load {loaded_at - start:.2f}s, "\
+        f"fit {fitted_at - loaded_at:.2f}s, save {saved_at - fitted_at:.2f}s")
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,68 @@
+"""
+Name: bench_http_session.py
+Author: Ryan Gascoigne-Jones
+
+Purpose: Compares the connections opened by one requests.get per poll
+  against the pooled keep-alive session used by get_rides, using a local
+  stub of queue-times.com
+
+Usage: python -m benchmarks.bench_http_session (from the project
+  directory)
+"""
+
+from . import common
+
+import time
+from django.conf import settings
+import requests
+from django.test import override_settings
+from rides.utils.api_request import get_rides
+from .stub_upstream import StubUpstream
+
+NUM_REQUESTS = 200
+
+
+def get_rides_unpooled(park_id: int) -> list[dict]:
+  """Requests a park without a session, as get_rides did before the
+  pooled session"""
+
+  response = requests.get(f"{settings.QUEUE_TIMES_URL}/parks/{park_id}/"\
+                          "queue_times.json")
+
+  return response.json()['lands']
+
+
+def measure(server: StubUpstream, fetch) -> tuple[int, int, float]:
+  """Produces the requests served, connections opened and milliseconds
+  per request when fetching NUM_REQUESTS times"""
+
+  server.reset_stats()
+  start: float = time.perf_counter()
+
+  for _ in range(NUM_REQUESTS):
+    fetch(park_id=1)
+
+  elapsed: float = (time.perf_counter() - start) * 1000 / NUM_REQUESTS
+
+  return (server.requests, server.connections, elapsed)
+
+
+def main() -> None:
+
+  server: StubUpstream = StubUpstream(num_rides=100).start()
+
+  print(f"{'client':>10} {'requests':>9} {'new conns':>10} "\
+        f"{'reused':>7} {'ms/request':>11}")
+
+  with override_settings(QUEUE_TIMES_URL=server.url):
+    for name, fetch in (('unpooled', get_rides_unpooled),
+                        ('session', get_rides)):
+      served, connections, elapsed = measure(server, fetch)
+      print(f"{name:>10} {served:>9} {connections:>10} "\
+            f"{served - connections:>7} {elapsed:>11.2f}")
+
+  server.shutdown()
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,240 @@
+"""
+Name: bench_suite.py
+Author: Ryan Gascoigne-Jones
+
+Purpose: Measures the wall time, DB queries and peak memory of each stage
+  of ingesting and serving synthetic parks of 10, 100 and 1,000 rides from
+  a local stub of queue-times.com, and compares them with the baselines
+  in baselines.json
+
+Usage: python -m benchmarks.bench_suite [--save-baseline] [--check]
+  (from the project directory). Wall times are only comparable with
+  baselines saved on the same machine, query counts on any
+"""
+
+from .common import benchmark_db
+
+import argparse
+import json
+import statistics
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable, NamedTuple, Optional
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import F
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from rides.models import Park, Ride, RideWaitRollup, RideWaitSample
+from rides.utils.api_request import compile_rides_list, create_rides, \
+  forget_validators, get_queue_data, get_ride_categories, save_queue_data
+from .common import make_rides_lands
+from .stub_upstream import StubUpstream
+
+BASELINES_PATH: Path = Path(__file__).resolve().parent / 'baselines.json'
+
+PARK_SIZES: tuple[int, ...] = (10, 100, 1000)
+PARK_ID: int = 1
+
+# Allowed growth over the baseline before a stage counts as a regression.
+# Any extra query is a regression
+TIME_TOLERANCE: float = 0.5
+MEMORY_TOLERANCE: float = 0.25
+
+
+class Stage(NamedTuple):
+  """A measured step. setup is run before each run and isn't measured"""
+
+  name: str
+  setup: Callable[[], None]
+  run: Callable[[], object]
+
+
+def reset_park() -> None:
+  """Removes the park's rides, history and cached data"""
+
+  Ride.objects.all().delete()
+  RideWaitSample.objects.all().delete()
+  RideWaitRollup.objects.all().delete()
+  Park.objects.all().delete()
+  forget_validators(park_id=PARK_ID)
+  cache.clear()
+
+
+def get_stages(server: StubUpstream, num_rides: int) -> list[Stage]:
+  """Produces the stages measured for a park of num_rides"""
+
+  client: Client = Client()
+
+  def change_upstream() -> None:
+    # Every ride's wait time changes between polls
+    server.wait_offset += 5
+
+  def ingest_unchanged_setup() -> None:
+    save_queue_data(park_id=PARK_ID)
+
+  def create_rides_setup() -> None:
+    server.wait_offset += 5
+
+  def home_miss_setup() -> None:
+    cache.clear()
+
+  def home_land_changed_setup() -> None:
+    # A new snapshot in which only the rides of the first land changed, so
+    # the tables of the other lands stay cached
+    park: Park = Park.objects.get(id=PARK_ID)
+    land: str = park.categories[0]
+    Ride.objects.filter(park_id=PARK_ID, category=land)\
+                .update(wait_time=F('wait_time') + 5)
+    Park.objects.filter(id=PARK_ID).update(
+      version=F('version') + 1,
+      land_versions={**park.land_versions,
+                     land: park.land_versions.get(land, 0) + 1})
+
+  return [
+    Stage('ingest_insert', reset_park,
+          lambda: save_queue_data(park_id=PARK_ID)),
+    Stage('ingest_update', change_upstream,
+          lambda: save_queue_data(park_id=PARK_ID)),
+    Stage('ingest_unchanged', ingest_unchanged_setup,
+          lambda: save_queue_data(park_id=PARK_ID)),
+    Stage('create_rides', create_rides_setup,
+          lambda: create_rides(park_id=PARK_ID, rides_lands=make_rides_lands(
+            num_rides=num_rides, num_lands=server.num_lands,
+            wait_offset=server.wait_offset))),
+    Stage('compile_rides_list', lambda: None,
+          lambda: compile_rides_list(
+            get_ride_categories(park_id=PARK_ID), park_id=PARK_ID)),
+    Stage('get_queue_data', lambda: None,
+          lambda: get_queue_data(park_id=PARK_ID)),
+    Stage('home_miss', home_miss_setup, lambda: client.get('/')),
+    Stage('home_hit', lambda: None, lambda: client.get('/')),
+    Stage('home_land_changed', home_land_changed_setup,
+          lambda: client.get('/')),
+  ]
+
+
+def measure(stage: Stage, repeats: int) -> dict[str, float]:
+  """Produces the median wall time in ms and the queries of a stage, then
+  its peak traced memory in KiB from a separate run, as tracing slows it"""
+
+  times: list[float] = []
+  queries: int = 0
+
+  for _ in range(repeats):
+    stage.setup()
+
+    with CaptureQueriesContext(connection) as captured:
+      start: float = time.perf_counter()
+      stage.run()
+      times.append((time.perf_counter() - start) * 1000)
+
+    queries = len(captured)
+
+  stage.setup()
+  tracemalloc.start()
+  stage.run()
+  _, peak = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+
+  return {
+    'ms': round(statistics.median(times), 3),
+    'queries': queries,
+    'peak_kib': round(peak / 1024, 1)
+  }
+
+
+def find_regressions(results: dict, baselines: dict) -> list[str]:
+  """Produces a description of each stage that is worse than its
+  baseline"""
+
+  regressions: list[str] = []
+
+  for size, stages in results.items():
+    for name, result in stages.items():
+      baseline: Optional[dict] = baselines.get(size, {}).get(name)
+      if baseline is None:
+        continue
+
+      if result['queries'] > baseline['queries']:
+        regressions.append(f"{name} ({size} rides): {result['queries']} "\
+                           f"queries, baseline {baseline['queries']}")
+      if result['ms'] > baseline['ms'] * (1 + TIME_TOLERANCE):
+        regressions.append(f"{name} ({size} rides): {result['ms']:.1f}ms, "\
+                           f"baseline {baseline['ms']:.1f}ms")
+      if result['peak_kib'] > baseline['peak_kib'] * (1 + MEMORY_TOLERANCE):
+        regressions.append(f"{name} ({size} rides): "\
+                           f"{result['peak_kib']:.0f}KiB peak, baseline "\
+                           f"{baseline['peak_kib']:.0f}KiB")
+
+  return regressions
+
+
+def print_results(size: str, stages: dict, baselines: dict) -> None:
+  """Prints the results of a park size beside their baselines"""
+
+  print(f"\n{size} rides")
+  print(f"{'stage':>18} {'ms':>9} {'base ms':>9} {'queries':>8} "\
+        f"{'base q':>7} {'peak KiB':>9} {'base KiB':>9}")
+
+  for name, result in stages.items():
+    baseline: dict = baselines.get(size, {}).get(name, {})
+    print(f"{name:>18} {result['ms']:>9.2f} "\
+          f"{baseline.get('ms', float('nan')):>9.2f} "\
+          f"{result['queries']:>8} {baseline.get('queries', '-'):>7} "\
+          f"{result['peak_kib']:>9.1f} "\
+          f"{baseline.get('peak_kib', float('nan')):>9.1f}")
+
+
+def main() -> None:
+
+  parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+  parser.add_argument('--repeats', type=int, default=5,
+                      help="Runs of each stage the median time is taken of")
+  parser.add_argument('--save-baseline', action='store_true',
+                      help="Write the results to baselines.json")
+  parser.add_argument('--check', action='store_true',
+                      help="Exit with status 1 if a stage regressed")
+  args = parser.parse_args()
+
+  baselines: dict = json.loads(BASELINES_PATH.read_text()) \
+                    if BASELINES_PATH.exists() else {}
+  results: dict = {}
+
+  with benchmark_db():
+    for num_rides in PARK_SIZES:
+      # Many small lands, as in large parks
+      server: StubUpstream = StubUpstream(
+        num_rides=num_rides, num_lands=max(2, num_rides // 10)).start()
+
+      with override_settings(QUEUE_TIMES_URL=server.url):
+        results[str(num_rides)] = {
+          stage.name: measure(stage=stage, repeats=args.repeats)
+          for stage in get_stages(server=server, num_rides=num_rides)
+        }
+
+      server.shutdown()
+      server.server_close()
+      print_results(size=str(num_rides), stages=results[str(num_rides)],
+                    baselines=baselines)
+
+  regressions: list[str] = find_regressions(results=results,
+                                            baselines=baselines)
+
+  if regressions:
+    print("\nRegressions:")
+    for regression in regressions:
+      print(f"  {regression}")
+
+  if args.save_baseline:
+    BASELINES_PATH.write_text(json.dumps(results, indent=2) + '\n')
+    print(f"\nSaved baselines to {BASELINES_PATH.name}")
+
+  if args.check and regressions:
+    sys.exit(1)
+
+
+if __name__ == '__main__':
+  main()
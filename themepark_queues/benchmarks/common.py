@@ -0,0 +1,65 @@
+"""
+Name: common.py
+Author: Ryan Gascoigne-Jones
+
+Purpose: Contains shared set up for benchmarks, which run against a
+  throwaway test DB so the development DB is never touched
+"""
+
+import os
+import sys
+from pathlib import Path
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+# Allows benchmarks to be run from the project directory with
+# python -m benchmarks.<name>
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "themepark_queues.settings")
+
+import django
+
+django.setup()
+
+from django.db import connection
+from django.test.utils import setup_test_environment, \
+  teardown_test_environment
+
+
+@contextmanager
+def benchmark_db(test_name: Optional[str] = None) -> Iterator[None]:
+  """Creates a test DB for the duration of a benchmark. SQLite test DBs
+  are in memory unless a test_name file is given"""
+
+  setup_test_environment()
+  if test_name is not None:
+    connection.settings_dict['TEST']['NAME'] = test_name
+  old_name: str = connection.creation.create_test_db(verbosity=0)
+
+  try:
+    yield
+  finally:
+    connection.creation.destroy_test_db(old_name, verbosity=0)
+    teardown_test_environment()
+
+
+def make_rides_lands(num_rides: int, num_lands: int = 10,
+                     wait_offset: int = 0) -> list[dict]:
+  """Produces queue-times.com style lands of synthetic rides, spread
+  evenly across num_lands lands"""
+
+  rides_lands: list[dict] = [
+    {'id': land, 'name': f"Land {land}", 'rides': []}
+    for land in range(num_lands)
+  ]
+
+  for ride_id in range(1, num_rides + 1):
+    rides_lands[ride_id % num_lands]['rides'].append({
+      'id': ride_id,
+      'name': f"Ride {ride_id}",
+      'is_open': ride_id % 7 != 0,
+      'wait_time': (ride_id * 5 + wait_offset) % 120,
+      'last_updated': '2024-09-12T12:00:00Z'
+    })
+
+  return rides_lands
@@ -0,0 +1,368 @@
+"""
+Name: load_test.py
+Author: Ryan Gascoigne-Jones
+
+Purpose: Drives the home page, ride pages and subscribe POSTs at a target
+  rate and reports latency percentiles and throughput. By default the app
+  is served in this process against a throwaway DB, with local stand-ins
+  for queue-times.com and Firebase, so nothing leaves the machine
+
+Usage: python -m benchmarks.load_test [--rps 50] [--duration 30]
+  [--mix home=0.7,ride_info=0.2,subscribe=0.1] (from the project
+  directory). Pass --url with --username and --password to load test an
+  app that is already running instead
+"""
+
+from .common import benchmark_db
+
+import argparse
+import itertools
+import math
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+from socketserver import ThreadingMixIn
+from typing import Callable, NamedTuple, Optional
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, \
+  make_server
+import requests
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.wsgi import get_wsgi_application
+from django.db import connection
+from django.test import override_settings
+from rides.utils.api_request import save_queue_data
+from rides.utils.subscription_outbox import flush_outbox, get_outbox_stats
+from .stub_firebase import StubFirebase
+from .stub_upstream import StubUpstream
+
+PARK_ID: int = 1
+PASSWORD: str = 'load-test-password'
+
+
+class Result(NamedTuple):
+  """Outcome of one request. latency is measured from when the request
+  was scheduled, so it includes time spent waiting when the generator
+  falls behind"""
+
+  kind: str
+  ok: bool
+  latency: float
+  service_time: float
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+  daemon_threads = True
+
+
+class QuietHandler(WSGIRequestHandler):
+
+  def log_message(self, format, *args) -> None:
+    return None
+
+
+def parse_mix(mix: str) -> dict[str, float]:
+  """Parses kind=weight pairs separated by commas"""
+
+  weights: dict[str, float] = {}
+
+  for pair in mix.split(','):
+    kind, weight = pair.split('=')
+    if kind not in ('home', 'ride_info', 'subscribe'):
+      raise argparse.ArgumentTypeError(f"Unknown request kind {kind}")
+    weights[kind] = float(weight)
+
+  return weights
+
+
+def get_percentile(values: list[float], percentile: float) -> float:
+  """Produces the value at a percentile using the nearest rank"""
+
+  ordered: list[float] = sorted(values)
+
+  return ordered[max(0, math.ceil(percentile / 100 * len(ordered)) - 1)]
+
+
+def login(session: requests.Session, base_url: str, username: str,
+          password: str) -> None:
+  """Logs a session in through the login form"""
+
+  session.get(f"{base_url}/login")
+  response = session.post(f"{base_url}/login", data={
+    'username': username,
+    'password': password,
+    'csrfmiddlewaretoken': session.cookies.get('csrftoken')
+  }, allow_redirects=False)
+
+  if response.status_code != 302:
+    raise RuntimeError(f"Logging in as {username} failed")
+
+
+def run_load(base_url: str, rps: float, duration: float, workers: int,
+             mix: dict[str, float],
+             users: list[tuple[str, str]]) -> tuple[list[Result], float]:
+  """Sends requests at rps for duration seconds from a pool of worker
+  threads, each with its own keep-alive session. Produces the results and
+  the seconds taken to send them"""
+
+  ride_ids: list[int] = [
+    ride['id'] for land in requests.get(
+      f"{base_url}/api/parks/{PARK_ID}/queues").json()['lands']
+    for ride in land['rides']
+  ]
+
+  total: int = int(rps * duration)
+  tickets = itertools.count()
+  results: list[Result] = []
+  results_lock = threading.Lock()
+
+  kinds: list[str] = list(mix)
+  weights: list[float] = list(mix.values())
+
+  # Sessions log in before the clock starts
+  anonymous: list[requests.Session] = [requests.Session()
+                                       for _ in range(workers)]
+  logged_in: list[Optional[requests.Session]] = [None] * workers
+  if 'subscribe' in mix:
+    for worker in range(workers):
+      logged_in[worker] = requests.Session()
+      username, password = users[worker % len(users)]
+      login(session=logged_in[worker], base_url=base_url, username=username,
+            password=password)
+
+  start: float = time.perf_counter() + 0.1
+
+  def send(worker: int, kind: str, rng: random.Random) -> requests.Response:
+    ride_id: int = rng.choice(ride_ids)
+
+    if kind == 'home':
+      return anonymous[worker].get(f"{base_url}/")
+    if kind == 'ride_info':
+      return anonymous[worker].get(f"{base_url}/ride-info/{ride_id}")
+
+    session: requests.Session = logged_in[worker] # type: ignore
+    return session.post(f"{base_url}/ride-info/{ride_id}", data={
+      'csrfmiddlewaretoken': session.cookies.get('csrftoken')
+    })
+
+  def run_worker(worker: int) -> None:
+    rng = random.Random(worker)
+
+    while True:
+      ticket: int = next(tickets)
+      if ticket >= total:
+        return
+
+      # Requests are sent on a fixed schedule rather than when the last
+      # one finished, so slow responses don't lower the load
+      scheduled: float = start + ticket / rps
+      delay: float = scheduled - time.perf_counter()
+      if delay > 0:
+        time.sleep(delay)
+
+      kind: str = rng.choices(kinds, weights)[0]
+      sent: float = time.perf_counter()
+      try:
+        ok: bool = send(worker=worker, kind=kind, rng=rng).status_code < 400
+      except requests.RequestException:
+        ok = False
+      finished: float = time.perf_counter()
+
+      with results_lock:
+        results.append(Result(kind=kind, ok=ok, latency=finished - scheduled,
+                              service_time=finished - sent))
+
+  threads: list[threading.Thread] = [
+    threading.Thread(target=run_worker, args=(worker,))
+    for worker in range(workers)
+  ]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+
+  return (results, time.perf_counter() - start)
+
+
+def print_report(results: list[Result], elapsed: float) -> None:
+  """Prints the throughput, errors and latency percentiles of each kind of
+  request"""
+
+  by_kind: dict[str, list[Result]] = defaultdict(list)
+  for result in results:
+    by_kind[result.kind].append(result)
+    by_kind['all'].append(result)
+
+  print(f"\n{'request':>10} {'count':>7} {'errors':>7} {'req/s':>7} "\
+        f"{'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8} "\
+        f"{'service p50':>12}")
+
+  for kind in sorted(by_kind, key=lambda kind: kind == 'all'):
+    kind_results: list[Result] = by_kind[kind]
+    latencies: list[float] = [result.latency * 1000
+                              for result in kind_results]
+    service_times: list[float] = [result.service_time * 1000
+                                  for result in kind_results]
+
+    print(f"{kind:>10} {len(kind_results):>7} "\
+          f"{sum(not result.ok for result in kind_results):>7} "\
+          f"{len(kind_results) / elapsed:>7.1f} "\
+          f"{get_percentile(latencies, 50):>8.1f} "\
+          f"{get_percentile(latencies, 90):>8.1f} "\
+          f"{get_percentile(latencies, 99):>8.1f} "\
+          f"{max(latencies):>8.1f} "\
+          f"{get_percentile(service_times, 50):>12.1f}")
+
+
+def run_background(stop: threading.Event, interval: float,
+                   work: Callable[[], object]) -> threading.Thread:
+  """Runs work every interval seconds in a thread until stop is set"""
+
+  def loop() -> None:
+    try:
+      while not stop.wait(interval):
+        try:
+          work()
+        except Exception:
+          pass
+    finally:
+      connection.close()
+
+  thread = threading.Thread(target=loop, daemon=True)
+  thread.start()
+
+  return thread
+
+
+def run_self_contained(args: argparse.Namespace,
+                       mix: dict[str, float]) -> None:
+  """Serves the app in this process against stand-ins for queue-times.com
+  and Firebase, and load tests it"""
+
+  upstream: StubUpstream = StubUpstream(
+    num_rides=args.rides, num_lands=max(2, args.rides // 10),
+    latency=args.upstream_latency, error_rate=args.upstream_error_rate,
+    change_rate=args.change_rate).start()
+  firebase: StubFirebase = StubFirebase(latency=args.firebase_latency).start()
+
+  os.environ['FIREBASE_DATABASE_EMULATOR_HOST'] = firebase.host
+
+  # Requests are served by many threads, which can't share an in-memory
+  # SQLite DB
+  with tempfile.TemporaryDirectory() as tmp_dir, \
+       benchmark_db(test_name=str(Path(tmp_dir) / 'load_test.sqlite3')), \
+       override_settings(QUEUE_TIMES_URL=upstream.url,
+                         FIREBASE_DB_URL='https://loadtest.firebaseio.com',
+                         ALLOWED_HOSTS=['127.0.0.1']):
+
+    # Lets pages be read while ingestion writes. SQLite still allows one
+    # writer at a time, so capacity should be measured against the
+    # production DB with --url
+    with connection.cursor() as cursor:
+      cursor.execute('PRAGMA journal_mode=WAL')
+
+    password_hash: str = make_password(PASSWORD)
+    User.objects.bulk_create([
+      User(username=f"user{user}@example.com",
+           email=f"user{user}@example.com", password=password_hash)
+      for user in range(args.users)
+    ])
+    users: list[tuple[str, str]] = [(f"user{user}@example.com", PASSWORD)
+                                    for user in range(args.users)]
+
+    save_queue_data(park_id=PARK_ID)
+
+    server = make_server('127.0.0.1', 0, get_wsgi_application(),
+                         server_class=ThreadingWSGIServer,
+                         handler_class=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url: str = f"http://127.0.0.1:{server.server_port}"
+
+    # Ingestion and subscription writes keep running during the test, as
+    # they would in production
+    stop = threading.Event()
+    workers: list[threading.Thread] = [
+      run_background(stop=stop, interval=args.ingest_interval,
+                     work=lambda: save_queue_data(park_id=PARK_ID)),
+      run_background(stop=stop, interval=1,
+                     work=lambda: flush_outbox(batch_size=100)),
+    ]
+
+    print(f"Serving the app at {base_url} with {args.rides} rides and "\
+          f"{args.users} users")
+
+    results, elapsed = run_load(base_url=base_url, rps=args.rps,
+                                duration=args.duration, workers=args.workers,
+                                mix=mix, users=users)
+
+    stop.set()
+    for worker in workers:
+      worker.join()
+    server.shutdown()
+    server.server_close()
+
+    print_report(results=results, elapsed=elapsed)
+    print(f"\nUpstream: {upstream.requests} requests, {upstream.errors} "\
+          f"errors. Firebase: {firebase.updates} updates, "\
+          f"{get_outbox_stats()['depth']} subscriptions waiting")
+
+  upstream.shutdown()
+  firebase.shutdown()
+
+
+def main() -> None:
+
+  parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+  parser.add_argument('--rps', type=float, default=50,
+                      help="Target requests per second")
+  parser.add_argument('--duration', type=float, default=30,
+                      help="Seconds to send requests for")
+  parser.add_argument('--workers', type=int, default=32,
+                      help="Threads sending requests")
+  parser.add_argument('--mix', type=parse_mix,
+                      default='home=0.7,ride_info=0.2,subscribe=0.1',
+                      help="Weights of each kind of request")
+  parser.add_argument('--url', help="Load test an app already running "\
+                                    "at this URL")
+  parser.add_argument('--username', help="User subscribing with --url")
+  parser.add_argument('--password', help="Password of --username")
+  parser.add_argument('--rides', type=int, default=100,
+                      help="Rides in the stub park")
+  parser.add_argument('--users', type=int, default=50,
+                      help="Users created to subscribe")
+  parser.add_argument('--upstream-latency', type=float, default=0.05,
+                      help="Seconds the stub queue-times.com takes")
+  parser.add_argument('--upstream-error-rate', type=float, default=0.0,
+                      help="Fraction of stub queue-times.com requests "\
+                           "that fail")
+  parser.add_argument('--change-rate', type=float, default=0.2,
+                      help="Fraction of rides changed on each poll")
+  parser.add_argument('--firebase-latency', type=float, default=0.05,
+                      help="Seconds the stub Firebase takes")
+  parser.add_argument('--ingest-interval', type=float, default=5,
+                      help="Seconds between polls of the stub park")
+  args = parser.parse_args()
+
+  mix: dict[str, float] = args.mix if isinstance(args.mix, dict) \
+                          else parse_mix(args.mix)
+
+  if args.url is None:
+    run_self_contained(args=args, mix=mix)
+    return
+
+  if 'subscribe' in mix and not (args.username and args.password):
+    parser.error("--username and --password are needed to subscribe")
+
+  results, elapsed = run_load(
+    base_url=args.url.rstrip('/'), rps=args.rps, duration=args.duration,
+    workers=args.workers, mix=mix, users=[(args.username, args.password)])
+
+  print_report(results=results, elapsed=elapsed)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,167 @@
+"""
+Name: stub_firebase.py
+Author: Ryan Gascoigne-Jones
+
+Purpose: Contains a local stand-in for the Firebase Realtime Database REST
+  API used by firebase_admin, holding the DB in memory, so subscriptions
+  can be written during load tests without the remote DB
+
+Usage: python -m benchmarks.stub_firebase [--port 9000] [--latency 0.05]
+  (from the project directory), then run the app with
+  FIREBASE_DATABASE_EMULATOR_HOST=127.0.0.1:9000
+"""
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import argparse
+import json
+import threading
+import time
+from typing import Any
+from urllib.parse import urlparse
+
+
+def split_path(path: str) -> list[str]:
+  return [key for key in path.strip('/').split('/') if key]
+
+
+class StubFirebaseHandler(BaseHTTPRequestHandler):
+  """Serves GET, PUT, PATCH and DELETE of <path>.json like the Realtime
+  Database REST API"""
+
+  protocol_version = 'HTTP/1.1'
+  disable_nagle_algorithm = True
+
+  def get_keys(self) -> list[str]:
+    path: str = urlparse(self.path).path
+
+    if path.endswith('.json'):
+      path = path[:-len('.json')]
+
+    return split_path(path)
+
+  def read_body(self) -> Any:
+    length: int = int(self.headers.get('Content-Length', 0))
+
+    return json.loads(self.rfile.read(length) or b'null')
+
+  def respond(self, value: Any) -> None:
+    if self.server.latency:
+      time.sleep(self.server.latency)
+
+    body: bytes = json.dumps(value).encode()
+
+    self.send_response(200)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def do_GET(self) -> None:
+    self.respond(self.server.get(keys=self.get_keys()))
+
+  def do_PUT(self) -> None:
+    value: Any = self.read_body()
+    self.server.set(keys=self.get_keys(), value=value)
+    self.respond(value)
+
+  def do_PATCH(self) -> None:
+    value: dict = self.read_body()
+    keys: list[str] = self.get_keys()
+
+    # Each key of a multi-path update is a path relative to the reference
+    with self.server.lock:
+      for path, child in value.items():
+        self.server.set(keys=keys + split_path(path), value=child)
+      self.server.updates += 1
+
+    self.respond(value)
+
+  def do_DELETE(self) -> None:
+    self.server.set(keys=self.get_keys(), value=None)
+    self.respond(None)
+
+  def log_message(self, format, *args) -> None:
+    return None
+
+
+class StubFirebase(ThreadingHTTPServer):
+  """Stub Realtime Database run in a background thread. latency is added
+  to every response in seconds"""
+
+  daemon_threads = True
+
+  def __init__(self, port: int = 0, latency: float = 0.0) -> None:
+    super().__init__(('127.0.0.1', port), StubFirebaseHandler)
+    self.latency = latency
+    self.data: dict = {}
+    self.updates = 0
+    self.lock = threading.RLock()
+
+  @property
+  def host(self) -> str:
+    """Value for FIREBASE_DATABASE_EMULATOR_HOST"""
+
+    return f"127.0.0.1:{self.server_port}"
+
+  def start(self) -> 'StubFirebase':
+    threading.Thread(target=self.serve_forever, daemon=True).start()
+    return self
+
+  def get(self, keys: list[str]) -> Any:
+    with self.lock:
+      node: Any = self.data
+
+      for key in keys:
+        if not isinstance(node, dict) or key not in node:
+          return None
+        node = node[key]
+
+      return json.loads(json.dumps(node))
+
+  def set(self, keys: list[str], value: Any) -> None:
+    """Sets the value at a path. Setting None deletes it, along with any
+    parents left empty"""
+
+    with self.lock:
+      if not keys:
+        self.data = value if isinstance(value, dict) else {}
+        return
+
+      parents: list[dict] = [self.data]
+      for key in keys[:-1]:
+        child: Any = parents[-1].get(key)
+        if not isinstance(child, dict):
+          if value is None:
+            return
+          child = parents[-1][key] = {}
+        parents.append(child)
+
+      if value is None:
+        parents[-1].pop(keys[-1], None)
+
+        # Removes parents left empty
+        for parent, key in zip(reversed(parents[:-1]), reversed(keys[:-1])):
+          if parent[key]:
+            break
+          del parent[key]
+      else:
+        parents[-1][keys[-1]] = value
+
+
+def main() -> None:
+
+  parser = argparse.ArgumentParser(description="Serves an in-memory "\
+                                               "Realtime Database")
+  parser.add_argument('--port', type=int, default=9000)
+  parser.add_argument('--latency', type=float, default=0.0,
+                      help="Seconds added to each response")
+  args = parser.parse_args()
+
+  server = StubFirebase(port=args.port, latency=args.latency)
+
+  print(f"Serving an in-memory Realtime Database at {server.host}")
+  server.serve_forever()
+
+
+if __name__ == '__main__':
+  main()
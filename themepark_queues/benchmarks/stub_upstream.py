@@ -0,0 +1,179 @@
+"""
+Name: stub_upstream.py
+Author: Ryan Gascoigne-Jones
+
+Purpose: Contains a local stand-in for queue-times.com serving synthetic
+  parks, which counts the connections opened to it so connection reuse
+  can be measured. Responses can be delayed, fail and change between
+  requests so the app can be load tested without queue-times.com
+
+Usage: python -m benchmarks.stub_upstream [--port 8001] [--rides 100]
+  [--latency 0.05] [--error-rate 0.01] [--change-rate 0.2] (from the
+  project directory), then run the app with
+  QUEUE_TIMES_URL=http://127.0.0.1:8001
+"""
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from .common import make_rides_lands
+
+PARK_PATH = re.compile(r'^/parks/(\d+)/queue_times\.json$')
+
+
+class StubUpstreamHandler(BaseHTTPRequestHandler):
+  """Serves parks/<id>/queue_times.json over keep-alive connections"""
+
+  protocol_version = 'HTTP/1.1'
+  # Stops small responses being delayed on keep-alive connections
+  disable_nagle_algorithm = True
+
+  def setup(self) -> None:
+    # Called once for each new connection
+    super().setup()
+    with self.server.stats_lock:
+      self.server.connections += 1
+
+  def do_GET(self) -> None:
+    match = PARK_PATH.match(self.path)
+
+    with self.server.stats_lock:
+      self.server.requests += 1
+
+    if match is None:
+      self.send_error(404)
+      return
+
+    if self.server.latency:
+      time.sleep(self.server.latency)
+
+    if self.server.should_fail():
+      with self.server.stats_lock:
+        self.server.errors += 1
+      self.send_error(503)
+      return
+
+    body: bytes = json.dumps({
+      'lands': self.server.get_lands(park_id=int(match.group(1)))
+    }).encode()
+
+    self.send_response(200)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, format, *args) -> None:
+    return None
+
+
+class StubUpstream(ThreadingHTTPServer):
+  """Stub queue-times.com server run in a background thread. latency is
+  added to every response in seconds, error_rate is the fraction of
+  requests answered with a 503 and change_rate is the fraction of rides
+  whose wait time changes on each request"""
+
+  daemon_threads = True
+
+  def __init__(self, num_rides: int = 100, num_lands: int = 10,
+               port: int = 0, latency: float = 0.0, error_rate: float = 0.0,
+               change_rate: float = 0.0, seed: int = 0) -> None:
+    super().__init__(('127.0.0.1', port), StubUpstreamHandler)
+    self.num_rides = num_rides
+    self.num_lands = num_lands
+    self.latency = latency
+    self.error_rate = error_rate
+    self.change_rate = change_rate
+    # Changed to change the wait time of every ride served
+    self.wait_offset = 0
+    self.connections = 0
+    self.requests = 0
+    self.errors = 0
+    self.stats_lock = threading.Lock()
+    self.random = random.Random(seed)
+    # Wait time offset and last_updated of rides changed by change_rate,
+    # for each park
+    self.changed_rides: dict[int, dict[int, tuple[int, str]]] = {}
+
+  @property
+  def url(self) -> str:
+    return f"http://127.0.0.1:{self.server_port}"
+
+  def start(self) -> 'StubUpstream':
+    threading.Thread(target=self.serve_forever, daemon=True).start()
+    return self
+
+  def reset_stats(self) -> None:
+    with self.stats_lock:
+      self.connections = 0
+      self.requests = 0
+      self.errors = 0
+
+  def should_fail(self) -> bool:
+    with self.stats_lock:
+      return self.random.random() < self.error_rate
+
+  def get_lands(self, park_id: int) -> list[dict]:
+    """Produces the park's lands, first changing change_rate of its rides
+    when it is set"""
+
+    rides_lands: list[dict] = make_rides_lands(num_rides=self.num_rides,
+                                               num_lands=self.num_lands,
+                                               wait_offset=self.wait_offset)
+
+    if not self.change_rate:
+      return rides_lands
+
+    now: str = datetime.now(timezone.utc).isoformat()
+
+    with self.stats_lock:
+      changed: dict[int, tuple[int, str]] = self.changed_rides.setdefault(
+        park_id, {})
+
+      for land in rides_lands:
+        for ride in land['rides']:
+          if self.random.random() < self.change_rate:
+            changed[ride['id']] = (changed.get(ride['id'], (0, now))[0] + 5,
+                                   now)
+
+          if ride['id'] in changed:
+            offset, last_updated = changed[ride['id']]
+            ride['wait_time'] = (ride['wait_time'] + offset) % 120
+            ride['last_updated'] = last_updated
+
+    return rides_lands
+
+
+def main() -> None:
+
+  parser = argparse.ArgumentParser(description="Serves synthetic parks in "\
+                                               "the format of queue-times.com")
+  parser.add_argument('--port', type=int, default=8001)
+  parser.add_argument('--rides', type=int, default=100,
+                      help="Rides in each park")
+  parser.add_argument('--lands', type=int, default=10,
+                      help="Lands in each park")
+  parser.add_argument('--latency', type=float, default=0.0,
+                      help="Seconds added to each response")
+  parser.add_argument('--error-rate', type=float, default=0.0,
+                      help="Fraction of requests answered with a 503")
+  parser.add_argument('--change-rate', type=float, default=0.0,
+                      help="Fraction of rides changed on each request")
+  args = parser.parse_args()
+
+  server = StubUpstream(num_rides=args.rides, num_lands=args.lands,
+                        port=args.port, latency=args.latency,
+                        error_rate=args.error_rate,
+                        change_rate=args.change_rate)
+
+  print(f"Serving {args.rides} rides per park at {server.url}")
+  server.serve_forever()
+
+
+if __name__ == '__main__':
+  main()
@@ -4,3 +4,16 @@ from django.apps import AppConfig
 class RidesConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "rides"
+
+    def ready(self) -> None:
+        from .signals import rides_changed
+        from .utils.broadcaster import cache_snapshot_events
+        from .utils.notifications import enqueue_reopen_notifications
+
+        # Queues notifications of rides reopening as they are ingested
+        rides_changed.connect(enqueue_reopen_notifications,
+                              dispatch_uid="enqueue_reopen_notifications")
+
+        # Caches each park's ride events for clients polling over WSGI
+        rides_changed.connect(cache_snapshot_events,
+                              dispatch_uid="cache_snapshot_events")
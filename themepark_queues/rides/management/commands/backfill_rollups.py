@@ -0,0 +1,29 @@
+"""
+Name: backfill_rollups.py
+Author: Ryan Gascoigne-Jones
+
+Purpose: Management command that rebuilds the hourly and daily wait time
+  rollups of rides from their existing history
+"""
+
+from django.core.management.base import BaseCommand
+import time
+from ...utils.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+  help = "Rebuilds wait time rollups from ride history. Run while the "\
+         "ingestor is stopped so no samples are added during the rebuild"
+
+  def add_arguments(self, parser) -> None:
+    parser.add_argument('--park', type=int,
+                        help="Only rebuild the rollups of rides in this park")
+
+  def handle(self, *args, **options) -> None:
+
+    start: float = time.monotonic()
+
+    num_rollups: int = rebuild_rollups(park_id=options['park'])
+
+    self.stdout.write(f"Wrote {num_rollups} rollups in "\
+                      f"{time.monotonic() - start:.2f}s")
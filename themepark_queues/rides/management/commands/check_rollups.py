@@ -0,0 +1,32 @@
+"""
+Name: check_rollups.py
+Author: Ryan Gascoigne-Jones
+
+Purpose: Management command that checks the hourly and daily wait time
+  rollups of rides match their raw history
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from ...utils.rollups import check_rollups
+
+
+class Command(BaseCommand):
+  help = "Checks wait time rollups against ride history, failing if any "\
+         "differ"
+
+  def add_arguments(self, parser) -> None:
+    parser.add_argument('--park', type=int,
+                        help="Only check the rollups of rides in this park")
+
+  def handle(self, *args, **options) -> None:
+
+    differences: list[str] = check_rollups(park_id=options['park'])
+
+    for difference in differences:
+      self.stdout.write(difference)
+
+    if differences:
+      raise CommandError(f"{len(differences)} rollups differ from ride "\
+                         "history, rebuild them with backfill_rollups")
+
+    self.stdout.write("Rollups match ride history")
@@ -0,0 +1,34 @@
+"""
+Name: fit_forecasts.py
+Author: Ryan Gascoigne-Jones
+
+Purpose: Management command that fits wait time forecasts for every ride
+  in each tracked park from its wait time history
+"""
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+import time
+from ...utils.forecasting import fit_park
+
+
+class Command(BaseCommand):
+  help = "Fits wait time forecasts for the rides of each park in "\
+         "INGESTOR_PARKS"
+
+  def add_arguments(self, parser) -> None:
+    parser.add_argument('--park', type=int, action='append', dest='parks',
+                        help="Park to fit instead of INGESTOR_PARKS "\
+                             "(can be repeated)")
+
+  def handle(self, *args, **options) -> None:
+
+    park_ids: list[int] = options['parks'] or list(settings.INGESTOR_PARKS)
+
+    for park_id in park_ids:
+      start: float = time.monotonic()
+
+      num_rides: int = fit_park(park_id=park_id)
+
+      self.stdout.write(f"Fitted {num_rides} rides in park {park_id} in "\
+                        f"{time.monotonic() - start:.2f}s")
@@ -0,0 +1,68 @@
+"""
+Name: flush_subscriptions.py
+Author: Ryan Gascoigne-Jones
+
+Purpose: Management command that writes ride notification subscriptions
+  queued in the local outbox to the remote DB in batches
+"""
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+import logging
+import time
+from ...utils.subscription_outbox import flush_outbox, get_outbox_stats, \
+  retry_dead_subscriptions
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+  help = "Writes queued ride notification subscriptions to the remote DB"
+
+  def add_arguments(self, parser) -> None:
+    parser.add_argument('--once', action='store_true',
+                        help="Flush the outbox until it is empty and exit")
+    parser.add_argument('--interval', type=float,
+                        help="Seconds to wait when the outbox is empty")
+    parser.add_argument('--batch-size', type=int,
+                        help="Maximum subscriptions written in one update")
+    parser.add_argument('--retry-dead', action='store_true',
+                        help="Requeue subscriptions which reached "\
+                             "SUBSCRIPTION_OUTBOX_MAX_ATTEMPTS and exit")
+
+  def handle(self, *args, **options) -> None:
+
+    if options['retry_dead']:
+      requeued: int = retry_dead_subscriptions()
+      logger.info(f"Requeued {requeued} subscriptions")
+      return
+
+    interval: float = options['interval'] or \
+                      settings.SUBSCRIPTION_OUTBOX_INTERVAL
+    batch_size: int = options['batch_size'] or \
+                      settings.SUBSCRIPTION_OUTBOX_BATCH_SIZE
+
+    while True:
+      try:
+        flushed: int = flush_outbox(batch_size=batch_size)
+      except Exception:
+        logger.exception("Flushing subscriptions to the remote DB failed")
+        flushed = 0
+
+        if options['once']:
+          return
+      else:
+        if flushed:
+          stats: dict[str, float] = get_outbox_stats()
+          logger.info(f"Flushed {flushed} subscriptions in "\
+                      f"{stats['last_flush_seconds']:.2f}s, "\
+                      f"{stats['depth']} waiting, {stats['dead']} given up")
+
+      # Keeps flushing while there are full batches waiting
+      if flushed == batch_size:
+        continue
+
+      if options['once']:
+        return
+
+      time.sleep(interval)
@@ -0,0 +1,53 @@
+"""
+Name: import_subscriptions.py
+Author: Ryan Gascoigne-Jones
+
+Purpose: Management command that adds the subscribers of each ride
+  notification in the remote DB to the local subscription index
+"""
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from ...models import Ride, Subscription
+from ...utils.firebase_access import get_db, get_notif_db_url, \
+  iterate_children
+
+
+class Command(BaseCommand):
+  help = "Adds subscribers in the remote DB to the local subscription index"
+
+  def handle(self, *args, **options) -> None:
+
+    notifications = get_db().reference(get_notif_db_url()).get()
+
+    users: dict[str, int] = {
+      email.strip().lower(): user_id for user_id, email
+      in get_user_model().objects.values_list('id', 'email')
+    }
+    ride_ids: set[int] = set(Ride.objects.values_list('id', flat=True))
+
+    subscriptions: list[Subscription] = []
+    unknown: int = 0
+
+    for park_id, rides in iterate_children(notifications):
+      for ride_id, ride_notif in iterate_children(rides):
+        subscribers: dict = ride_notif.get('subscribers') or {}
+
+        for user_email in subscribers.values():
+          user_id = users.get(user_email.strip().lower())
+
+          # Subscribers without an account or rides that haven't been
+          # ingested can't be indexed
+          if user_id is None or int(ride_id) not in ride_ids:
+            unknown += 1
+            continue
+
+          subscriptions.append(Subscription(user_id=user_id,
+                                            park_id=int(park_id),
+                                            ride_id=int(ride_id)))
+
+    # Subscriptions already in the index are left as they are
+    Subscription.objects.bulk_create(subscriptions, ignore_conflicts=True)
+
+    self.stdout.write(f"Indexed {len(subscriptions)} subscriptions, "\
+                      f"skipped {unknown}")
@@ -0,0 +1,33 @@
+"""
+Name: migrate_email_lists.py
+Author: Ryan Gascoigne-Jones
+
+Purpose: Management command that converts the user_emails list of each
+  ride notification in the remote DB to keyed subscribers
+"""
+
+from django.core.management.base import BaseCommand
+from ...utils.firebase_access import convert_email_lists, get_notif_db_url, \
+  get_db
+
+
+class Command(BaseCommand):
+  help = "Moves user_emails lists in the remote DB to keyed subscribers"
+
+  def add_arguments(self, parser) -> None:
+    parser.add_argument('--dry-run', action='store_true',
+                        help="Show the number of paths that would be "\
+                             "written without writing them")
+
+  def handle(self, *args, **options) -> None:
+
+    ref = get_db().reference(get_notif_db_url())
+
+    update: dict = convert_email_lists(notifications=ref.get())
+
+    if not options['dry_run'] and update:
+      # Every ride is converted in a single atomic multi-path update
+      ref.update(update)
+
+    self.stdout.write(f"{'Would write' if options['dry_run'] else 'Wrote'} "\
+                      f"{len(update)} paths")
@@ -0,0 +1,95 @@
+"""
+Name: run_ingestor.py
+Author: Ryan Gascoigne-Jones
+
+Purpose: Management command that polls queue-times.com for each tracked
+  park and saves the ride data to the local DB, so that views only have
+  to read from the local DB
+"""
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+import logging
+import time
+from typing import Optional
+from ...utils.ingestion import IngestResult, ParkIngestor
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+  help = "Polls queue-times.com for each park in INGESTOR_PARKS and saves "\
+         "the ride data to the local DB"
+
+  def add_arguments(self, parser) -> None:
+    parser.add_argument('--park', type=int, action='append', dest='parks',
+                        help="Park to poll instead of INGESTOR_PARKS "\
+                             "(can be repeated)")
+    parser.add_argument('--interval', type=int,
+                        help="Poll interval in seconds for parks passed "\
+                             "with --park")
+    parser.add_argument('--once', action='store_true',
+                        help="Poll each park once and exit")
+    parser.add_argument('--workers', type=int,
+                        help="Maximum number of parks polled at once")
+
+  def handle(self, *args, **options) -> None:
+
+    poll_intervals: dict[int, int] = get_poll_intervals(
+      parks=options['parks'], interval=options['interval'])
+
+    # Monotonic time each park is next due to be polled
+    next_poll: dict[int, float] = {park_id: 0.0 for park_id in poll_intervals}
+
+    max_workers: int = options['workers'] or settings.INGESTOR_MAX_WORKERS
+
+    # One pool for every poll, so a park that timed out still holds its
+    # worker and isn't polled again until it finishes
+    ingestor: ParkIngestor = ParkIngestor(max_workers=max_workers)
+
+    try:
+      while True:
+        now: float = time.monotonic()
+
+        due_parks: list[int] = [park_id for park_id, due in next_poll.items()
+                                if due <= now]
+
+        # Polls every due park concurrently
+        results: list[IngestResult] = ingestor.ingest(
+          park_ids=due_parks,
+          timeout=settings.INGESTOR_PARK_TIMEOUT)
+
+        for result in results:
+          next_poll[result.park_id] = now + poll_intervals[result.park_id]
+          log_result(result=result)
+
+        if options['once']:
+          return
+
+        # Sleeps until the next park is due
+        time.sleep(max(0.0, min(next_poll.values()) - time.monotonic()))
+    finally:
+      ingestor.shutdown()
+
+def get_poll_intervals(parks: Optional[list[int]],
+                       interval: Optional[int]) -> dict[int, int]:
+  """Produces the poll interval in seconds for each park to ingest"""
+
+  if not parks:
+    return dict(settings.INGESTOR_PARKS)
+
+  default_interval: int = interval or settings.INGESTOR_DEFAULT_INTERVAL
+
+  return {park_id: default_interval for park_id in parks}
+
+
+def log_result(result: IngestResult) -> None:
+  """Logs the wall time and outcome of ingesting a park"""
+
+  if result.error is None:
+    logger.info(f"Ingested park {result.park_id}: "\
+                f"{len(result.categories or [])} categories in "\
+                f"{result.duration:.2f}s")
+  else:
+    logger.warning(f"Failed to ingest park {result.park_id} in "\
+                   f"{result.duration:.2f}s: {result.error}")
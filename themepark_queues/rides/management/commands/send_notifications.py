@@ -0,0 +1,69 @@
+"""
+Name: send_notifications.py
+Author: Ryan Gascoigne-Jones
+
+Purpose: Management command that sends queued ride reopening notifications
+  in batches with the sender set by NOTIFICATION_SENDER
+"""
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+import logging
+import time
+from ...utils.notifications import drain_notifications, \
+  get_notification_stats, retry_dead_notifications
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+  help = "Sends queued ride reopening notifications"
+
+  def add_arguments(self, parser) -> None:
+    parser.add_argument('--once', action='store_true',
+                        help="Send queued notifications until there are "\
+                             "none left and exit")
+    parser.add_argument('--interval', type=float,
+                        help="Seconds to wait when no notifications are "\
+                             "queued")
+    parser.add_argument('--batch-size', type=int,
+                        help="Maximum notifications sent in one batch")
+    parser.add_argument('--retry-dead', action='store_true',
+                        help="Requeue notifications which reached "\
+                             "NOTIFICATION_MAX_ATTEMPTS and exit")
+
+  def handle(self, *args, **options) -> None:
+
+    if options['retry_dead']:
+      requeued: int = retry_dead_notifications()
+      logger.info(f"Requeued {requeued} notifications")
+      return
+
+    interval: float = options['interval'] or settings.NOTIFICATION_INTERVAL
+    batch_size: int = options['batch_size'] or \
+                      settings.NOTIFICATION_BATCH_SIZE
+
+    while True:
+      try:
+        sent: int = drain_notifications(batch_size=batch_size)
+      except Exception:
+        logger.exception("Sending notifications failed")
+        sent = 0
+
+        if options['once']:
+          return
+      else:
+        if sent:
+          stats: dict[str, float] = get_notification_stats()
+          logger.info(f"Sent {sent} notifications in "\
+                      f"{stats['last_send_seconds']:.2f}s, "\
+                      f"{stats['depth']} waiting, {stats['dead']} given up")
+
+      # Keeps sending while there are full batches waiting
+      if sent == batch_size:
+        continue
+
+      if options['once']:
+        return
+
+      time.sleep(interval)
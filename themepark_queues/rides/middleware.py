@@ -0,0 +1,137 @@
+"""
+Name: middleware.py
+Author: Ryan Gascoigne-Jones
+
+Purpose: Contains middleware which records the latency of every view in
+  the metrics and times a sample of requests, sending the duration and DB
+  queries of each stage in a Server-Timing header and a structured log line
+"""
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connection
+from django.http import HttpRequest
+from django.http.response import HttpResponseBase
+import json
+import logging
+import random
+import time
+from .utils.metrics import inc, observe
+from .utils.timing import RequestTimings, request_timings
+
+logger = logging.getLogger(__name__)
+
+
+class MetricsMiddleware:
+  """Records the latency and status of every response by URL name"""
+
+  sync_capable = True
+  async_capable = True
+
+  def __init__(self, get_response) -> None:
+    self.get_response = get_response
+
+    if iscoroutinefunction(self.get_response):
+      markcoroutinefunction(self)
+
+  def __call__(self, request: HttpRequest):
+    if iscoroutinefunction(self):
+      return self.__acall__(request)
+
+    start: float = time.perf_counter()
+    response: HttpResponseBase = self.get_response(request)
+    record_view(request=request, response=response, start=start)
+
+    return response
+
+  async def __acall__(self, request: HttpRequest) -> HttpResponseBase:
+    # Streamed responses are recorded when they start rather than finish
+    start: float = time.perf_counter()
+    response: HttpResponseBase = await self.get_response(request)
+    record_view(request=request, response=response, start=start)
+
+    return response
+
+
+def record_view(request: HttpRequest, response: HttpResponseBase,
+                start: float) -> None:
+  # Unresolved paths share a label so scanners can't add series
+  view: str = (request.resolver_match.url_name or 'unnamed') \
+              if request.resolver_match is not None else 'unresolved'
+
+  observe('themepark_view_seconds', time.perf_counter() - start, view=view)
+  inc('themepark_view_responses_total', view=view,
+      status=f"{response.status_code // 100}xx")
+
+
+class ServerTimingMiddleware:
+  """Times SERVER_TIMING_SAMPLE_RATE of requests. Requests that aren't
+  sampled only cost a random number"""
+
+  sync_capable = True
+  async_capable = True
+
+  def __init__(self, get_response) -> None:
+    self.get_response = get_response
+
+    if iscoroutinefunction(self.get_response):
+      markcoroutinefunction(self)
+
+  def __call__(self, request: HttpRequest):
+    if iscoroutinefunction(self):
+      return self.__acall__(request)
+
+    if not is_sampled():
+      return self.get_response(request)
+
+    timings: RequestTimings = RequestTimings()
+    token = request_timings.set(timings)
+
+    try:
+      with connection.execute_wrapper(timings.count_query):
+        response: HttpResponseBase = self.get_response(request)
+    finally:
+      request_timings.reset(token)
+
+    finish(request=request, response=response, timings=timings)
+
+    return response
+
+  async def __acall__(self, request: HttpRequest) -> HttpResponseBase:
+    if not is_sampled():
+      return await self.get_response(request)
+
+    # Queries of async views run in other threads, so only stages are
+    # timed
+    timings: RequestTimings = RequestTimings()
+    token = request_timings.set(timings)
+
+    try:
+      response: HttpResponseBase = await self.get_response(request)
+    finally:
+      request_timings.reset(token)
+
+    finish(request=request, response=response, timings=timings)
+
+    return response
+
+
+def is_sampled() -> bool:
+  """Decides whether a request is timed"""
+
+  return random.random() < settings.SERVER_TIMING_SAMPLE_RATE
+
+
+def finish(request: HttpRequest, response: HttpResponseBase,
+           timings: RequestTimings) -> None:
+  """Adds the Server-Timing header to the response and logs the timings"""
+
+  response['Server-Timing'] = timings.get_server_timing()
+
+  logger.info(json.dumps({
+    'event': 'request_timing',
+    'method': request.method,
+    'path': request.path,
+    'status': response.status_code,
+    **timings.as_dict()
+  }))
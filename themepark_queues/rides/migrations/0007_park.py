@@ -0,0 +1,26 @@
+# Generated by Django 4.2.15 on 2026-10-18 15:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rides", "0006_rename_type_ride_category"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Park",
+            fields=[
+                ("id", models.IntegerField(primary_key=True, serialize=False)),
+                ("categories", models.JSONField(default=list)),
+                ("last_ingested", models.DateTimeField(null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="ride",
+            name="park_id",
+            field=models.IntegerField(default=1),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.15 on 2026-10-18 15:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rides", "0007_park"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="park",
+            name="version",
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 4.2.15 on 2026-10-18 15:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def create_timestamp_brin_index(apps, schema_editor):
+    """Adds a BRIN index on timestamp on Postgres. Samples are appended in
+    time order, so it serves time range scans across all rides at a tiny
+    fraction of the size and insert cost of a btree"""
+
+    if schema_editor.connection.vendor != "postgresql":
+        return
+
+    schema_editor.execute(
+        "CREATE INDEX rides_ridewaitsample_timestamp_brin "
+        "ON rides_ridewaitsample USING brin (timestamp)"
+    )
+
+
+def drop_timestamp_brin_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+
+    schema_editor.execute("DROP INDEX IF EXISTS rides_ridewaitsample_timestamp_brin")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rides", "0008_park_version"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RideWaitSample",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("timestamp", models.DateTimeField()),
+                ("wait_time", models.PositiveSmallIntegerField()),
+                ("open_state", models.BooleanField()),
+                (
+                    "ride",
+                    models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="samples",
+                        to="rides.ride",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="ridewaitsample",
+            constraint=models.UniqueConstraint(
+                fields=("ride", "timestamp"), name="unique_ride_sample_timestamp"
+            ),
+        ),
+        migrations.RunPython(create_timestamp_brin_index, drop_timestamp_brin_index),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.15 on 2026-10-18 15:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rides", "0009_ridewaitsample"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SubscriptionOutbox",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("park_id", models.IntegerField()),
+                ("ride_id", models.IntegerField()),
+                ("ride_name", models.CharField(max_length=255)),
+                ("user_email", models.EmailField(max_length=254)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("attempts", models.PositiveSmallIntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.15 on 2026-10-18 15:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rides", "0011_subscription"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="NotificationJob",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("park_id", models.IntegerField()),
+                ("user_email", models.EmailField(max_length=254)),
+                ("rides", models.JSONField(default=list)),
+                ("reopened_at", models.DateTimeField()),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("attempts", models.PositiveSmallIntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.15 on 2026-10-18 15:51
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rides", "0012_notificationjob"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RideForecast",
+            fields=[
+                (
+                    "ride",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="forecast",
+                        serialize=False,
+                        to="rides.ride",
+                    ),
+                ),
+                ("fitted_at", models.DateTimeField()),
+                ("waits", models.JSONField(default=list)),
+            ],
+        ),
+    ]
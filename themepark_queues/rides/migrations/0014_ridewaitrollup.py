@@ -0,0 +1,57 @@
+# Generated by Django 4.2.15 on 2026-10-18 15:54
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rides", "0013_rideforecast"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RideWaitRollup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "period",
+                    models.CharField(
+                        choices=[("hour", "Hour"), ("day", "Day")], max_length=4
+                    ),
+                ),
+                ("start", models.DateTimeField()),
+                ("samples", models.PositiveIntegerField(default=0)),
+                ("open_samples", models.PositiveIntegerField(default=0)),
+                ("wait_sum", models.PositiveIntegerField(default=0)),
+                ("min_wait", models.PositiveSmallIntegerField(null=True)),
+                ("max_wait", models.PositiveSmallIntegerField(null=True)),
+                ("histogram", models.JSONField(default=dict)),
+                (
+                    "ride",
+                    models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="rollups",
+                        to="rides.ride",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="ridewaitrollup",
+            constraint=models.UniqueConstraint(
+                fields=("ride", "period", "start"),
+                name="unique_ride_rollup_period_start",
+            ),
+        ),
+    ]
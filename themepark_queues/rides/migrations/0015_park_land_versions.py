@@ -0,0 +1,18 @@
+# Generated by Django 4.2.15 on 2026-10-18 16:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rides", "0014_ridewaitrollup"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="park",
+            name="land_versions",
+            field=models.JSONField(default=dict),
+        ),
+    ]
@@ -1,8 +1,14 @@
+from django.conf import settings
 from django.db import models
+from django.utils.dateparse import parse_datetime
+from datetime import datetime
+import math
+from typing import Optional
 
 class Ride(models.Model):
 
   id = models.IntegerField(primary_key = True)
+  park_id = models.IntegerField(default = 1)
   name = models.CharField(max_length = 255)
   category = models.CharField(max_length = 255)
   open_state = models.BooleanField()
@@ -12,3 +18,202 @@ class Ride(models.Model):
   def __str__(self) -> str:
     return self.name
 
+
+class Park(models.Model):
+  """Snapshot metadata for a park kept up to date by the ingestor"""
+
+  id = models.IntegerField(primary_key = True)
+  # Ride categories/lands in the order they are returned by the API
+  categories = models.JSONField(default = list)
+  last_ingested = models.DateTimeField(null = True)
+  # Incremented each time a new snapshot of the park is ingested
+  version = models.PositiveIntegerField(default = 0)
+  # Version of each category/land, incremented only when a snapshot changes
+  # its rides so its cached table can be kept
+  land_versions = models.JSONField(default = dict)
+
+  def __str__(self) -> str:
+    return f"Park {self.id}"
+
+
+class RideWaitSample(models.Model):
+  """Wait time and state of a ride at a point in time. Appended each time
+  a ride is ingested so wait time history is kept"""
+
+  # The unique (ride, timestamp) index also covers lookups by ride
+  ride = models.ForeignKey(Ride, on_delete = models.CASCADE,
+                           related_name = 'samples', db_index = False)
+  timestamp = models.DateTimeField()
+  wait_time = models.PositiveSmallIntegerField()
+  open_state = models.BooleanField()
+
+  class Meta:
+    constraints = [
+      # Serves range scans of a ride's history and stops the same sample
+      # being recorded twice
+      models.UniqueConstraint(fields = ['ride', 'timestamp'],
+                              name = 'unique_ride_sample_timestamp')
+    ]
+
+  def __str__(self) -> str:
+    return f"{self.ride_id} at {self.timestamp}"
+
+
+class RideWaitRollup(models.Model):
+  """Aggregate of a ride's wait time samples over an hour or a day. Kept
+  up to date as samples are ingested so history isn't scanned to read it"""
+
+  HOUR = 'hour'
+  DAY = 'day'
+  PERIOD_CHOICES = [(HOUR, 'Hour'), (DAY, 'Day')]
+
+  # The unique (ride, period, start) index also covers lookups by ride
+  ride = models.ForeignKey(Ride, on_delete = models.CASCADE,
+                           related_name = 'rollups', db_index = False)
+  period = models.CharField(max_length = 4, choices = PERIOD_CHOICES)
+  start = models.DateTimeField()
+  samples = models.PositiveIntegerField(default = 0)
+  # Wait times are only aggregated over samples where the ride was open
+  open_samples = models.PositiveIntegerField(default = 0)
+  wait_sum = models.PositiveIntegerField(default = 0)
+  min_wait = models.PositiveSmallIntegerField(null = True)
+  max_wait = models.PositiveSmallIntegerField(null = True)
+  # Number of open samples with each wait time, which percentiles are
+  # read from
+  histogram = models.JSONField(default = dict)
+
+  class Meta:
+    constraints = [
+      models.UniqueConstraint(fields = ['ride', 'period', 'start'],
+                              name = 'unique_ride_rollup_period_start')
+    ]
+
+  @property
+  def mean_wait(self) -> Optional[float]:
+    """Mean wait time while the ride was open"""
+
+    if not self.open_samples:
+      return None
+
+    return self.wait_sum / self.open_samples
+
+  @property
+  def open_fraction(self) -> float:
+    """Fraction of samples where the ride was open"""
+
+    if not self.samples:
+      return 0.0
+
+    return self.open_samples / self.samples
+
+  def get_percentile(self, percentile: float) -> Optional[int]:
+    """Produces the wait time at the given percentile (0-100) while the
+    ride was open, using the nearest rank"""
+
+    if not self.open_samples:
+      return None
+
+    rank: int = max(1, math.ceil(percentile / 100 * self.open_samples))
+
+    seen: int = 0
+    for wait_time in sorted(self.histogram, key=int):
+      seen += self.histogram[wait_time]
+      if seen >= rank:
+        return int(wait_time)
+
+    return self.max_wait
+
+  def __str__(self) -> str:
+    return f"{self.ride_id} {self.period} at {self.start}"
+
+
+class SubscriptionOutbox(models.Model):
+  """Subscription to a ride's reopening notifications waiting to be
+  written to the remote DB by the flush_subscriptions worker"""
+
+  park_id = models.IntegerField()
+  ride_id = models.IntegerField()
+  ride_name = models.CharField(max_length = 255)
+  user_email = models.EmailField()
+  created_at = models.DateTimeField(auto_now_add = True)
+  # Failed flushes of this row, which is retried until it is written or
+  # reaches SUBSCRIPTION_OUTBOX_MAX_ATTEMPTS
+  attempts = models.PositiveSmallIntegerField(default = 0)
+
+  def __str__(self) -> str:
+    return f"{self.user_email} for {self.ride_id}"
+
+
+class Subscription(models.Model):
+  """User subscribed to notifications of a ride reopening. The local index
+  of the subscribers held in the remote DB"""
+
+  # The unique (user, park_id, ride) index also covers lookups by user
+  user = models.ForeignKey(settings.AUTH_USER_MODEL,
+                           on_delete = models.CASCADE,
+                           related_name = 'subscriptions', db_index = False)
+  park_id = models.IntegerField()
+  ride = models.ForeignKey(Ride, on_delete = models.CASCADE,
+                           related_name = 'subscriptions', db_index = False)
+  created_at = models.DateTimeField(auto_now_add = True)
+
+  class Meta:
+    constraints = [
+      models.UniqueConstraint(fields = ['user', 'park_id', 'ride'],
+                              name = 'unique_user_ride_subscription')
+    ]
+    indexes = [
+      # Finds the subscribers of rides in a park
+      models.Index(fields = ['park_id', 'ride'],
+                   name = 'subscription_park_ride_idx')
+    ]
+
+  def __str__(self) -> str:
+    return f"{self.user_id} for {self.ride_id}"
+
+
+class NotificationJob(models.Model):
+  """Notification to a subscriber of the rides in a park that reopened in
+  one ingested snapshot, waiting to be sent by the send_notifications
+  worker"""
+
+  park_id = models.IntegerField()
+  user_email = models.EmailField()
+  # Reopened rides as {'ride_id', 'ride_name'}
+  rides = models.JSONField(default = list)
+  # Earliest upstream last_updated of the reopened rides
+  reopened_at = models.DateTimeField()
+  created_at = models.DateTimeField(auto_now_add = True)
+  # Failed sends of this job, which is retried until it is sent or
+  # reaches NOTIFICATION_MAX_ATTEMPTS
+  attempts = models.PositiveSmallIntegerField(default = 0)
+
+  def __str__(self) -> str:
+    return f"{self.user_email} for park {self.park_id}"
+
+
+class RideForecast(models.Model):
+  """Forecast wait times of a ride for the next few hours, replaced each
+  time the fit_forecasts command is run"""
+
+  ride = models.OneToOneField(Ride, on_delete = models.CASCADE,
+                              primary_key = True,
+                              related_name = 'forecast')
+  fitted_at = models.DateTimeField()
+  # Forecast steps as {'time': ISO 8601 time, 'wait_time': minutes}
+  waits = models.JSONField(default = list)
+
+  def get_upcoming_waits(self, now: datetime) -> list[dict]:
+    """Produces the forecast steps after now with their times parsed"""
+
+    upcoming: list[dict] = []
+
+    for step in self.waits:
+      time: datetime = parse_datetime(step['time']) # type: ignore
+      if time > now:
+        upcoming.append({'time': time, 'wait_time': step['wait_time']})
+
+    return upcoming
+
+  def __str__(self) -> str:
+    return f"{self.ride_id} at {self.fitted_at}"
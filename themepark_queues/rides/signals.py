@@ -0,0 +1,32 @@
+"""
+Name: signals.py
+Author: Ryan Gascoigne-Jones
+
+Purpose: Contains signals sent when ingested ride data changes, so other
+  parts of the app can react to changes without polling the DB
+"""
+
+from datetime import datetime
+from django.dispatch import Signal
+from typing import NamedTuple, Optional
+
+
+class RideChange(NamedTuple):
+  """A ride whose data changed in an ingested snapshot. The old values
+  are None for a ride that wasn't stored before"""
+
+  ride_id: int
+  park_id: int
+  name: str
+  category: str
+  old_wait_time: Optional[int]
+  wait_time: int
+  old_open_state: Optional[bool]
+  open_state: bool
+  last_updated: datetime
+  old_category: Optional[str] = None
+
+
+# Sent once the changed rides of a park have been committed, with the
+# park_id and the list of RideChange as changes
+rides_changed = Signal()
@@ -6,10 +6,18 @@ Purpose: Tests api_request.py file for requesting queue data from
   queue-times.com
 """
 
-from django.test import TestCase
-from ..models import Ride
+from django.test import TestCase, override_settings
+import requests
+import json
+from ..models import Ride, Park, RideWaitSample
 from unittest.mock import patch, MagicMock
-from ..utils.api_request import get_rides, create_rides, compile_rides_list
+from django.utils import timezone
+from datetime import timedelta
+from ..utils.api_request import get_rides, create_rides, compile_rides_list, \
+  save_queue_data, get_queue_data, get_session, create_session, \
+  forget_validators, remember_validators, get_fetch_stats, save_rides, \
+  RidesResponse
+from ..signals import rides_changed
 
 
 class GetRidesTest(TestCase):
@@ -46,14 +54,17 @@ class GetRidesTest(TestCase):
       ]
     }
 
-  @patch('rides.utils.api_request.requests.get') # Mocks the GET request
-  def test_get_rides(self, mock_get):
+  @patch('rides.utils.api_request.get_session') # Mocks the shared session
+  def test_get_rides(self, mock_get_session):
     """Tests the function gets the list of rides in the correct format
     and doesn't distort them from the data retrieved from the API"""
 
-    # Mocks the response object returned by requests.get
+    # Mocks the response object returned by the session's get
+    mock_get = mock_get_session.return_value.get
     mock_response = MagicMock()
     mock_response.json.return_value = self.mock_response_data
+    mock_response.content = json.dumps(self.mock_response_data).encode()
+    mock_response.headers = {}
     mock_get.return_value = mock_response
 
     # Calls the function
@@ -88,10 +99,160 @@ class GetRidesTest(TestCase):
     ]
 
     # Checks the result is as expected
-    self.assertEqual(result, expected_result)
+    self.assertEqual(result.lands, expected_result)
 
     # Checks the correct URL was called
-    mock_get.assert_called_once_with("https://queue-times.com/parks/1/queue_times.json")
+    self.assertEqual(mock_get.call_args.args,
+                     ("https://queue-times.com/parks/1/queue_times.json",))
+
+  @override_settings(QUEUE_TIMES_CONNECT_TIMEOUT=2,
+                     QUEUE_TIMES_READ_TIMEOUT=5)
+  @patch('rides.utils.api_request.get_session')
+  def test_get_rides_timeout(self, mock_get_session):
+    """Tests requests are sent with connect and read timeouts"""
+
+    mock_response = mock_get_session.return_value.get.return_value
+    mock_response.json.return_value = self.mock_response_data
+    mock_response.content = json.dumps(self.mock_response_data).encode()
+
+    get_rides(park_id=1)
+
+    self.assertEqual(
+      mock_get_session.return_value.get.call_args.kwargs['timeout'], (2, 5))
+
+  @patch('rides.utils.api_request.get_session')
+  def test_get_rides_error_status(self, mock_get_session):
+    """Tests an error response still failing after retries raises"""
+
+    mock_get_session.return_value.get.return_value.raise_for_status\
+      .side_effect = requests.HTTPError("503 Server Error")
+
+    with self.assertRaises(requests.HTTPError):
+      get_rides(park_id=1)
+
+
+class GetRidesConditionalTest(TestCase):
+
+  def setUp(self):
+    """Forgets validators from other tests and sets up a response body"""
+
+    forget_validators(park_id=1)
+    self.body = {'lands': [{'name': 'Family', 'rides': []}]}
+
+  def make_response(self, status_code=200, headers=None):
+    """Produces a mock response from queue-times.com"""
+
+    mock_response = MagicMock()
+    mock_response.status_code = status_code
+    mock_response.headers = headers or {}
+    mock_response.content = json.dumps(self.body).encode()
+    mock_response.json.return_value = self.body
+
+    return mock_response
+
+  @patch('rides.utils.api_request.get_session')
+  def test_get_rides_not_modified(self, mock_get_session):
+    """Tests the last response's validators are sent and a 304 response
+    returns None"""
+
+    mock_get = mock_get_session.return_value.get
+    mock_get.side_effect = [
+      self.make_response(headers={'ETag': '"v1"',
+                                  'Last-Modified': 'Thu, 12 Sep 2024'}),
+      self.make_response(status_code=304)
+    ]
+    not_modified = get_fetch_stats()['not_modified']
+
+    response = get_rides(park_id=1, conditional=True)
+    self.assertEqual(response.lands, self.body['lands'])
+    # As if the rides were saved
+    remember_validators(park_id=1, validators=response.validators)
+
+    self.assertIsNone(get_rides(park_id=1, conditional=True))
+
+    self.assertEqual(mock_get.call_args.kwargs['headers'],
+                     {'If-None-Match': '"v1"',
+                      'If-Modified-Since': 'Thu, 12 Sep 2024'})
+    self.assertEqual(get_fetch_stats()['not_modified'], not_modified + 1)
+
+  @patch('rides.utils.api_request.get_session')
+  def test_get_rides_unchanged_body(self, mock_get_session):
+    """Tests an identical body returns None without being parsed"""
+
+    first = self.make_response()
+    second = self.make_response()
+    mock_get_session.return_value.get.side_effect = [first, second]
+    unchanged = get_fetch_stats()['unchanged']
+
+    remember_validators(park_id=1,
+                        validators=get_rides(park_id=1,
+                                             conditional=True).validators)
+
+    self.assertIsNone(get_rides(park_id=1, conditional=True))
+    second.json.assert_not_called()
+
+  @patch('rides.utils.api_request.get_session')
+  def test_get_rides_validators_not_stored(self, mock_get_session):
+    """Tests a response whose rides weren't saved isn't used to skip the
+    next conditional request"""
+
+    mock_get_session.return_value.get.side_effect = [
+      self.make_response(headers={'ETag': '"v1"'}),
+      self.make_response(headers={'ETag': '"v1"'})
+    ]
+
+    get_rides(park_id=1, conditional=True)
+
+    self.assertIsNotNone(get_rides(park_id=1, conditional=True))
+    self.assertEqual(
+      mock_get_session.return_value.get.call_args.kwargs['headers'], {})
+
+  @patch('rides.utils.api_request.get_session')
+  def test_get_rides_error_counted(self, mock_get_session):
+    """Tests failed requests are counted and raised"""
+
+    mock_get_session.return_value.get.side_effect = \
+      requests.ConnectionError()
+    errors = get_fetch_stats()['errors']
+
+    with self.assertRaises(requests.ConnectionError):
+      get_rides(park_id=1)
+
+    self.assertEqual(get_fetch_stats()['errors'], errors + 1)
+
+  @patch('rides.utils.api_request.get_session')
+  def test_get_rides_unconditional(self, mock_get_session):
+    """Tests data is always returned without conditional=True"""
+
+    mock_get_session.return_value.get.side_effect = [
+      self.make_response(headers={'ETag': '"v1"'}),
+      self.make_response(headers={'ETag': '"v1"'})
+    ]
+
+    remember_validators(park_id=1,
+                        validators=get_rides(park_id=1).validators)
+
+    self.assertEqual(get_rides(park_id=1).lands, self.body['lands'])
+    self.assertEqual(
+      mock_get_session.return_value.get.call_args.kwargs['headers'], {})
+
+
+class GetSessionTest(TestCase):
+
+  def test_get_session_shared(self):
+    """Tests the same session is reused so connections are kept alive"""
+
+    self.assertIs(get_session(), get_session())
+
+  @override_settings(QUEUE_TIMES_RETRIES=2)
+  def test_create_session_retries(self):
+    """Tests failed requests are retried a bounded number of times"""
+
+    retry = create_session().get_adapter('https://queue-times.com')\
+                            .max_retries
+
+    self.assertEqual(retry.total, 2)
+    self.assertIn(503, retry.status_forcelist)
 
 
 class CreateRidesTest(TestCase):
@@ -143,8 +304,9 @@ class CreateRidesTest(TestCase):
     # Assert that ride categories are returned correctly
     self.assertEqual(result, ['Family', 'Thrills'])
 
+  @patch('rides.utils.api_request.save_wait_samples')
   @patch('rides.utils.api_request.Ride') # Mocks the Ride model
-  def test_create_rides_rides_created(self, mock_ride):
+  def test_create_rides_rides_created(self, mock_ride, mock_save_wait_samples):
     """Tests the creation of multiple ride objects in DB"""
 
     result = create_rides(park_id=1, rides_lands=self.rides_lands)
@@ -153,11 +315,114 @@ class CreateRidesTest(TestCase):
     # values
     self.assertEqual(mock_ride.call_count, 3)  # 3 rides in total
 
-    # Check that the save method was called for each ride
-    self.assertEqual(mock_ride.return_value.save.call_count, 3)
+    # Check that all rides were saved in a single bulk upsert
+    mock_ride.objects.bulk_create.assert_called_once()
+    self.assertEqual(len(mock_ride.objects.bulk_create.call_args.args[0]), 3)
+    self.assertTrue(
+      mock_ride.objects.bulk_create.call_args.kwargs['update_conflicts'])
+
+  def test_create_rides_updates_existing(self):
+    """Tests that existing rides are updated rather than duplicated"""
+
+    create_rides(park_id=1, rides_lands=self.rides_lands)
+
+    self.rides_lands[0]['rides'][0]['wait_time'] = 45
+    self.rides_lands[0]['rides'][0]['is_open'] = False
+    create_rides(park_id=1, rides_lands=self.rides_lands)
+
+    self.assertEqual(Ride.objects.count(), 3)
+    ride = Ride.objects.get(id=1)
+    self.assertEqual(ride.wait_time, 45)
+    self.assertFalse(ride.open_state)
+
+  def test_create_rides_samples(self):
+    """Tests a wait time sample is recorded for each new update of a
+    ride"""
+
+    create_rides(park_id=1, rides_lands=self.rides_lands)
+    # Polling again before the ride is updated adds no samples
+    create_rides(park_id=1, rides_lands=self.rides_lands)
+    self.assertEqual(RideWaitSample.objects.count(), 3)
+
+    self.rides_lands[0]['rides'][0]['wait_time'] = 45
+    self.rides_lands[0]['rides'][0]['last_updated'] = '2023-09-12T12:05:00Z'
+    create_rides(park_id=1, rides_lands=self.rides_lands)
+
+    samples = RideWaitSample.objects.filter(ride_id=1).order_by('timestamp')
+    self.assertEqual([sample.wait_time for sample in samples], [30, 45])
+
+  def test_create_rides_query_count(self):
+    """Tests the park is written with a constant number of queries"""
+
+    # Select of stored rides, savepoint, ride upsert, select of recorded
+    # samples, sample insert returning the samples inserted, rollup
+    # savepoint, select and upsert, and savepoint releases
+    with self.assertNumQueries(10):
+      create_rides(park_id=1, rides_lands=self.rides_lands)
+
+    # Only the select when nothing has changed
+    with self.assertNumQueries(1):
+      create_rides(park_id=1, rides_lands=self.rides_lands)
+
+  def test_save_rides_changes(self):
+    """Tests only changed rides are written and reported"""
+
+    save_rides(park_id=1, rides_lands=self.rides_lands)
+
+    self.rides_lands[0]['rides'][1]['is_open'] = True
+    self.rides_lands[0]['rides'][1]['wait_time'] = 10
+    self.rides_lands[0]['rides'][1]['last_updated'] = '2023-09-12T12:40:00Z'
+
+    with patch('rides.utils.api_request.Ride.objects.bulk_create',
+               wraps=Ride.objects.bulk_create) as mock_bulk_create:
+      categories, changes = save_rides(park_id=1,
+                                       rides_lands=self.rides_lands)
+
+    self.assertEqual(categories, ['Family', 'Thrills'])
+    self.assertEqual([ride.id for ride in mock_bulk_create.call_args.args[0]],
+                     [2])
+    self.assertEqual(len(changes), 1)
+    self.assertEqual(changes[0].ride_id, 2)
+    self.assertEqual(changes[0].old_open_state, False)
+    self.assertEqual(changes[0].open_state, True)
+    self.assertEqual(changes[0].old_wait_time, 0)
+    self.assertEqual(changes[0].wait_time, 10)
+    self.assertEqual(Ride.objects.get(id=2).wait_time, 10)
+
+  def test_save_rides_new_rides(self):
+    """Tests new rides are reported without old values"""
+
+    _, changes = save_rides(park_id=1, rides_lands=self.rides_lands)
+
+    self.assertEqual([change.ride_id for change in changes], [1, 2, 3])
+    self.assertIsNone(changes[0].old_wait_time)
+    self.assertIsNone(changes[0].old_open_state)
+
+  def test_save_rides_signal(self):
+    """Tests rides_changed is sent with the changes once committed"""
+
+    received = []
 
+    def receiver(sender, park_id, changes, **kwargs):
+      received.append((park_id, changes))
+
+    rides_changed.connect(receiver)
+    self.addCleanup(rides_changed.disconnect, receiver)
+
+    with self.captureOnCommitCallbacks(execute=True):
+      _, changes = save_rides(park_id=1, rides_lands=self.rides_lands)
+
+    self.assertEqual(received, [(1, changes)])
+
+    # Nothing is sent when nothing changed
+    with self.captureOnCommitCallbacks(execute=True):
+      save_rides(park_id=1, rides_lands=self.rides_lands)
+
+    self.assertEqual(len(received), 1)
+
+  @patch('rides.utils.api_request.save_wait_samples')
   @patch('rides.utils.api_request.Ride')
-  def test_create_rides_rides_correct(self, mock_ride):
+  def test_create_rides_rides_correct(self, mock_ride, mock_save_wait_samples):
     """Tests the correctness of created ride objects in DB"""
 
     result = create_rides(park_id=1, rides_lands=self.rides_lands)
@@ -165,6 +430,7 @@ class CreateRidesTest(TestCase):
     # Check the ride's attributes
     mock_ride.assert_any_call(
       id=1,
+      park_id=1,
       name='Family Ride 1',
       category='Family',
       open_state=True,
@@ -173,6 +439,7 @@ class CreateRidesTest(TestCase):
     )
     mock_ride.assert_any_call(
       id=2,
+      park_id=1,
       name='Family Ride 2',
       category='Family',
       open_state=False,
@@ -194,47 +461,242 @@ class CreateRidesTest(TestCase):
 
 class CompileRidesListTest(TestCase):
 
-  @patch('rides.models.Ride.objects.filter')  # Mocks the Ride model's filter method
-  def test_compile_rides_list(self, mock_filter):
+  def setUp(self):
+    """Creates rides in several categories, and a ride in another park"""
+
+    for ride_id, name, category in [(1, 'B Family Ride', 'Family'),
+                                    (2, 'A Family Ride', 'Family'),
+                                    (3, 'Thrill Ride', 'Thrills'),
+                                    (4, 'Water Ride', 'Water')]:
+      Ride.objects.create(id=ride_id, park_id=1, name=name,
+                          category=category, open_state=True, wait_time=10,
+                          last_updated=timezone.now())
+
+    Ride.objects.create(id=5, park_id=2, name='Other Park Ride',
+                        category='Family', open_state=True, wait_time=10,
+                        last_updated=timezone.now())
+
+  def test_compile_rides_list(self):
     """Tests compiling a populated list of rides"""
-    
-    # Mock the queryset that would be returned for each category
-    mock_qs_family = MagicMock()  # Mock queryset for 'Family'
-    mock_qs_thrill = MagicMock()  # Mock queryset for 'Thrills'
-
-    # Mock the order_by call to return the same mock queryset
-    mock_qs_family.order_by.return_value = mock_qs_family
-    mock_qs_thrill.order_by.return_value = mock_qs_thrill
-
-    # Defines what Ride.objects.filter should return (input category)
-    mock_filter.side_effect = [
-        mock_qs_family,
-        mock_qs_thrill
-    ]
 
-    # Calls the function
-    ride_categories = ['Family', 'Thrills']
-    result = compile_rides_list(ride_categories)
+    result = compile_rides_list(['Thrills', 'Family'], park_id=1)
+
+    # Rides are grouped in the order of the categories passed and sorted
+    # by name
+    self.assertEqual([[ride.id for ride in rides] for rides in result],
+                     [[3], [2, 1]])
 
-    # Verify that the filter method was called with the correct arguments
-    mock_filter.assert_any_call(category='Family')
-    mock_filter.assert_any_call(category='Thrills')
+  def test_compile_rides_list_single_query(self):
+    """Tests the number of queries doesn't grow with the categories"""
 
-    # Verify the function returns the expected result (list of querysets)
-    self.assertEqual(result, [mock_qs_family, mock_qs_thrill])
+    with self.assertNumQueries(1):
+      compile_rides_list(['Family', 'Thrills', 'Water'], park_id=1)
 
-  @patch('rides.models.Ride.objects.filter')
-  def test_compile_rides_list_empty(self, mock_filter):
+  def test_compile_rides_list_missing_category(self):
+    """Tests a category without rides has an empty list"""
+
+    result = compile_rides_list(['Family', 'Empty'], park_id=1)
+
+    self.assertEqual(result[1], [])
+
+  def test_compile_rides_list_empty(self):
     """Tests compiling an empty list of rides"""
 
-    # Mock an empty queryset return
-    mock_filter.return_value = MagicMock()
+    # Verify that no query is made and that the result is an empty list
+    with self.assertNumQueries(0):
+      result = compile_rides_list([])
+
+    self.assertEqual(result, [])
+
+
+class SaveQueueDataTest(TestCase):
+
+  def setUp(self):
+    """Forgets the validators of responses in other tests"""
+
+    forget_validators(park_id=1)
+
+  def respond_with(self, mock_get_rides, lands):
+    """Makes the mocked get_rides return lands, which can be changed
+    between polls"""
+
+    mock_get_rides.side_effect = lambda park_id, conditional: RidesResponse(
+      lands=lands, validators={'hash': json.dumps(lands)})
+
+  @patch('rides.utils.api_request.get_rides')
+  def test_save_queue_data_records_park(self, mock_get_rides):
+    """Tests that ingesting a park stores its categories and ingestion
+    time"""
+
+    lands = [
+      {
+        'name': 'Family',
+        'rides': [
+          {
+            'id': 1,
+            'name': 'Family Ride 1',
+            'is_open': True,
+            'wait_time': 30,
+            'last_updated': '2023-09-12T12:00:00Z'
+          }
+        ]
+      }
+    ]
+    self.respond_with(mock_get_rides, lands)
+
+    result = save_queue_data(park_id=1)
+
+    self.assertEqual(result, ['Family'])
+
+    park = Park.objects.get(id=1)
+    self.assertEqual(park.categories, ['Family'])
+    self.assertIsNotNone(park.last_ingested)
+    self.assertEqual(park.version, 1)
+    self.assertEqual(Ride.objects.get(id=1).park_id, 1)
+
+    # Ingesting the same data again keeps the snapshot version
+    save_queue_data(park_id=1)
+    self.assertEqual(Park.objects.get(id=1).version, 1)
+
+    # Changed data is a new snapshot version
+    lands[0]['rides'][0]['wait_time'] = 45
+    save_queue_data(park_id=1)
+    self.assertEqual(Park.objects.get(id=1).version, 2)
+
+  @patch('rides.utils.api_request.get_rides')
+  def test_save_queue_data_land_versions(self, mock_get_rides):
+    """Tests only the lands whose rides changed get a new version, including
+    the land a ride moved out of"""
+
+    def make_ride(ride_id: int, wait_time: int) -> dict:
+      return {'id': ride_id, 'name': f'Ride {ride_id}', 'is_open': True,
+              'wait_time': wait_time, 'last_updated': '2023-09-12T12:00:00Z'}
+
+    self.respond_with(mock_get_rides, [
+      {'name': 'Family', 'rides': [make_ride(1, 10)]},
+      {'name': 'Thrills', 'rides': [make_ride(2, 20)]},
+      {'name': 'Water', 'rides': [make_ride(3, 30)]}
+    ])
+    save_queue_data(park_id=1)
+    self.assertEqual(Park.objects.get(id=1).land_versions,
+                     {'Family': 1, 'Thrills': 1, 'Water': 1})
+
+    # Ride 1 changes and ride 2 moves from Thrills to Water
+    lands = [
+      {'name': 'Family', 'rides': [make_ride(1, 15)]},
+      {'name': 'Thrills', 'rides': []},
+      {'name': 'Water', 'rides': [make_ride(2, 20), make_ride(3, 30)]}
+    ]
+    self.respond_with(mock_get_rides, lands)
+    save_queue_data(park_id=1)
+    self.assertEqual(Park.objects.get(id=1).land_versions,
+                     {'Family': 2, 'Thrills': 2, 'Water': 2})
+
+    # Only Water changes
+    lands[2]['rides'][1]['wait_time'] = 35
+    save_queue_data(park_id=1)
+    self.assertEqual(Park.objects.get(id=1).land_versions,
+                     {'Family': 2, 'Thrills': 2, 'Water': 3})
+
+
+  @patch('rides.utils.api_request.save_rides')
+  @patch('rides.utils.api_request.get_rides')
+  def test_save_queue_data_unchanged(self, mock_get_rides,
+                                     mock_save_rides):
+    """Tests nothing is written when the park's data is unchanged"""
+
+    last_ingested = timezone.now() - timedelta(minutes=5)
+    Park.objects.create(id=1, categories=['Family'],
+                        last_ingested=last_ingested, version=3)
+    mock_get_rides.return_value = None
+
+    result = save_queue_data(park_id=1)
+
+    mock_get_rides.assert_called_once_with(park_id=1, conditional=True)
+    mock_save_rides.assert_not_called()
+    self.assertEqual(result, ['Family'])
+
+    park = Park.objects.get(id=1)
+    self.assertEqual(park.version, 3)
+    self.assertGreater(park.last_ingested, last_ingested)
+
+  @patch('rides.utils.api_request.remember_validators')
+  @patch('rides.utils.api_request.save_rides')
+  @patch('rides.utils.api_request.get_rides')
+  def test_save_queue_data_failure(self, mock_get_rides, mock_save_rides,
+                                   mock_remember_validators):
+    """Tests data which failed to save isn't later skipped as unchanged"""
+
+    self.respond_with(mock_get_rides, [])
+    mock_save_rides.side_effect = Exception("DB error")
+
+    with self.captureOnCommitCallbacks(execute=True):
+      with self.assertRaises(Exception):
+        save_queue_data(park_id=1)
+
+    mock_remember_validators.assert_not_called()
+
+  @patch('rides.utils.api_request.get_session')
+  def test_save_queue_data_after_unsaved_fetch(self, mock_get_session):
+    """Tests data fetched without being saved, e.g. by a benchmark or a
+    shell, doesn't stop the next ingestion saving the same data"""
+
+    def make_response(wait_time):
+      body = {'lands': [{'name': 'Family', 'rides': [
+        {'id': 1, 'name': 'Family Ride 1', 'is_open': True,
+         'wait_time': wait_time, 'last_updated': '2023-09-12T12:00:00Z'}]}]}
+      mock_response = MagicMock()
+      mock_response.status_code = 200
+      mock_response.headers = {'ETag': f'"{wait_time}"'}
+      mock_response.content = json.dumps(body).encode()
+      mock_response.json.return_value = body
+      return mock_response
+
+    mock_get_session.return_value.get.side_effect = [
+      make_response(5), make_response(10), make_response(10),
+      make_response(10)]
+
+    with self.captureOnCommitCallbacks(execute=True):
+      save_queue_data(park_id=1)
+
+    # The upstream changes and is fetched, but not saved
+    get_rides(park_id=1)
+
+    with self.captureOnCommitCallbacks(execute=True):
+      save_queue_data(park_id=1)
+
+    self.assertEqual(Ride.objects.get(id=1).wait_time, 10)
+
+    # Once saved, the same data is skipped as unchanged
+    with self.captureOnCommitCallbacks(execute=True):
+      save_queue_data(park_id=1)
+
+    self.assertEqual(Park.objects.get(id=1).version, 2)
+    self.assertEqual(
+      mock_get_session.return_value.get.call_args.kwargs['headers'],
+      {'If-None-Match': '"10"'})
+
+
+class GetQueueDataTest(TestCase):
+
+  @patch('rides.utils.api_request.get_rides')
+  def test_get_queue_data_reads_local_db(self, mock_get_rides):
+    """Tests that queue data is read from the local DB without requesting
+    it from the API"""
+
+    Park.objects.create(id=1, categories=['Thrills'],
+                        last_ingested=timezone.now())
+    Ride.objects.create(id=1, park_id=1, name='Thrill Ride 1',
+                        category='Thrills', open_state=True, wait_time=20,
+                        last_updated=timezone.now())
+
+    rides, categories = get_queue_data(park_id=1)
 
-    # Call the function with an empty ride category list
-    result = compile_rides_list([])
+    mock_get_rides.assert_not_called()
+    self.assertEqual(categories, ['Thrills'])
+    self.assertEqual([ride.name for ride in rides[0]], ['Thrill Ride 1'])
 
-    # Verify that no filter call was made
-    mock_filter.assert_not_called()
+  def test_get_queue_data_not_ingested(self):
+    """Tests that a park which hasn't been ingested has no rides"""
 
-    # Verify that the result is an empty list
-    self.assertEqual(result, [])
\ No newline at end of file
+    self.assertEqual(get_queue_data(park_id=1), ([], []))
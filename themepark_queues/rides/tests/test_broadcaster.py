@@ -0,0 +1,227 @@
+"""
+Name: test_broadcaster.py
+Author: Ryan Gascoigne-Jones
+
+Purpose: Tests broadcaster.py file for fanning out ride change events to
+  connected clients
+"""
+
+from asgiref.sync import sync_to_async
+import asyncio
+from django.core.cache import caches
+from django.db.models import F
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from unittest.mock import patch
+from ..models import Park, Ride
+from ..signals import rides_changed
+from ..utils.broadcaster import RideChangeBroadcaster, get_snapshot_events, \
+  get_cached_events
+
+
+class RideChangeBroadcasterTest(TestCase):
+
+  def setUp(self):
+    """Sets up rides in two parks"""
+
+    for ride_id, park_id in [(1, 1), (2, 2)]:
+      Park.objects.create(id=park_id, categories=['Family'], version=1)
+      Ride.objects.create(id=ride_id, park_id=park_id,
+                          name=f"Ride {ride_id}", category='Family',
+                          open_state=True, wait_time=10,
+                          last_updated=timezone.now())
+
+    self.broadcaster = RideChangeBroadcaster(poll_interval=0.01,
+                                             queue_size=2)
+
+  def ingest(self, ride_id, wait_time):
+    """Changes a ride's wait time and bumps its park's version, as the
+    ingestor does"""
+
+    ride = Ride.objects.get(id=ride_id)
+    Ride.objects.filter(id=ride_id).update(wait_time=wait_time)
+    Park.objects.filter(id=ride.park_id).update(version=F('version') + 1)
+
+  async def unsubscribe_all(self, queues):
+    """Disconnects every client and waits for the poller to stop"""
+
+    for park_id, queue in queues:
+      self.broadcaster.unsubscribe(park_id=park_id, queue=queue)
+    await asyncio.wait_for(self.broadcaster.task, timeout=1)
+
+  async def test_broadcaster_fan_out(self):
+    """Tests ride changes reach every client of the ride's park only"""
+
+    park_1_queues = [await self.broadcaster.subscribe(park_id=1)
+                     for _ in range(3)]
+    park_2_queue = await self.broadcaster.subscribe(park_id=2)
+
+    # Lets the poller read the state clients connected to
+    await asyncio.sleep(0.05)
+    await sync_to_async(self.ingest)(ride_id=1, wait_time=25)
+
+    for queue in park_1_queues:
+      event = await asyncio.wait_for(queue.get(), timeout=1)
+      self.assertEqual(event['version'], 2)
+      self.assertEqual(event['ride_id'], 1)
+      self.assertEqual(event['wait_time'], 25)
+      self.assertTrue(event['open_state'])
+
+    self.assertTrue(park_2_queue.empty())
+
+    await self.unsubscribe_all([(1, queue) for queue in park_1_queues] +
+                               [(2, park_2_queue)])
+
+  async def test_broadcaster_single_poller(self):
+    """Tests clients connecting at the same time share one poller, which
+    makes one query per poll however many clients connect"""
+
+    with patch('rides.utils.broadcaster.get_park_versions',
+               return_value={}) as mock_get_park_versions:
+      queues = await asyncio.gather(*[self.broadcaster.subscribe(park_id=1)
+                                      for _ in range(50)])
+      task = self.broadcaster.task
+      await asyncio.sleep(0.05)
+
+      self.assertIs(self.broadcaster.task, task)
+      await self.unsubscribe_all([(1, queue) for queue in queues])
+
+    # Roughly one call per poll interval, not one per client
+    self.assertLess(mock_get_park_versions.call_count, 20)
+
+  async def test_broadcaster_only_new_changes(self):
+    """Tests changes from before a client connected aren't published, nor
+    are new versions which didn't change the ride's wait or state"""
+
+    await sync_to_async(self.ingest)(ride_id=1, wait_time=25)
+
+    queue = await self.broadcaster.subscribe(park_id=1)
+    await asyncio.sleep(0.05)
+    await sync_to_async(self.ingest)(ride_id=1, wait_time=25)
+    await asyncio.sleep(0.05)
+
+    self.assertTrue(queue.empty())
+    self.assertEqual(self.broadcaster.versions[1], 3)
+
+    await self.unsubscribe_all([(1, queue)])
+
+  def test_publish_slow_client(self):
+    """Tests a full queue drops its oldest event"""
+
+    queue = asyncio.Queue(maxsize=2)
+    self.broadcaster.subscribers[1] = {queue}
+
+    self.broadcaster.publish([{'park_id': 1, 'version': version}
+                              for version in range(3)])
+
+    self.assertEqual([queue.get_nowait()['version'] for _ in range(2)],
+                     [1, 2])
+
+  def test_get_snapshot_events(self):
+    """Tests every ride is produced with the park's version"""
+
+    version, events = get_snapshot_events(park_id=1)
+
+    self.assertEqual(version, 1)
+    self.assertEqual([(event['ride_id'], event['version'])
+                      for event in events], [(1, 1)])
+
+
+class CachedEventsTest(TestCase):
+
+  def setUp(self):
+    """Sets up a ride in a park and empties the ride events cache"""
+
+    caches['ride_events'].clear()
+    self.addCleanup(caches['ride_events'].clear)
+
+    Park.objects.create(id=1, categories=['Family'], version=1)
+    Ride.objects.create(id=1, park_id=1, name='Ride 1', category='Family',
+                        open_state=True, wait_time=10,
+                        last_updated=timezone.now())
+
+  def test_get_cached_events(self):
+    """Tests every ride is produced only if the park's version is newer,
+    reading the DB only when the park isn't cached"""
+
+    with self.assertNumQueries(2):
+      events = get_cached_events(park_id=1, after_version=0)
+
+    self.assertEqual([(event['ride_id'], event['version'])
+                      for event in events], [(1, 1)])
+
+    with self.assertNumQueries(0):
+      self.assertEqual(get_cached_events(park_id=1, after_version=1), [])
+
+  def test_rides_changed_caches_events(self):
+    """Tests the events are cached again when the park's rides change,
+    so polls don't read the DB"""
+
+    get_cached_events(park_id=1, after_version=0)
+
+    Ride.objects.filter(id=1).update(wait_time=25)
+    Park.objects.filter(id=1).update(version=2)
+    rides_changed.send(sender=None, park_id=1, changes=[])
+
+    with self.assertNumQueries(0):
+      events = get_cached_events(park_id=1, after_version=1)
+
+    self.assertEqual([(event['version'], event['wait_time'])
+                      for event in events], [(2, 25)])
+
+
+class ParkEventsViewTest(TestCase):
+
+  def setUp(self):
+    """Empties the ride events cache"""
+
+    caches['ride_events'].clear()
+    self.addCleanup(caches['ride_events'].clear)
+
+  @override_settings(RIDE_EVENTS_WSGI_RETRY=30)
+  def test_park_events_wsgi(self):
+    """Tests the current rides are sent over WSGI when the park changed
+    since the client's last event, then the response ends"""
+
+    Park.objects.create(id=1, categories=['Family'], version=3)
+    Ride.objects.create(id=1, park_id=1, name='Family Ride',
+                        category='Family', open_state=True, wait_time=20,
+                        last_updated=timezone.now())
+
+    response = self.client.get('/api/parks/1/events')
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(response['Content-Type'], 'text/event-stream')
+
+    content = response.content.decode()
+    self.assertTrue(content.startswith("retry: 30000\n\n"))
+    self.assertIn("id: 3\nevent: ride\ndata: ", content)
+    self.assertIn('"wait_time": 20', content)
+
+    # Nothing changed since the last event the client received
+    response = self.client.get('/api/parks/1/events',
+                               HTTP_LAST_EVENT_ID='3')
+    self.assertNotIn("event: ride", response.content.decode())
+
+  @override_settings(RIDE_EVENTS_RETRY=5)
+  @patch('rides.views.broadcaster')
+  async def test_park_events_stream(self, mock_broadcaster):
+    """Tests events from the broadcaster are streamed to the client"""
+
+    queue = asyncio.Queue()
+    await queue.put({'version': 7, 'park_id': 1, 'ride_id': 1,
+                     'wait_time': 20, 'open_state': True})
+
+    async def subscribe(park_id):
+      return queue
+
+    mock_broadcaster.subscribe.side_effect = subscribe
+
+    response = await self.async_client.get('/api/parks/1/events')
+    self.assertEqual(response['Content-Type'], 'text/event-stream')
+
+    chunks = response.streaming_content.__aiter__()
+    self.assertEqual(await chunks.__anext__(), b"retry: 5000\n\n")
+
+    event = (await chunks.__anext__()).decode()
+    self.assertTrue(event.startswith("id: 7\nevent: ride\ndata: "))
+    self.assertIn('"wait_time": 20', event)
@@ -6,101 +6,191 @@ Purpose: Tests firebase_access.py file for accessing and adding ride
   notifications to the remote DB
 """
 
-from django.test import TestCase
-from unittest.mock import patch, Mock
-from ..utils.firebase_access import add_notif, add_to_email_list, \
-  get_notif_db_url, get_park_url, get_ride_url
+from django.test import TestCase, override_settings
+from django.core.management import call_command
+from django.contrib.auth.models import User
+from django.utils import timezone
+from io import StringIO
+from unittest.mock import patch
+from ..utils.firebase_access import get_email_key, convert_email_lists, \
+  get_db, get_notif_db_url, get_park_url, get_ride_url
+from ..models import Ride, Subscription
 import logging
+import threading
+import time
 
 logging.getLogger().setLevel(logging.ERROR)
 
 
-class AddNotifTest(TestCase):
+class GetDbTest(TestCase):
 
-  @patch('firebase_admin.db.reference')
-  @patch('rides.utils.firebase_access.add_to_email_list')
-  @patch('rides.utils.firebase_access.get_ride_url')
-  def test_add_notif(self, mock_get_ride_url, mock_add_to_email_list,
-                     mock_reference):
-    """Tests adding/updating a ride notification to the remote DB"""
+  def setUp(self):
+    """Forgets any app initialised by other tests"""
 
-    # Mocks ride URL and list of emails generated by add_to_email_list()
-    mock_get_ride_url.return_value = 'mocked_ride_url'
-    mock_add_to_email_list.return_value = ['test@example.com']
+    patcher = patch('rides.utils.firebase_access._db', None)
+    patcher.start()
+    self.addCleanup(patcher.stop)
 
-    # Creates a mock reference to simulate DB reference
-    mock_ref = Mock()
-    mock_reference.return_value = mock_ref
+  @patch('firebase_admin.credentials.Certificate')
+  @patch('firebase_admin.initialize_app')
+  def test_get_db_initialises_once(self, mock_initialize_app,
+                                   mock_certificate):
+    """Tests the app is initialised on first use only"""
 
-    # Call the function with mock test data
-    add_notif(park_id=1, ride_id=101, ride_name='Test Ride',
-              user_email='test@example.com')
+    from firebase_admin import db
 
-    # Checks get_ride_url() called correctly
-    mock_get_ride_url.assert_called_once_with(park_id=1, ride_id=101)
+    self.assertIs(get_db(), db)
+    self.assertIs(get_db(), db)
 
-    # Checks add_to_email_list)_ called with correct parameters
-    mock_add_to_email_list.assert_called_once_with(ride_url='mocked_ride_url',
-      user_email='test@example.com')
-    
-    # Checks the reference was created with the correct URL
-    mock_reference.assert_called_once_with('mocked_ride_url')
-
-    # Checks the update method is called with correct data
-    mock_ref.update.assert_called_once_with({
-        'ride_id': 101,
-        'ride_name': 'Test Ride',
-        'user_emails': ['test@example.com']
+    mock_initialize_app.assert_called_once()
+
+  @patch('firebase_admin.credentials.Certificate')
+  @patch('firebase_admin.initialize_app')
+  def test_get_db_threads(self, mock_initialize_app, mock_certificate):
+    """Tests the app is initialised once when first used by many threads
+    at the same time"""
+
+    # Slows initialisation so the threads overlap
+    mock_initialize_app.side_effect = lambda *args: time.sleep(0.05)
+
+    threads = [threading.Thread(target=get_db) for _ in range(10)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+
+    mock_initialize_app.assert_called_once()
+
+
+  @override_settings(FIREBASE_DB_URL='https://loadtest.firebaseio.com')
+  @patch.dict('os.environ', {'FIREBASE_DATABASE_EMULATOR_HOST': 'localhost:9000'})
+  @patch('firebase_admin.credentials.Certificate')
+  @patch('firebase_admin.initialize_app')
+  def test_get_db_emulator(self, mock_initialize_app, mock_certificate):
+    """Tests the service account key isn't loaded for an emulator"""
+
+    get_db()
+
+    mock_certificate.assert_not_called()
+    mock_initialize_app.assert_called_once_with(None, {
+      'databaseURL': 'https://loadtest.firebaseio.com'
     })
 
 
-class AddToEmailListTest(TestCase):
+class GetEmailKeyTest(TestCase):
 
-  @patch('firebase_admin.db.reference')
-  def test_add_to_email_list(self, mock_reference):
-    """Tests adding a new email to the existing email list"""
+  def test_get_email_key(self):
+    """Tests keys are valid remote DB keys and the same for each email"""
 
-    # Create a mock reference to simulate the Firebase database reference
-    mock_ref = Mock()
-    mock_reference.return_value = mock_ref
-    
-    # Set up the mock to return an existing email list when get() is called
-    mock_ref.get.return_value = ['existing@example.com']
+    key = get_email_key('Test.User@example.com')
+
+    self.assertEqual(key, get_email_key(' test.user@example.com'))
+    self.assertNotEqual(key, get_email_key('other@example.com'))
+    # Keys can't contain . $ # [ ] or /
+    self.assertRegex(key, r'^[0-9a-f]+$')
+
+
+class ConvertEmailListsTest(TestCase):
+
+  def test_convert_email_lists(self):
+    """Tests user_emails lists are moved to keyed subscribers"""
+
+    notifications = {
+      '1': {
+        '101': {
+          'ride_id': 101,
+          'ride_name': 'Test Ride',
+          'user_emails': ['a@example.com', 'b@example.com']
+        },
+        '102': {
+          'ride_id': 102,
+          'ride_name': 'Converted Ride',
+          'subscribers': {get_email_key('c@example.com'): 'c@example.com'}
+        }
+      }
+    }
+
+    update = convert_email_lists(notifications)
+
+    self.assertEqual(update, {
+      f"1/101/subscribers/{get_email_key('a@example.com')}": 'a@example.com',
+      f"1/101/subscribers/{get_email_key('b@example.com')}": 'b@example.com',
+      '1/101/user_emails': None
+    })
+
+  def test_convert_email_lists_array_nodes(self):
+    """Tests nodes with integer keys returned as lists are converted"""
+
+    notifications = [None, [None, None, {'user_emails': ['a@example.com']}]]
+
+    update = convert_email_lists(notifications)
+
+    self.assertIn('1/2/user_emails', update)
+    self.assertEqual(len(update), 2)
+
+  def test_convert_email_lists_empty(self):
+    """Tests nothing is written when there are no notifications"""
+
+    self.assertEqual(convert_email_lists(None), {})
+
+
+class MigrateEmailListsCommandTest(TestCase):
+
+  @patch('rides.management.commands.migrate_email_lists.get_db')
+  def test_migrate_email_lists(self, mock_get_db):
+    """Tests all rides are converted in one update"""
+
+    mock_reference = mock_get_db.return_value.reference
+
+    mock_ref = mock_reference.return_value
+    mock_ref.get.return_value = {'1': {'101': {'user_emails': ['a@example.com']}}}
+
+    call_command('migrate_email_lists', stdout=StringIO())
+
+    mock_reference.assert_called_once_with('notifications')
+    mock_ref.update.assert_called_once_with(
+      convert_email_lists(mock_ref.get.return_value))
+
+  @patch('rides.management.commands.migrate_email_lists.get_db')
+  def test_migrate_email_lists_dry_run(self, mock_get_db):
+    """Tests nothing is written on a dry run"""
 
-    # Call the function with a test URL and a new email
-    emails = add_to_email_list('mocked_ride_url', 'new@example.com')
+    mock_reference = mock_get_db.return_value.reference
 
-    # Assert that the reference was created with the correct URL
-    mock_reference.assert_called_once_with('mocked_ride_url/user_emails')
+    mock_ref = mock_reference.return_value
+    mock_ref.get.return_value = {'1': {'101': {'user_emails': ['a@example.com']}}}
 
-    # Assert that the get() method was called on the reference
-    mock_ref.get.assert_called_once()
+    call_command('migrate_email_lists', '--dry-run', stdout=StringIO())
 
-    # Check that the returned list contains the existing email and the new one
-    self.assertEqual(emails, ['existing@example.com', 'new@example.com'])
+    mock_ref.update.assert_not_called()
 
-  @patch('firebase_admin.db.reference')
-  def test_add_to_email_list_empty(self, mock_reference):
-    """Tests adding an email when the current list is empty"""
 
-    # Create a mock reference to simulate the Firebase database reference
-    mock_ref = Mock()
-    mock_reference.return_value = mock_ref
+class ImportSubscriptionsCommandTest(TestCase):
 
-    # Set up the mock to return None (representing an empty list)
-    mock_ref.get.return_value = None
+  @patch('rides.management.commands.import_subscriptions.get_db')
+  def test_import_subscriptions(self, mock_get_db):
+    """Tests remote DB subscribers with an account are indexed locally and
+    existing subscriptions are kept"""
 
-    # Call the function with a test URL and a new email
-    emails = add_to_email_list('mocked_ride_url', 'new@example.com')
+    user = User.objects.create_user(username='a@example.com',
+                                    email='a@example.com', password='pass')
+    ride = Ride.objects.create(id=101, name='Test Ride', category='Thrill',
+                               open_state=False, wait_time=0,
+                               last_updated=timezone.now())
+    Subscription.objects.create(user=user, park_id=1, ride=ride)
 
-    # Assert that the reference was created with the correct URL
-    mock_reference.assert_called_once_with('mocked_ride_url/user_emails')
+    mock_get_db.return_value.reference.return_value.get.return_value = {
+      '1': {'101': {'subscribers': {'key_a': 'A@example.com',
+                                    'key_b': 'b@example.com'}},
+            '102': {'subscribers': {'key_a': 'a@example.com'}}}
+    }
 
-    # Assert that the get() method was called on the reference
-    mock_ref.get.assert_called_once()
+    out = StringIO()
+    call_command('import_subscriptions', stdout=out)
 
-    # Check that the returned list contains only the new email
-    self.assertEqual(emails, ['new@example.com'])
+    self.assertEqual(list(Subscription.objects.values_list(
+      'user', 'park_id', 'ride')), [(user.id, 1, 101)])
+    self.assertIn("skipped 2", out.getvalue())
 
 
 class GetUrlsFunctionsTest(TestCase):
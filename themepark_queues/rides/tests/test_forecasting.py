@@ -0,0 +1,179 @@
+"""
+Name: test_forecasting.py
+Author: Ryan Gascoigne-Jones
+
+Purpose: Tests forecasting.py file for fitting wait time forecasts of all
+  rides in a park from their history
+"""
+
+from django.test import TestCase, override_settings
+from django.core.management import call_command
+from datetime import datetime, timedelta, timezone as dt_timezone
+from io import StringIO
+import pandas as pd
+from ..models import Ride, RideForecast, RideWaitSample
+from ..utils.forecasting import fit_forecasts, fit_park, load_history
+
+# A Monday
+NOW = datetime(2024, 8, 12, 9, 50, tzinfo=dt_timezone.utc)
+
+
+def make_history(rows: list[tuple[int, datetime, float]]) -> pd.DataFrame:
+  """Produces history in the columns loaded from the DB"""
+
+  history = pd.DataFrame(rows, columns=['ride_id', 'timestamp', 'wait_time'])
+  history['timestamp'] = pd.to_datetime(history['timestamp'], utc=True)
+
+  return history
+
+
+def weekly_history(ride_id: int, hour_waits: dict[int, float],
+                   weeks: int = 4) -> list[tuple[int, datetime, float]]:
+  """Produces samples of a ride on the Mondays before NOW at the given
+  hours"""
+
+  return [(ride_id, datetime(2024, 8, 12, hour, 0, tzinfo=dt_timezone.utc)
+           - timedelta(weeks=week), wait)
+          for week in range(1, weeks + 1) for hour, wait in hour_waits.items()]
+
+
+class FitForecastsTest(TestCase):
+
+  def fit(self, history: pd.DataFrame, prior_samples: float = 0):
+    return fit_forecasts(history=history, now=NOW, hours=2, step_minutes=30,
+                         trend_hours=2, prior_samples=prior_samples)
+
+  def test_fit_forecasts_seasonal(self):
+    """Tests each ride is forecast its mean wait at that hour of the week,
+    with all rides fitted together"""
+
+    history = make_history(weekly_history(1, {10: 10, 11: 50})
+                           + weekly_history(2, {10: 30, 11: 20}))
+
+    forecasts = self.fit(history)
+
+    self.assertEqual(len(forecasts), 8)
+
+    ride_1 = forecasts[forecasts['ride_id'] == 1]
+    self.assertEqual(list(ride_1['wait_time']), [10, 10, 50, 50])
+    self.assertEqual(ride_1['time'].iloc[0],
+                     pd.Timestamp('2024-08-12T10:00:00Z'))
+
+    ride_2 = forecasts[forecasts['ride_id'] == 2]
+    self.assertEqual(list(ride_2['wait_time']), [30, 30, 20, 20])
+
+  def test_fit_forecasts_missing_hours(self):
+    """Tests hours of the week without history use the ride's mean"""
+
+    history = make_history(weekly_history(1, {10: 10, 13: 30}))
+
+    forecasts = self.fit(history)
+
+    # 11:00 and 11:30 have no history
+    self.assertEqual(list(forecasts['wait_time']), [10, 10, 20, 20])
+
+  def test_fit_forecasts_prior(self):
+    """Tests hours with few samples are pulled towards the ride's mean"""
+
+    history = make_history(weekly_history(1, {10: 10, 11: 50}, weeks=1))
+
+    forecasts = self.fit(history, prior_samples=1)
+
+    self.assertEqual(list(forecasts['wait_time']), [20, 20, 40, 40])
+
+  def test_fit_forecasts_trend(self):
+    """Tests recent waits above the usual raise forecasts by an amount that
+    fades with time"""
+
+    history = make_history(
+      weekly_history(1, {9: 10, 10: 10, 11: 10})
+      + [(1, NOW - timedelta(minutes=10), 30)])
+
+    waits = list(self.fit(history)['wait_time'])
+
+    self.assertGreater(waits[0], 10)
+    self.assertEqual(waits, sorted(waits, reverse=True))
+
+  def test_fit_forecasts_empty(self):
+    """Tests parks without history have no forecasts"""
+
+    self.assertTrue(self.fit(make_history([])).empty)
+
+
+@override_settings(FORECAST_HISTORY_DAYS=56, FORECAST_HOURS=2,
+                   FORECAST_STEP_MINUTES=30, FORECAST_TREND_HOURS=2,
+                   FORECAST_PRIOR_SAMPLES=0)
+class FitParkTest(TestCase):
+
+  def setUp(self):
+    """Sets up rides in two parks with history"""
+
+    self.ride = Ride.objects.create(id=1, park_id=1, name='Ride A',
+                                    category='Thrill', open_state=True,
+                                    wait_time=10, last_updated=NOW)
+    self.other = Ride.objects.create(id=2, park_id=2, name='Ride B',
+                                     category='Thrill', open_state=True,
+                                     wait_time=10, last_updated=NOW)
+
+    for ride_id, timestamp, wait_time in weekly_history(1, {10: 10}) \
+                                         + weekly_history(2, {10: 40}):
+      RideWaitSample.objects.create(ride_id=ride_id, timestamp=timestamp,
+                                    wait_time=wait_time, open_state=True)
+
+    # Closed rides report a wait time of 0, which isn't their wait
+    RideWaitSample.objects.create(ride=self.ride, timestamp=NOW,
+                                  wait_time=0, open_state=False)
+
+  def test_load_history(self):
+    """Tests only open samples of the park's rides are loaded"""
+
+    history = load_history(park_id=1, since=NOW - timedelta(days=56))
+
+    self.assertEqual(len(history), 4)
+    self.assertEqual(set(history['ride_id']), {1})
+
+  def test_fit_park(self):
+    """Tests one forecast row is saved for each ride in the park"""
+
+    self.assertEqual(fit_park(park_id=1, now=NOW), 1)
+
+    forecast = RideForecast.objects.get()
+    self.assertEqual(forecast.ride, self.ride)
+    self.assertEqual(forecast.fitted_at, NOW)
+    self.assertEqual(forecast.waits[0], {'time': '2024-08-12T10:00:00+00:00',
+                                         'wait_time': 10})
+
+    # Refitting replaces the forecast
+    fit_park(park_id=1, now=NOW + timedelta(hours=1))
+    self.assertEqual(RideForecast.objects.get().fitted_at,
+                     NOW + timedelta(hours=1))
+
+  def test_fit_park_no_history(self):
+    """Tests forecasts of rides without history in the window are removed"""
+
+    fit_park(park_id=1, now=NOW)
+    fit_park(park_id=1, now=NOW + timedelta(days=100))
+
+    self.assertFalse(RideForecast.objects.exists())
+
+  def test_get_upcoming_waits(self):
+    """Tests only forecast steps after now are produced"""
+
+    fit_park(park_id=1, now=NOW)
+
+    waits = RideForecast.objects.get().get_upcoming_waits(
+      now=NOW + timedelta(minutes=40))
+
+    self.assertEqual([step['time'] for step in waits],
+                     [NOW + timedelta(minutes=70 + 30 * step)
+                      for step in range(2)])
+
+  @override_settings(FORECAST_HISTORY_DAYS=100000)
+  def test_fit_forecasts_command(self):
+    """Tests the command fits each park passed"""
+
+    out = StringIO()
+    call_command('fit_forecasts', '--park', '1', '--park', '2', stdout=out)
+
+    self.assertEqual(RideForecast.objects.count(), 2)
+    self.assertIn("Fitted 1 rides in park 2", out.getvalue())
@@ -0,0 +1,146 @@
+"""
+Name: test_ingestion.py
+Author: Ryan Gascoigne-Jones
+
+Purpose: Tests ingestion.py file for saving ride data for many parks
+  concurrently
+"""
+
+from django.test import TestCase
+from unittest.mock import patch
+import threading
+import time
+from ..utils.ingestion import ingest_park, ParkIngestor
+
+
+class IngestParkTest(TestCase):
+
+  @patch('rides.utils.ingestion.save_queue_data')
+  def test_ingest_park(self, mock_save_queue_data):
+    """Tests a successful ingestion reports its categories"""
+
+    mock_save_queue_data.return_value = ['Family']
+
+    result = ingest_park(park_id=1)
+
+    mock_save_queue_data.assert_called_once_with(park_id=1)
+    self.assertEqual(result.park_id, 1)
+    self.assertEqual(result.categories, ['Family'])
+    self.assertIsNone(result.error)
+
+  @patch('rides.utils.ingestion.save_queue_data')
+  def test_ingest_park_error(self, mock_save_queue_data):
+    """Tests a failed ingestion reports its error rather than raising"""
+
+    mock_save_queue_data.side_effect = ValueError("Bad JSON")
+
+    with self.assertLogs('rides.utils.ingestion', level='ERROR'):
+      result = ingest_park(park_id=1)
+
+    self.assertIsNone(result.categories)
+    self.assertIn("Bad JSON", result.error)
+
+
+class ParkIngestorTest(TestCase):
+
+  def setUp(self):
+    self.ingestor = ParkIngestor(max_workers=4)
+
+  def tearDown(self):
+    self.ingestor.shutdown()
+
+  @patch('rides.utils.ingestion.save_queue_data')
+  def test_ingest_parks_concurrent(self, mock_save_queue_data):
+    """Tests parks are ingested at the same time"""
+
+    def slow_save(park_id):
+      time.sleep(0.2)
+      return [f"Land {park_id}"]
+
+    mock_save_queue_data.side_effect = slow_save
+
+    start = time.monotonic()
+    results = self.ingestor.ingest(park_ids=[1, 2, 3, 4], timeout=5)
+
+    # Four parks taking 0.2s each finish in much less than 0.8s
+    self.assertLess(time.monotonic() - start, 0.6)
+    self.assertEqual([result.park_id for result in results], [1, 2, 3, 4])
+    self.assertEqual(results[2].categories, ["Land 3"])
+
+  @patch('rides.utils.ingestion.save_queue_data')
+  def test_ingest_parks_max_workers(self, mock_save_queue_data):
+    """Tests no more than max_workers parks are ingested at once"""
+
+    running = 0
+    most_running = 0
+    lock = threading.Lock()
+
+    def counting_save(park_id):
+      nonlocal running, most_running
+      with lock:
+        running += 1
+        most_running = max(most_running, running)
+      time.sleep(0.05)
+      with lock:
+        running -= 1
+      return []
+
+    mock_save_queue_data.side_effect = counting_save
+
+    ingestor = ParkIngestor(max_workers=2)
+    ingestor.ingest(park_ids=list(range(6)), timeout=5)
+    ingestor.shutdown()
+
+    self.assertEqual(most_running, 2)
+
+  @patch('rides.utils.ingestion.save_queue_data')
+  def test_ingest_parks_timeout(self, mock_save_queue_data):
+    """Tests a slow park times out without delaying the others"""
+
+    release = threading.Event()
+
+    def save(park_id):
+      if park_id == 1:
+        release.wait(5)
+      return []
+
+    mock_save_queue_data.side_effect = save
+
+    with self.assertLogs('rides.utils.ingestion', level='ERROR'):
+      results = self.ingestor.ingest(park_ids=[1, 2], timeout=0.2)
+    release.set()
+
+    self.assertEqual(results[0].error, "Timed out")
+    self.assertIsNone(results[1].error)
+
+  @patch('rides.utils.ingestion.save_queue_data')
+  def test_ingest_parks_skips_in_flight(self, mock_save_queue_data):
+    """Tests a park that timed out isn't ingested again until its earlier
+    ingestion finishes, so the two never overlap"""
+
+    release = threading.Event()
+
+    def save(park_id):
+      release.wait(5)
+      return []
+
+    mock_save_queue_data.side_effect = save
+
+    with self.assertLogs('rides.utils.ingestion', level='ERROR'):
+      self.ingestor.ingest(park_ids=[1], timeout=0.1)
+
+    with self.assertLogs('rides.utils.ingestion', level='WARNING'):
+      results = self.ingestor.ingest(park_ids=[1], timeout=0.1)
+
+    self.assertEqual(results[0].error, "Still running")
+    self.assertEqual(mock_save_queue_data.call_count, 1)
+
+    # Polled again once the earlier ingestion has finished
+    release.set()
+    while 1 in self.ingestor.in_flight:
+      time.sleep(0.01)
+
+    results = self.ingestor.ingest(park_ids=[1], timeout=5)
+
+    self.assertIsNone(results[0].error)
+    self.assertEqual(mock_save_queue_data.call_count, 2)
@@ -0,0 +1,227 @@
+"""
+Name: test_metrics.py
+Author: Ryan Gascoigne-Jones
+
+Purpose: Tests metrics.py file and the /metrics view for serving counters
+  and histograms summed across processes
+"""
+
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from datetime import timedelta
+import json
+import os
+from pathlib import Path
+import tempfile
+import threading
+from unittest.mock import patch
+from ..models import Ride, Park, SubscriptionOutbox
+from ..utils import metrics
+from ..utils.metrics import inc, observe, timer, render_metrics
+
+
+@override_settings(METRICS_DIR=None)
+@patch.dict(metrics._values, clear=True)
+class MetricsTest(TestCase):
+
+  def test_counter(self):
+    """Tests counters are summed by their labels"""
+
+    inc('themepark_ingest_failures_total', park=1)
+    inc('themepark_ingest_failures_total', 2, park=1)
+    inc('themepark_ingest_failures_total', park=2)
+
+    output = render_metrics()
+
+    self.assertIn('# TYPE themepark_ingest_failures_total counter',
+                  output)
+    self.assertIn('themepark_ingest_failures_total{park="1"} 3',
+                  output)
+    self.assertIn('themepark_ingest_failures_total{park="2"} 1',
+                  output)
+
+  def test_histogram(self):
+    """Tests histogram buckets are cumulative"""
+
+    observe('themepark_ingest_seconds', 0.004, park=1)
+    observe('themepark_ingest_seconds', 0.3, park=1)
+    observe('themepark_ingest_seconds', 60, park=1)
+
+    output = render_metrics()
+
+    self.assertIn('themepark_ingest_seconds_bucket{park="1",le="0.005"} 1',
+                  output)
+    self.assertIn('themepark_ingest_seconds_bucket{park="1",le="0.5"} 2',
+                  output)
+    self.assertIn('themepark_ingest_seconds_bucket{park="1",le="10.0"} 2',
+                  output)
+    self.assertIn('themepark_ingest_seconds_bucket{park="1",le="+Inf"} 3',
+                  output)
+    self.assertIn('themepark_ingest_seconds_count{park="1"} 3', output)
+
+  def test_timer_records_on_error(self):
+    """Tests the timer observes a duration when the timed code raises"""
+
+    with self.assertRaises(ValueError):
+      with timer('themepark_firebase_seconds', operation='outbox_flush'):
+        raise ValueError()
+
+    self.assertIn('themepark_firebase_seconds_count{operation="outbox_flush"} 1',
+                  render_metrics())
+
+  def test_summed_across_processes(self):
+    """Tests the files of other processes are added to this process's
+    values"""
+
+    with tempfile.TemporaryDirectory() as metrics_dir:
+      # Written by another worker
+      (Path(metrics_dir) / 'metrics-1.json').write_text(json.dumps([
+        ['themepark_upstream_polls_total', [], [4]],
+        ['themepark_ingest_seconds', [['park', '1']],
+         [1] + [0] * len(metrics.BUCKETS) + [0.001]]
+      ]))
+
+      with override_settings(METRICS_DIR=metrics_dir), \
+           patch.object(metrics, 'start_flusher'):
+        inc('themepark_upstream_polls_total')
+        observe('themepark_ingest_seconds', 0.001, park=1)
+
+        output = render_metrics()
+
+        self.assertTrue(metrics.get_metrics_file().exists())
+
+    self.assertIn('themepark_upstream_polls_total 5', output)
+    self.assertIn('themepark_ingest_seconds_count{park="1"} 2', output)
+
+  @patch.object(metrics, 'start_flusher')
+  @patch.object(metrics, 'flush')
+  def test_maybe_flush_once_per_interval(self, mock_flush,
+                                         mock_start_flusher):
+    """Tests threads recording values at the same time write them once"""
+
+    barrier = threading.Barrier(8)
+
+    def record():
+      barrier.wait()
+      metrics.maybe_flush()
+
+    with override_settings(METRICS_DIR='/tmp/metrics',
+                           METRICS_FLUSH_INTERVAL=60), \
+         patch.object(metrics, '_next_flush', 0.0):
+      threads = [threading.Thread(target=record) for _ in range(8)]
+      for thread in threads:
+        thread.start()
+      for thread in threads:
+        thread.join()
+
+    mock_flush.assert_called_once_with()
+    mock_start_flusher.assert_called_once_with()
+
+  def test_flush_concurrent(self):
+    """Tests concurrent flushes each write through a temporary file of
+    their own, leaving only the complete metrics file"""
+
+    inc('themepark_upstream_polls_total')
+
+    with tempfile.TemporaryDirectory() as metrics_dir:
+      with override_settings(METRICS_DIR=metrics_dir):
+        threads = [threading.Thread(target=metrics.flush) for _ in range(8)]
+        for thread in threads:
+          thread.start()
+        for thread in threads:
+          thread.join()
+
+        path = metrics.get_metrics_file()
+
+        self.assertEqual(os.listdir(metrics_dir), [path.name])
+        self.assertEqual(json.loads(path.read_text()),
+                         [['themepark_upstream_polls_total', [], [1]]])
+
+  def test_flusher_writes_idle_values(self):
+    """Tests values are written every METRICS_FLUSH_INTERVAL without any
+    more being recorded"""
+
+    inc('themepark_upstream_polls_total')
+
+    with tempfile.TemporaryDirectory() as metrics_dir:
+      with override_settings(METRICS_DIR=metrics_dir), \
+           patch('rides.utils.metrics.time.sleep',
+                 side_effect=[None, SystemExit]):
+        with self.assertRaises(SystemExit):
+          metrics.run_flusher()
+
+        self.assertTrue(metrics.get_metrics_file().exists())
+
+  def test_metrics_file_unique(self):
+    """Tests a forked process writes to a file of its own even if it gets
+    the pid of a process which exited"""
+
+    with override_settings(METRICS_DIR='/tmp/metrics'):
+      path = metrics.get_metrics_file()
+
+      with patch.object(metrics, '_process_id', metrics._process_id):
+        metrics.reset_after_fork()
+        forked_path = metrics.get_metrics_file()
+
+    self.assertNotEqual(path, forked_path)
+    self.assertTrue(forked_path.name.startswith(f"metrics-{os.getpid()}-"))
+
+  def test_freshness_gauges(self):
+    """Tests the age of each park's data and the queue depths are read
+    from the local DB"""
+
+    now = timezone.now()
+    Park.objects.create(id=1, categories=['Family'],
+                        last_ingested=now - timedelta(seconds=30))
+    Ride.objects.create(id=1, park_id=1, name='Family Ride', category='Family',
+                        open_state=True, wait_time=10,
+                        last_updated=now - timedelta(minutes=5))
+    SubscriptionOutbox.objects.create(park_id=1, ride_id=1,
+                                      ride_name='Family Ride',
+                                      user_email='user@example.com')
+
+    lines = render_metrics().splitlines()
+
+    ingest_age = next(line for line in lines if line.startswith(
+      'themepark_park_ingest_age_seconds{park="1"}'))
+    data_age = next(line for line in lines if line.startswith(
+      'themepark_park_data_age_seconds{park="1"}'))
+
+    self.assertAlmostEqual(float(ingest_age.split()[-1]), 30, delta=5)
+    self.assertAlmostEqual(float(data_age.split()[-1]), 300, delta=5)
+    self.assertIn('themepark_outbox_depth 1', lines)
+
+
+@override_settings(METRICS_DIR=None, METRICS_TOKEN=None)
+@patch.dict(metrics._values, clear=True)
+class MetricsViewTest(TestCase):
+
+  def test_view_latency_recorded(self):
+    """Tests the latency and status of views are served at /metrics"""
+
+    self.client.get(reverse('about'))
+    response = self.client.get(reverse('metrics'))
+
+    self.assertEqual(response.status_code, 200)
+    self.assertTrue(response['Content-Type'].startswith('text/plain'))
+    self.assertContains(response, 'themepark_view_seconds_count{view="about"} 1')
+    self.assertContains(
+      response, 'themepark_view_responses_total{status="2xx",view="about"} 1')
+
+  @override_settings(METRICS_TOKEN='secret')
+  def test_token_required(self):
+    """Tests /metrics is only served with the bearer token when it is set"""
+
+    self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+
+    response = self.client.get(reverse('metrics'),
+                               HTTP_AUTHORIZATION='Bearer secret')
+    self.assertEqual(response.status_code, 200)
+
+  @override_settings(METRICS_REQUIRE_TOKEN=True)
+  def test_token_unset_refused(self):
+    """Tests /metrics isn't served to anyone when a token is required but
+    not set"""
+
+    self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
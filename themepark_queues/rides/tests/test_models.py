@@ -7,7 +7,8 @@ Purpose: Tests models.py file
 
 from django.test import TestCase
 from datetime import datetime
-from ..models import Ride
+from ..models import Ride, RideWaitSample
+from django.db import IntegrityError
 from django.utils import timezone
 
 # Create your tests here.
@@ -78,4 +79,43 @@ class RideModelTest(TestCase):
     )
 
     self.assertFalse(ride_closed.open_state)
-    self.assertTrue(self.ride.open_state)
\ No newline at end of file
+    self.assertTrue(self.ride.open_state)
+
+
+class RideWaitSampleModelTest(TestCase):
+  """Tests the RideWaitSample model"""
+
+  def setUp(self):
+    """Sets up a ride with a sample of its wait time"""
+
+    self.ride = Ride.objects.create(
+      id = 1,
+      name = "Ride test placeholder",
+      category = "Thrills",
+      open_state = True,
+      wait_time = 25,
+      last_updated = timezone.now()
+    )
+
+    self.sample = RideWaitSample.objects.create(
+      ride = self.ride,
+      timestamp = self.ride.last_updated,
+      wait_time = self.ride.wait_time,
+      open_state = self.ride.open_state
+    )
+
+  def test_sample_creation(self):
+    """Tests a sample is linked to the ride's history"""
+
+    self.assertEqual(list(self.ride.samples.all()), [self.sample])
+
+  def test_sample_unique_timestamp(self):
+    """Tests a ride can't have two samples at the same time"""
+
+    with self.assertRaises(IntegrityError):
+      RideWaitSample.objects.create(
+        ride = self.ride,
+        timestamp = self.ride.last_updated,
+        wait_time = 30,
+        open_state = True
+      )
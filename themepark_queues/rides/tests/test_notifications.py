@@ -0,0 +1,227 @@
+"""
+Name: test_notifications.py
+Author: Ryan Gascoigne-Jones
+
+Purpose: Tests notifications.py file for detecting reopened rides and
+  queueing and sending notifications to their subscribers
+"""
+
+from django.test import TestCase, override_settings
+from django.core import mail
+from django.core.mail import EmailMessage
+from django.core.management import call_command
+from django.contrib.auth.models import User
+from django.utils import timezone
+from datetime import timedelta
+from smtplib import SMTPRecipientsRefused
+from unittest.mock import patch
+from ..models import Ride, Subscription, NotificationJob
+from ..signals import RideChange
+from ..utils.api_request import save_rides
+from ..utils.notifications import get_reopened_rides, create_reopen_jobs, \
+  drain_notifications, get_notification_stats
+
+
+def failing_sender(jobs):
+  """Sender used to test a batch which couldn't be sent"""
+
+  raise Exception("Mail server down")
+
+
+def rejecting_sender(jobs):
+  """Sender used to test a job which failed to send, which fails the
+  notification to b@example.com"""
+
+  return [job for job in jobs if job.user_email == 'b@example.com']
+
+
+def make_change(ride_id: int, old_open_state, open_state: bool,
+                name: str = 'Ride') -> RideChange:
+  """Produces a change of a ride in park 1"""
+
+  return RideChange(ride_id=ride_id, park_id=1, name=name, category='Thrill',
+                    old_wait_time=0, wait_time=10,
+                    old_open_state=old_open_state, open_state=open_state,
+                    last_updated=timezone.now() - timedelta(seconds=30))
+
+
+class ReopenNotificationsTest(TestCase):
+
+  def setUp(self):
+    """Subscribes two users to closed rides"""
+
+    self.user_a = User.objects.create_user(username='a@example.com',
+                                           email='a@example.com')
+    self.user_b = User.objects.create_user(username='b@example.com',
+                                           email='b@example.com')
+
+    for ride_id, name in [(101, 'Ride A'), (102, 'Ride B'), (103, 'Ride C')]:
+      Ride.objects.create(id=ride_id, park_id=1, name=name, category='Thrill',
+                          open_state=False, wait_time=0,
+                          last_updated=timezone.now())
+
+    Subscription.objects.create(user=self.user_a, park_id=1, ride_id=101)
+    Subscription.objects.create(user=self.user_a, park_id=1, ride_id=102)
+    Subscription.objects.create(user=self.user_b, park_id=1, ride_id=102)
+    Subscription.objects.create(user=self.user_b, park_id=1, ride_id=103)
+
+  def test_get_reopened_rides(self):
+    """Tests only rides going from closed to open have reopened"""
+
+    changes = [make_change(101, False, True), make_change(102, True, False),
+               make_change(103, None, True), make_change(104, True, True)]
+
+    self.assertEqual(get_reopened_rides(changes), [changes[0]])
+
+  def test_create_reopen_jobs(self):
+    """Tests one job is queued per subscriber, listing all their reopened
+    rides, using one query to find the subscribers"""
+
+    changes = [make_change(101, False, True, 'Ride A'),
+               make_change(102, False, True, 'Ride B'),
+               make_change(103, True, False, 'Ride C')]
+
+    # Finding subscribers and inserting the jobs
+    with self.assertNumQueries(2):
+      create_reopen_jobs(park_id=1, changes=changes)
+
+    jobs = {job.user_email: job for job in NotificationJob.objects.all()}
+
+    self.assertEqual(jobs['a@example.com'].rides,
+                     [{'ride_id': 101, 'ride_name': 'Ride A'},
+                      {'ride_id': 102, 'ride_name': 'Ride B'}])
+    self.assertEqual(jobs['b@example.com'].rides,
+                     [{'ride_id': 102, 'ride_name': 'Ride B'}])
+    self.assertEqual(jobs['a@example.com'].reopened_at,
+                     min(changes[0].last_updated, changes[1].last_updated))
+
+    self.assertGreaterEqual(
+      get_notification_stats()['last_enqueue_latency_seconds'], 30)
+
+  def test_create_reopen_jobs_none_reopened(self):
+    """Tests the DB isn't queried when no rides reopened"""
+
+    with self.assertNumQueries(0):
+      create_reopen_jobs(park_id=1, changes=[make_change(101, True, False)])
+
+  def test_ingestion_queues_jobs(self):
+    """Tests jobs are queued when an ingested snapshot reopens a ride"""
+
+    rides_lands = [{'name': 'Thrills', 'rides': [
+      {'id': 103, 'name': 'Ride C', 'is_open': True, 'wait_time': 5,
+       'last_updated': '2024-08-12T10:00:00.000Z'}]}]
+
+    with self.captureOnCommitCallbacks(execute=True):
+      save_rides(park_id=1, rides_lands=rides_lands)
+
+    job = NotificationJob.objects.get()
+    self.assertEqual(job.user_email, 'b@example.com')
+    self.assertEqual(job.rides, [{'ride_id': 103, 'ride_name': 'Ride C'}])
+
+  @override_settings(REOPEN_NOTIFICATIONS=False)
+  def test_ingestion_notifications_disabled(self):
+    """Tests no jobs are queued when notifications are disabled"""
+
+    rides_lands = [{'name': 'Thrills', 'rides': [
+      {'id': 103, 'name': 'Ride C', 'is_open': True, 'wait_time': 5,
+       'last_updated': '2024-08-12T10:00:00.000Z'}]}]
+
+    with self.captureOnCommitCallbacks(execute=True):
+      save_rides(park_id=1, rides_lands=rides_lands)
+
+    self.assertFalse(NotificationJob.objects.exists())
+
+
+class DrainNotificationsTest(TestCase):
+
+  def setUp(self):
+    """Queues notifications to two subscribers"""
+
+    for user_email in ['a@example.com', 'b@example.com']:
+      NotificationJob.objects.create(
+        park_id=1, user_email=user_email,
+        rides=[{'ride_id': 101, 'ride_name': 'Ride A'}],
+        reopened_at=timezone.now())
+
+  def test_drain_notifications(self):
+    """Tests queued jobs are emailed and removed from the queue"""
+
+    self.assertEqual(drain_notifications(batch_size=100), 2)
+
+    self.assertEqual(len(mail.outbox), 2)
+    self.assertEqual(mail.outbox[0].subject, "Ride A has reopened")
+    self.assertEqual(mail.outbox[0].to, ['a@example.com'])
+    self.assertFalse(NotificationJob.objects.exists())
+
+  @override_settings(
+    NOTIFICATION_SENDER='rides.tests.test_notifications.failing_sender')
+  def test_drain_notifications_failure(self):
+    """Tests jobs are kept to be retried without counting an attempt when
+    the batch can't be sent"""
+
+    with self.assertRaises(Exception):
+      drain_notifications(batch_size=100)
+
+    self.assertEqual(
+      set(NotificationJob.objects.values_list('attempts', flat=True)), {0})
+
+  @override_settings(
+    NOTIFICATION_SENDER='rides.tests.test_notifications.rejecting_sender')
+  def test_drain_notifications_job_failure(self):
+    """Tests a job which fails is kept to be retried and counted while the
+    rest of its batch is removed as sent"""
+
+    failures: float = get_notification_stats()['send_failures']
+
+    self.assertEqual(drain_notifications(batch_size=100), 1)
+
+    job = NotificationJob.objects.get()
+    self.assertEqual(job.user_email, 'b@example.com')
+    self.assertEqual(job.attempts, 1)
+    self.assertEqual(get_notification_stats()['send_failures'], failures + 1)
+
+  @override_settings(
+    NOTIFICATION_SENDER='rides.tests.test_notifications.rejecting_sender',
+    NOTIFICATION_MAX_ATTEMPTS=2)
+  def test_drain_notifications_max_attempts(self):
+    """Tests a job is logged and no longer sent once it reaches the max
+    attempts, until it is requeued"""
+
+    drain_notifications(batch_size=100)
+
+    with self.assertLogs('rides.utils.notifications', level='ERROR'):
+      drain_notifications(batch_size=100)
+
+    self.assertEqual(drain_notifications(batch_size=100), 0)
+    self.assertEqual(get_notification_stats()['dead'], 1)
+
+    call_command('send_notifications', '--retry-dead')
+
+    self.assertEqual(NotificationJob.objects.get().attempts, 0)
+
+  def test_send_email_notifications_rejected(self):
+    """Tests one rejected email doesn't stop the rest of the batch being
+    sent"""
+
+    send = EmailMessage.send
+
+    def reject_a(message, *args, **kwargs):
+      if message.to == ['a@example.com']:
+        raise SMTPRecipientsRefused({'a@example.com': (550, b"Rejected")})
+      return send(message, *args, **kwargs)
+
+    with patch.object(EmailMessage, 'send', reject_a):
+      with self.assertLogs('rides.utils.notifications', level='ERROR'):
+        self.assertEqual(drain_notifications(batch_size=100), 1)
+
+    self.assertEqual(mail.outbox[0].to, ['b@example.com'])
+    self.assertEqual(NotificationJob.objects.get().user_email,
+                     'a@example.com')
+
+  def test_send_notifications_command(self):
+    """Tests the worker sends batches until the queue is empty"""
+
+    call_command('send_notifications', '--once', '--batch-size', '1')
+
+    self.assertEqual(len(mail.outbox), 2)
+    self.assertEqual(get_notification_stats()['depth'], 0)
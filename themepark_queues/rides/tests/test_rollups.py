@@ -0,0 +1,206 @@
+"""
+Name: test_rollups.py
+Author: Ryan Gascoigne-Jones
+
+Purpose: Tests rollups.py file for keeping hourly and daily wait time
+  rollups of rides up to date
+"""
+
+from django.test import TestCase
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from datetime import datetime, timezone as dt_timezone
+from io import StringIO
+from ..models import Ride, RideWaitRollup, RideWaitSample
+from ..utils.api_request import insert_new_samples, save_rides
+from ..utils.rollups import check_rollups, rebuild_rollups, update_rollups
+
+
+def at(hour: int, minute: int = 0, day: int = 12) -> datetime:
+  return datetime(2024, 8, day, hour, minute, tzinfo=dt_timezone.utc)
+
+
+def make_rides_lands(wait_time: int, is_open: bool,
+                     last_updated: str) -> list[dict]:
+  return [{'name': 'Thrills', 'rides': [
+    {'id': 1, 'name': 'Ride A', 'is_open': is_open, 'wait_time': wait_time,
+     'last_updated': last_updated}]}]
+
+
+class RideWaitRollupModelTest(TestCase):
+
+  def test_rollup_statistics(self):
+    """Tests the mean, open fraction and percentiles of a rollup"""
+
+    rollup = RideWaitRollup(samples=5, open_samples=4, wait_sum=100,
+                            min_wait=10, max_wait=50,
+                            histogram={'10': 1, '20': 1, '50': 2})
+
+    self.assertEqual(rollup.mean_wait, 25)
+    self.assertEqual(rollup.open_fraction, 0.8)
+    self.assertEqual(rollup.get_percentile(50), 20)
+    self.assertEqual(rollup.get_percentile(90), 50)
+    self.assertEqual(rollup.get_percentile(0), 10)
+
+  def test_rollup_statistics_closed(self):
+    """Tests rollups of a ride that was never open have no waits"""
+
+    rollup = RideWaitRollup(samples=2)
+
+    self.assertIsNone(rollup.mean_wait)
+    self.assertEqual(rollup.open_fraction, 0)
+    self.assertIsNone(rollup.get_percentile(50))
+
+
+class UpdateRollupsTest(TestCase):
+
+  def setUp(self):
+    """Sets up a ride to sample"""
+
+    self.ride = Ride.objects.create(id=1, name='Ride A', category='Thrills',
+                                    open_state=True, wait_time=0,
+                                    last_updated=at(9))
+
+  def test_update_rollups(self):
+    """Tests samples are added to the rollups of their hour and day"""
+
+    update_rollups([
+      RideWaitSample(ride=self.ride, timestamp=at(10, 5), wait_time=20,
+                     open_state=True),
+      RideWaitSample(ride=self.ride, timestamp=at(10, 10), wait_time=40,
+                     open_state=True),
+      RideWaitSample(ride=self.ride, timestamp=at(11, 5), wait_time=0,
+                     open_state=False)
+    ])
+
+    hour = RideWaitRollup.objects.get(period='hour', start=at(10))
+    self.assertEqual((hour.samples, hour.open_samples, hour.wait_sum,
+                      hour.min_wait, hour.max_wait), (2, 2, 60, 20, 40))
+    self.assertEqual(hour.histogram, {'20': 1, '40': 1})
+
+    closed_hour = RideWaitRollup.objects.get(period='hour', start=at(11))
+    self.assertEqual(closed_hour.open_fraction, 0)
+
+    day = RideWaitRollup.objects.get(period='day', start=at(0))
+    self.assertEqual((day.samples, day.open_samples), (3, 2))
+
+  def test_update_rollups_incremental(self):
+    """Tests later samples are added to the existing rollups with one
+    read and one write"""
+
+    update_rollups([RideWaitSample(ride=self.ride, timestamp=at(10, 5),
+                                   wait_time=20, open_state=True)])
+
+    # Savepoint, select and upsert of rollups and release
+    with self.assertNumQueries(4):
+      update_rollups([RideWaitSample(ride=self.ride, timestamp=at(10, 10),
+                                     wait_time=30, open_state=True)])
+
+    hour = RideWaitRollup.objects.get(period='hour', start=at(10))
+    self.assertEqual((hour.samples, hour.wait_sum, hour.min_wait,
+                      hour.max_wait), (2, 50, 20, 30))
+    self.assertEqual(RideWaitRollup.objects.count(), 2)
+
+  def test_ingestion_updates_rollups(self):
+    """Tests ingested rides are added to the rollups once, even when the
+    same sample is ingested again"""
+
+    save_rides(park_id=1, rides_lands=make_rides_lands(
+      20, True, '2024-08-12T10:05:00Z'))
+    # Renamed ride with the same last_updated doesn't add a sample
+    rides_lands = make_rides_lands(20, True, '2024-08-12T10:05:00Z')
+    rides_lands[0]['rides'][0]['name'] = 'Ride A2'
+    save_rides(park_id=1, rides_lands=rides_lands)
+    save_rides(park_id=1, rides_lands=make_rides_lands(
+      30, True, '2024-08-12T10:10:00Z'))
+
+    hour = RideWaitRollup.objects.get(period='hour', start=at(10))
+    self.assertEqual((hour.samples, hour.wait_sum), (2, 50))
+    self.assertEqual(check_rollups(), [])
+
+  def test_concurrently_inserted_sample_not_rolled_up(self):
+    """Tests a sample inserted by another ingestion after the rides were
+    diffed is left for that ingestion to add to the rollups"""
+
+    save_rides(park_id=1, rides_lands=make_rides_lands(
+      20, True, '2024-08-12T10:05:00Z'))
+
+    # Inserted by another ingestion which rolls it up itself
+    RideWaitSample.objects.create(ride_id=1, timestamp=at(10, 10),
+                                  wait_time=30, open_state=True)
+
+    new_samples = insert_new_samples([
+      RideWaitSample(ride_id=1, timestamp=at(10, 10), wait_time=30,
+                     open_state=True)])
+
+    self.assertEqual(new_samples, [])
+    self.assertEqual(RideWaitSample.objects.count(), 2)
+
+    save_rides(park_id=1, rides_lands=make_rides_lands(
+      30, True, '2024-08-12T10:10:00Z'))
+
+    hour = RideWaitRollup.objects.get(period='hour', start=at(10))
+    self.assertEqual((hour.samples, hour.wait_sum), (1, 20))
+
+
+class RebuildRollupsTest(TestCase):
+
+  def setUp(self):
+    """Sets up rides in two parks with history but no rollups"""
+
+    for ride_id, park_id in ((1, 1), (2, 2)):
+      ride = Ride.objects.create(id=ride_id, park_id=park_id, name='Ride',
+                                 category='Thrills', open_state=True,
+                                 wait_time=0, last_updated=at(9))
+
+      for hour, wait_time in ((10, 10), (10, 20), (23, 30)):
+        RideWaitSample.objects.create(ride=ride,
+                                      timestamp=at(hour, wait_time),
+                                      wait_time=wait_time, open_state=True)
+
+  def test_check_rollups_missing(self):
+    """Tests rollups missing for raw samples are reported"""
+
+    self.assertEqual(len(check_rollups()), 6)
+    self.assertEqual(len(check_rollups(park_id=1)), 3)
+
+  def test_rebuild_rollups(self):
+    """Tests rollups are rebuilt from the raw samples"""
+
+    self.assertEqual(rebuild_rollups(), 6)
+
+    self.assertEqual(check_rollups(), [])
+
+    day = RideWaitRollup.objects.get(ride_id=1, period='day')
+    self.assertEqual((day.samples, day.get_percentile(50)), (3, 20))
+
+    # Rebuilding again replaces the rollups rather than adding to them
+    rebuild_rollups(park_id=1)
+    self.assertEqual(RideWaitRollup.objects.count(), 6)
+    self.assertEqual(check_rollups(), [])
+
+  def test_check_rollups_difference(self):
+    """Tests rollups that differ from the raw samples are reported"""
+
+    rebuild_rollups()
+    RideWaitRollup.objects.filter(ride_id=1, period='hour',
+                                  start=at(10)).update(wait_sum=100)
+
+    differences = check_rollups()
+
+    # Its histogram no longer matches its wait_sum either
+    self.assertEqual(len(differences), 2)
+    self.assertIn("wait_sum is 100 not 30", differences[0])
+    self.assertIn("histogram", differences[1])
+
+  def test_rollup_commands(self):
+    """Tests the check fails until the rollups are backfilled"""
+
+    with self.assertRaises(CommandError):
+      call_command('check_rollups', stdout=StringIO())
+
+    call_command('backfill_rollups', stdout=StringIO())
+
+    out = StringIO()
+    call_command('check_rollups', stdout=out)
+    self.assertIn("Rollups match ride history", out.getvalue())
@@ -0,0 +1,65 @@
+"""
+Name: test_run_ingestor.py
+Author: Ryan Gascoigne-Jones
+
+Purpose: Tests the run_ingestor management command which polls
+  queue-times.com for each park
+"""
+
+from django.test import TestCase, override_settings
+from django.core.management import call_command
+from unittest.mock import patch, call
+from ..management.commands.run_ingestor import get_poll_intervals
+
+
+class RunIngestorTest(TestCase):
+
+  @override_settings(INGESTOR_PARKS={1: 60, 2: 120})
+  @patch('rides.utils.ingestion.save_queue_data')
+  def test_run_ingestor_once(self, mock_save_queue_data):
+    """Tests each configured park is ingested once with --once"""
+
+    call_command('run_ingestor', '--once')
+
+    mock_save_queue_data.assert_has_calls([call(park_id=1),
+                                           call(park_id=2)],
+                                          any_order=True)
+    self.assertEqual(mock_save_queue_data.call_count, 2)
+
+  @patch('rides.utils.ingestion.save_queue_data')
+  def test_run_ingestor_park_option(self, mock_save_queue_data):
+    """Tests parks passed with --park override the configured parks"""
+
+    call_command('run_ingestor', '--once', '--park', '3')
+
+    mock_save_queue_data.assert_called_once_with(park_id=3)
+
+  @override_settings(INGESTOR_PARKS={1: 60, 2: 120})
+  @patch('rides.utils.ingestion.save_queue_data')
+  def test_run_ingestor_failure(self, mock_save_queue_data):
+    """Tests that a failing park doesn't stop other parks being ingested"""
+
+    mock_save_queue_data.side_effect = [Exception("API down"), ['Family']]
+
+    with self.assertLogs('rides.utils.ingestion',
+                         level='ERROR'):
+      call_command('run_ingestor', '--once')
+
+    self.assertEqual(mock_save_queue_data.call_count, 2)
+
+
+class GetPollIntervalsTest(TestCase):
+
+  @override_settings(INGESTOR_PARKS={1: 30})
+  def test_get_poll_intervals_settings(self):
+    """Tests the configured parks are used by default"""
+
+    self.assertEqual(get_poll_intervals(parks=None, interval=None), {1: 30})
+
+  @override_settings(INGESTOR_DEFAULT_INTERVAL=90)
+  def test_get_poll_intervals_parks(self):
+    """Tests parks passed in use the given or default interval"""
+
+    self.assertEqual(get_poll_intervals(parks=[4, 5], interval=None),
+                     {4: 90, 5: 90})
+    self.assertEqual(get_poll_intervals(parks=[4], interval=15), {4: 15})
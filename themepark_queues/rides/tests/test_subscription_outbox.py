@@ -0,0 +1,237 @@
+"""
+Name: test_subscription_outbox.py
+Author: Ryan Gascoigne-Jones
+
+Purpose: Tests subscription_outbox.py file for queueing ride notification
+  subscriptions and writing them to the remote DB in batches
+"""
+
+from django.test import TestCase, override_settings
+from django.core.management import call_command
+from unittest.mock import patch
+from ..models import SubscriptionOutbox
+from ..utils import metrics
+from ..utils.firebase_access import get_email_key
+from ..utils.subscription_outbox import enqueue_notif, flush_outbox, \
+  get_outbox_update, get_outbox_stats
+from ..utils.timing import RequestTimings, request_timings
+
+
+class SubscriptionOutboxTest(TestCase):
+
+  def setUp(self):
+    """Queues subscriptions to two rides in different parks"""
+
+    enqueue_notif(park_id=1, ride_id=101, ride_name='Ride A',
+                  user_email='a@example.com')
+    enqueue_notif(park_id=1, ride_id=101, ride_name='Ride A',
+                  user_email='b@example.com')
+    enqueue_notif(park_id=2, ride_id=202, ride_name='Ride B',
+                  user_email='a@example.com')
+
+  def test_get_outbox_update(self):
+    """Tests every queued subscription is in one multi-path update"""
+
+    rows = list(SubscriptionOutbox.objects.order_by('id'))
+
+    self.assertEqual(get_outbox_update(rows=rows), {
+      '1/101/ride_id': 101,
+      '1/101/ride_name': 'Ride A',
+      f"1/101/subscribers/{get_email_key('a@example.com')}": 'a@example.com',
+      f"1/101/subscribers/{get_email_key('b@example.com')}": 'b@example.com',
+      '2/202/ride_id': 202,
+      '2/202/ride_name': 'Ride B',
+      f"2/202/subscribers/{get_email_key('a@example.com')}": 'a@example.com'
+    })
+
+  @patch('rides.utils.subscription_outbox.get_db')
+  def test_flush_outbox(self, mock_get_db):
+    """Tests queued subscriptions are written to the notifications root in
+    one update and removed from the outbox"""
+
+    mock_reference = mock_get_db.return_value.reference
+
+    self.assertEqual(flush_outbox(batch_size=100), 3)
+
+    mock_reference.assert_called_once_with('notifications')
+    mock_reference.return_value.update.assert_called_once()
+    self.assertEqual(
+      len(mock_reference.return_value.update.call_args.args[0]), 7)
+    self.assertFalse(SubscriptionOutbox.objects.exists())
+
+  @override_settings(METRICS_DIR=None)
+  @patch.dict(metrics._values, clear=True)
+  @patch('rides.utils.subscription_outbox.get_db')
+  def test_flush_outbox_timed(self, mock_get_db):
+    """Tests writes to the remote DB are timed as the firebase stage and
+    their latency recorded by operation"""
+
+    timings = RequestTimings()
+    token = request_timings.set(timings)
+
+    try:
+      flush_outbox(batch_size=100)
+    finally:
+      request_timings.reset(token)
+
+    self.assertEqual(timings.stages['firebase'][2], 1)
+    self.assertIn(
+      'themepark_firebase_seconds_count{operation="outbox_flush"} 1',
+      metrics.render_metrics())
+
+  @patch('rides.utils.subscription_outbox.get_db')
+  def test_flush_outbox_batch_size(self, mock_get_db):
+    """Tests only the oldest batch_size subscriptions are flushed"""
+
+    self.assertEqual(flush_outbox(batch_size=2), 2)
+
+    self.assertEqual(SubscriptionOutbox.objects.get().ride_id, 202)
+
+  @patch('rides.utils.subscription_outbox.get_db')
+  def test_flush_outbox_empty(self, mock_get_db):
+    """Tests the remote DB isn't written when the outbox is empty"""
+
+    SubscriptionOutbox.objects.all().delete()
+
+    self.assertEqual(flush_outbox(batch_size=100), 0)
+
+    mock_get_db.assert_not_called()
+
+  @patch('rides.utils.subscription_outbox.get_db')
+  def test_flush_outbox_failure(self, mock_get_db):
+    """Tests subscriptions are kept to be retried when the remote DB
+    can't be written"""
+
+    mock_get_db.return_value.reference.return_value.update.side_effect = \
+      Exception("Firebase down")
+
+    failures: float = get_outbox_stats()['failures']
+
+    with self.assertRaises(Exception):
+      with self.assertLogs('rides.utils.subscription_outbox', level='WARNING'):
+        flush_outbox(batch_size=100)
+
+    # Only the row which failed on its own counts the attempt
+    self.assertEqual(SubscriptionOutbox.objects.count(), 3)
+    self.assertEqual(
+      list(SubscriptionOutbox.objects.order_by('id')
+                                     .values_list('attempts', flat=True)),
+      [1, 0, 0])
+    self.assertEqual(get_outbox_stats()['failures'], failures + 1)
+
+  @patch('rides.utils.subscription_outbox.get_db')
+  def test_flush_outbox_poison_row(self, mock_get_db):
+    """Tests a subscription the remote DB rejects doesn't hold back the
+    rest of its batch"""
+
+    def update(paths):
+      if any(path.startswith('2/') for path in paths):
+        raise ValueError("Rejected")
+
+    mock_get_db.return_value.reference.return_value.update.side_effect = \
+      update
+
+    rows = list(SubscriptionOutbox.objects.order_by('id'))
+    # Flushed after the others as it has already failed once
+    SubscriptionOutbox.objects.filter(id=rows[0].id).update(attempts=1)
+
+    with self.assertRaises(ValueError):
+      with self.assertLogs('rides.utils.subscription_outbox', level='WARNING'):
+        flush_outbox(batch_size=100)
+
+    # The row before the rejected one is written, the rejected row is
+    # counted and the row after it is left for the next flush, which
+    # writes it first as it has the lowest id
+    self.assertEqual(
+      list(SubscriptionOutbox.objects.order_by('id')
+                                     .values_list('id', 'attempts')),
+      [(rows[0].id, 1), (rows[2].id, 1)])
+
+    self.assertEqual(flush_outbox(batch_size=1), 1)
+    self.assertEqual(SubscriptionOutbox.objects.get().id, rows[2].id)
+
+  @override_settings(SUBSCRIPTION_OUTBOX_MAX_ATTEMPTS=2)
+  @patch('rides.utils.subscription_outbox.get_db')
+  def test_flush_outbox_max_attempts(self, mock_get_db):
+    """Tests a subscription is logged and no longer flushed once it reaches
+    the max attempts"""
+
+    mock_get_db.return_value.reference.return_value.update.side_effect = \
+      Exception("Rejected")
+
+    SubscriptionOutbox.objects.exclude(ride_id=202).delete()
+
+    with self.assertRaises(Exception):
+      flush_outbox(batch_size=100)
+
+    with self.assertLogs('rides.utils.subscription_outbox', level='ERROR'):
+      with self.assertRaises(Exception):
+        flush_outbox(batch_size=100)
+
+    self.assertEqual(flush_outbox(batch_size=100), 0)
+    self.assertEqual(get_outbox_stats()['dead'], 1)
+
+  @patch('rides.utils.subscription_outbox.get_db')
+  def test_get_outbox_stats(self, mock_get_db):
+    """Tests the outbox depth is reported before and after flushing"""
+
+    stats = get_outbox_stats()
+    self.assertEqual(stats['depth'], 3)
+    self.assertGreaterEqual(stats['oldest_seconds'], 0)
+
+    flushed: float = stats['flushed']
+
+    flush_outbox(batch_size=100)
+
+    stats = get_outbox_stats()
+    self.assertEqual(stats['depth'], 0)
+    self.assertEqual(stats['oldest_seconds'], 0)
+    self.assertEqual(stats['flushed'], flushed + 3)
+
+
+class FlushSubscriptionsCommandTest(TestCase):
+
+  @override_settings(SUBSCRIPTION_OUTBOX_BATCH_SIZE=2)
+  @patch('rides.utils.subscription_outbox.get_db')
+  def test_flush_subscriptions_once(self, mock_get_db):
+    """Tests full batches are flushed until the outbox is empty"""
+
+    for ride_id in range(5):
+      enqueue_notif(park_id=1, ride_id=ride_id, ride_name='Ride',
+                    user_email='a@example.com')
+
+    call_command('flush_subscriptions', '--once')
+
+    self.assertFalse(SubscriptionOutbox.objects.exists())
+    self.assertEqual(
+      mock_get_db.return_value.reference.return_value.update.call_count, 3)
+
+  @patch('rides.utils.subscription_outbox.get_db')
+  def test_flush_subscriptions_failure(self, mock_get_db):
+    """Tests a failed flush is logged rather than stopping the worker"""
+
+    mock_get_db.return_value.reference.return_value.update.side_effect = \
+      Exception("Firebase down")
+
+    enqueue_notif(park_id=1, ride_id=101, ride_name='Ride A',
+                  user_email='a@example.com')
+
+    with self.assertLogs('rides.management.commands.flush_subscriptions',
+                         level='ERROR'):
+      call_command('flush_subscriptions', '--once')
+
+    self.assertTrue(SubscriptionOutbox.objects.exists())
+
+  @override_settings(SUBSCRIPTION_OUTBOX_MAX_ATTEMPTS=2)
+  @patch('rides.utils.subscription_outbox.get_db')
+  def test_flush_subscriptions_retry_dead(self, mock_get_db):
+    """Tests subscriptions which were given up on are requeued"""
+
+    row = enqueue_notif(park_id=1, ride_id=101, ride_name='Ride A',
+                        user_email='a@example.com')
+    SubscriptionOutbox.objects.filter(id=row.id).update(attempts=2)
+
+    call_command('flush_subscriptions', '--retry-dead')
+
+    self.assertEqual(SubscriptionOutbox.objects.get().attempts, 0)
+    mock_get_db.assert_not_called()
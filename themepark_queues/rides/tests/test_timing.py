@@ -0,0 +1,97 @@
+"""
+Name: test_timing.py
+Author: Ryan Gascoigne-Jones
+
+Purpose: Tests timing.py file and ServerTimingMiddleware for timing the
+  stages of sampled requests
+"""
+
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.core.cache import cache
+import json
+from ..models import Ride, Park
+from ..utils.timing import RequestTimings, request_timings, stage, timed
+
+
+@timed('double')
+def double(value: int) -> int:
+  return value * 2
+
+
+class TimingTest(TestCase):
+
+  def test_stage_not_sampled(self):
+    """Tests stages outside a sampled request record nothing"""
+
+    self.assertIsNone(request_timings.get())
+
+    with stage('unsampled'):
+      pass
+
+    self.assertEqual(double(2), 4)
+
+  def test_stage_sampled(self):
+    """Tests stages record their calls and queries, summing repeated
+    stages"""
+
+    timings = RequestTimings()
+    token = request_timings.set(timings)
+
+    try:
+      with stage('outer'):
+        timings.queries += 2
+        self.assertEqual(double(2), 4)
+        self.assertEqual(double(3), 6)
+    finally:
+      request_timings.reset(token)
+
+    self.assertEqual(timings.stages['outer'][1:], [2, 1])
+    self.assertEqual(timings.stages['double'][1:], [0, 2])
+
+    header = timings.get_server_timing()
+    self.assertIn('outer;dur=', header)
+    self.assertIn('desc="2 queries"', header)
+    self.assertIn('total;dur=', header)
+
+
+class ServerTimingMiddlewareTest(TestCase):
+
+  def setUp(self):
+    """Sets up a park with rides to render on the homepage"""
+
+    cache.clear()
+
+    Park.objects.create(id=1, categories=['Family'], version=1)
+    Ride.objects.create(id=1, park_id=1, name='Family Ride', category='Family',
+                        open_state=True, wait_time=10,
+                        last_updated='2024-01-01T00:00:00Z')
+
+  @override_settings(SERVER_TIMING_SAMPLE_RATE=1.0)
+  def test_sampled_request_timed(self):
+    """Tests sampled requests get a Server-Timing header with each stage
+    and a structured log line"""
+
+    with self.assertLogs('rides.middleware', level='INFO') as logs:
+      response = self.client.get(reverse('home'))
+
+    header = response['Server-Timing']
+    for name in ['ride_categories', 'compile_rides', 'render', 'db', 'total']:
+      self.assertIn(f'{name};dur=', header)
+
+    line = json.loads(logs.records[0].getMessage())
+    self.assertEqual(line['event'], 'request_timing')
+    self.assertEqual(line['path'], reverse('home'))
+    self.assertEqual(line['status'], 200)
+    self.assertEqual(line['stages']['compile_rides']['queries'], 1)
+    self.assertGreaterEqual(line['queries'], 2)
+
+  @override_settings(SERVER_TIMING_SAMPLE_RATE=0.0)
+  def test_unsampled_request_not_timed(self):
+    """Tests requests which aren't sampled get no header or log line"""
+
+    with self.assertNoLogs('rides.middleware', level='INFO'):
+      response = self.client.get(reverse('home'))
+
+    self.assertEqual(response.status_code, 200)
+    self.assertNotIn('Server-Timing', response)
@@ -6,14 +6,18 @@ Purpose: Tests views.py file for all interaction with user views and html
   files
 """
 
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.urls import reverse
 from django.contrib.auth.models import User
 from django.contrib.auth import get_user_model, get_user
 from django.contrib import auth
 from unittest.mock import patch
-from ..models import Ride
+from ..models import Ride, Park, RideForecast, Subscription, \
+  SubscriptionOutbox
+from ..utils.api_request import get_queue_data
 from django.utils import timezone
+from datetime import timedelta
+from django.core.cache import cache
 
 
 class HomeViewTest(TestCase):
@@ -23,6 +27,9 @@ class HomeViewTest(TestCase):
 
     self.mocked_rides = ([['family_ride_1', 'family_ride_2'], ['thrill_ride_1', 'thrill_ride_2']], ['Family', 'Thrills'])
 
+    # Clears pages cached by other tests
+    cache.clear()
+
   @patch('rides.views.get_queue_data')
   def test_home_view_rendered(self, mock_get_queue_data):
     """Tests that the homepage is rendered correctly"""
@@ -42,10 +49,11 @@ class HomeViewTest(TestCase):
     mock_get_queue_data.return_value = self.mocked_rides
     response = self.client.get(reverse('home'))
 
-    # Check rides list is in context
-    self.assertIn('rides_list', response.context)
-    # Check context contains rides
-    self.assertEqual(response.context['rides_list'], [['family_ride_1', 'family_ride_2'], ['thrill_ride_1', 'thrill_ride_2']])
+    # Check the rides of each category are only passed within its land
+    self.assertNotIn('rides_list', response.context)
+    self.assertEqual([land['rides'] for land in response.context['lands']],
+                     [['family_ride_1', 'family_ride_2'],
+                      ['thrill_ride_1', 'thrill_ride_2']])
 
   @patch('rides.views.get_queue_data')
   def test_home_view_context_lands(self, mock_get_queue_data):
@@ -54,9 +62,12 @@ class HomeViewTest(TestCase):
     mock_get_queue_data.return_value = self.mocked_rides
     response = self.client.get(reverse('home'))
 
-    # Check context contains land_names and it's correctly converted to JSON
-    self.assertIn('land_names', response.context)
-    self.assertEqual(response.context['land_names'], '["Family", "Thrills"]')
+    # Check context contains each land's name with its rides
+    self.assertIn('lands', response.context)
+    self.assertEqual([land['name'] for land in response.context['lands']],
+                     ['Family', 'Thrills'])
+    self.assertEqual(response.context['lands'][1]['rides'],
+                     ['thrill_ride_1', 'thrill_ride_2'])
 
   @patch('rides.views.get_queue_data')
   def test_home_view_contains_table_headers(self, mock_get_queue_data):
@@ -65,9 +76,10 @@ class HomeViewTest(TestCase):
     mock_get_queue_data.return_value = self.mocked_rides
     response = self.client.get(reverse('home'))
 
-    # Tests table headers
-    self.assertContains(response, 'Family')
-    self.assertContains(response, 'Thrills')
+    # Tests table headers are rendered without a script
+    self.assertContains(response, '<h2>Family</h2>')
+    self.assertContains(response, '<h2>Thrills</h2>')
+    self.assertNotContains(response, 'document.write')
 
   @patch('rides.views.get_queue_data')
   def test_home_view_displays_rides(self, mock_get_queue_data):
@@ -81,7 +93,7 @@ class HomeViewTest(TestCase):
       {'name': 'thrill_ride_2', 'wait_time': 5, 'open_state': True},
     ], ['Family', 'Thrills'])
 
-    mock_get_queue_data.return_value = [[ride for ride in mocked_rides[:2]], [ride for ride in mocked_rides[2:]]]
+    mock_get_queue_data.return_value = ([mocked_rides[0][:2], mocked_rides[0][2:]], mocked_rides[1])
     response = self.client.get(reverse('home'))
 
     # Check that the page contains the ride names and wait times
@@ -95,6 +107,90 @@ class HomeViewTest(TestCase):
     self.assertContains(response, '5')
 
 
+class HomeViewCacheTest(TestCase):
+
+  def setUp(self):
+    """Sets up an ingested park with a ride and a user to log in as"""
+
+    cache.clear()
+
+    self.park = Park.objects.create(id=1, categories=['Family'],
+                                    last_ingested=timezone.now(), version=1)
+    self.ride = Ride.objects.create(id=1, park_id=1, name='Family Ride 1',
+                                    category='Family', open_state=True,
+                                    wait_time=15, last_updated=timezone.now())
+
+    self.user = User.objects.create_user(
+      username='testuser@example.com',
+      email='testuser@example.com',
+      password='testpass'
+    )
+
+  @patch('rides.views.get_queue_data', wraps=get_queue_data)
+  def test_home_view_anonymous_cached(self, mock_get_queue_data):
+    """Tests anonymous users are served the cached page for the current
+    snapshot"""
+
+    first = self.client.get(reverse('home'))
+    second = self.client.get(reverse('home'))
+
+    self.assertEqual(mock_get_queue_data.call_count, 1)
+    self.assertEqual(first.content, second.content)
+    self.assertContains(second, 'Family Ride 1')
+
+  def test_home_view_new_snapshot(self):
+    """Tests a new snapshot version replaces the cached page"""
+
+    self.client.get(reverse('home'))
+
+    Ride.objects.filter(id=1).update(name='Renamed Ride')
+    Park.objects.filter(id=1).update(version=2, land_versions={'Family': 1})
+
+    response = self.client.get(reverse('home'))
+    self.assertContains(response, 'Renamed Ride')
+
+  def test_home_view_unchanged_land_cached(self):
+    """Tests only the tables of lands with a new version are rendered
+    again after a new snapshot"""
+
+    Park.objects.filter(id=1).update(categories=['Family', 'Thrills'])
+    Ride.objects.create(id=2, park_id=1, name='Thrill Ride 1',
+                        category='Thrills', open_state=True, wait_time=40,
+                        last_updated=timezone.now())
+    self.client.get(reverse('home'))
+
+    # Both rides change, but only Thrills has a new version
+    Ride.objects.filter(id=1).update(name='Renamed Family Ride')
+    Ride.objects.filter(id=2).update(name='Renamed Thrill Ride')
+    Park.objects.filter(id=1).update(version=2, land_versions={'Thrills': 1})
+
+    response = self.client.get(reverse('home'))
+    self.assertContains(response, 'Family Ride 1')
+    self.assertContains(response, 'Renamed Thrill Ride')
+
+  @override_settings(PAGE_CACHE_TIMEOUT=60)
+  def test_home_view_cache_expires(self):
+    """Tests cached pages expire so old snapshot versions don't build up"""
+
+    with patch('rides.utils.page_cache.cache') as mock_cache:
+      mock_cache.get.return_value = None
+      self.client.get(reverse('home'))
+
+    self.assertEqual(mock_cache.set.call_args.kwargs['timeout'], 60)
+
+  def test_home_view_authenticated_navbar(self):
+    """Tests logged in users get their own navbar rather than the page
+    cached for anonymous users"""
+
+    self.client.get(reverse('home'))
+
+    self.client.login(username='testuser@example.com', password='testpass')
+    response = self.client.get(reverse('home'))
+
+    self.assertContains(response, 'Account: testuser@example.com')
+    self.assertContains(response, 'Family Ride 1')
+
+
 class RegisterViewTest(TestCase):
 
   def setUp(self):
@@ -244,6 +340,20 @@ class AccountViewTest(TestCase):
     response = self.client.get(reverse('account'))
     self.assertEqual(response.status_code, 200)
 
+  def test_account_view_subscriptions(self):
+    """Tests the rides the user is subscribed to are listed"""
+
+    ride = Ride.objects.create(id=1, name="Test Ride", category="Thrill",
+                               open_state=False, wait_time=0,
+                               last_updated=timezone.now())
+    Subscription.objects.create(user=self.user, park_id=1, ride=ride)
+
+    self.client.login(username='testuser@example.com', password='testpass')
+    response = self.client.get(reverse('account'))
+    self.assertEqual([subscription.ride for subscription
+                      in response.context['subscriptions']], [ride])
+    self.assertContains(response, "Test Ride")
+
   def test_account_view_anonymous(self):
     """Tests account view redirects to login page if user is
     unauthenticated"""
@@ -315,11 +425,15 @@ class RideInfoViewTest(TestCase):
       wait_time=30,
       last_updated=timezone.now()
     )
+
+    # Park was ingested recently so ride data is read from the local DB
+    self.park = Park.objects.create(id=1, categories=["Thrill"],
+                                    last_ingested=timezone.now())
     
-  # Mocks the add_notif function
-  @patch('rides.views.add_notif')
-  def test_ride_info_view_authenticated_user(self, mock_add_notif):
-    """Tests that a user can subscribe if they are logged in"""
+  @patch('rides.utils.firebase_access.get_db')
+  def test_ride_info_view_authenticated_user(self, mock_get_db):
+    """Tests that a user can subscribe if they are logged in, and that the
+    subscription is queued rather than written to the remote DB"""
 
     # Logs user in
     self.client.login(username='testuser@example.com', password='testpass')
@@ -330,13 +444,58 @@ class RideInfoViewTest(TestCase):
     self.assertEqual(response.context['ride'], self.ride)
     self.assertTrue(response.context['subscribed'])
 
-    # Check that add_notif was called once with correct arguments
-    mock_add_notif.assert_called_once_with(
-      park_id=1,
-      ride_id=self.ride.id,
-      ride_name=self.ride.name,
-      user_email='testuser@example.com'
-    )
+    # Checks the subscription was queued with the correct data
+    outbox = SubscriptionOutbox.objects.get()
+    self.assertEqual(outbox.park_id, 1)
+    self.assertEqual(outbox.ride_id, self.ride.id)
+    self.assertEqual(outbox.ride_name, self.ride.name)
+    self.assertEqual(outbox.user_email, 'testuser@example.com')
+
+    # Checks the remote DB wasn't accessed during the request
+    mock_get_db.assert_not_called()
+
+    # Checks the subscription was added to the local index
+    self.assertTrue(Subscription.objects.filter(user=self.user, park_id=1,
+                                                ride=self.ride).exists())
+
+  def test_ride_info_view_already_subscribed(self):
+    """Tests subscribed users see their subscription and that subscribing
+    again doesn't queue another remote DB write"""
+
+    Subscription.objects.create(user=self.user, park_id=1, ride=self.ride)
+
+    self.client.login(username='testuser@example.com', password='testpass')
+
+    response = self.client.get(reverse('ride-info', kwargs={'ride_id': self.ride.id}))
+    self.assertTrue(response.context['subscribed'])
+
+    response = self.client.post(reverse('ride-info', kwargs={'ride_id': self.ride.id}))
+    self.assertTrue(response.context['subscribed'])
+    self.assertFalse(SubscriptionOutbox.objects.exists())
+    self.assertEqual(Subscription.objects.count(), 1)
+
+  def test_ride_info_view_not_subscribed(self):
+    """Tests logged in users that haven't subscribed can subscribe"""
+
+    self.client.login(username='testuser@example.com', password='testpass')
+
+    response = self.client.get(reverse('ride-info', kwargs={'ride_id': self.ride.id}))
+    self.assertFalse(response.context['subscribed'])
+    self.assertContains(response, "Subscribe")
+
+  def test_ride_info_view_forecast(self):
+    """Tests upcoming forecast wait times of the ride are shown"""
+
+    now = timezone.now()
+    RideForecast.objects.create(ride=self.ride, fitted_at=now, waits=[
+      {'time': (now - timedelta(minutes=30)).isoformat(), 'wait_time': 5},
+      {'time': (now + timedelta(minutes=30)).isoformat(), 'wait_time': 45}
+    ])
+
+    response = self.client.get(reverse('ride-info', kwargs={'ride_id': self.ride.id}))
+    self.assertEqual([step['wait_time'] for step in response.context['forecast']],
+                     [45])
+    self.assertContains(response, "45 mins")
 
   def test_ride_info_view_anonymous_user(self):
     """Tests that a user cannot subscribe if they aren't logged in"""
@@ -346,6 +505,20 @@ class RideInfoViewTest(TestCase):
     self.assertFalse(response.context['subscribed'])
 
 
+  @patch('rides.utils.api_request.save_queue_data')
+  def test_ride_info_view_only_reads(self, mock_save_queue_data):
+    """Tests ride data is never requested by the view, even when the local
+    snapshot is old, so only the ingestor writes rides"""
+
+    Park.objects.filter(id=1).update(
+      last_ingested=timezone.now() - timedelta(hours=1))
+
+    response = self.client.get(reverse('ride-info', kwargs={'ride_id': self.ride.id}))
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(response.context['ride'], self.ride)
+    mock_save_queue_data.assert_not_called()
+
+
 class AboutViewTest(TestCase):
 
   def test_about_view_rendered(self):
@@ -353,3 +526,84 @@ class AboutViewTest(TestCase):
     response = self.client.get(reverse('about'))
     self.assertEqual(response.status_code, 200)
 
+
+class ParkQueuesViewTest(TestCase):
+
+  def setUp(self):
+    """Sets up an ingested park with rides in two lands"""
+
+    cache.clear()
+
+    self.park = Park.objects.create(id=1, categories=['Family', 'Thrills'],
+                                    last_ingested=timezone.now(), version=4)
+    self.last_updated = timezone.now()
+    Ride.objects.create(id=1, park_id=1, name='Family Ride 1',
+                        category='Family', open_state=True, wait_time=15,
+                        last_updated=self.last_updated)
+    Ride.objects.create(id=2, park_id=1, name='Thrill Ride 1',
+                        category='Thrills', open_state=False, wait_time=0,
+                        last_updated=self.last_updated)
+
+    self.url = reverse('park-queues', kwargs={'park_id': 1})
+
+  def test_park_queues_json(self):
+    """Tests the park's lands and rides are returned as JSON"""
+
+    response = self.client.get(self.url)
+
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(response['Content-Type'], 'application/json')
+    self.assertEqual(response.json(), {
+      'park_id': 1,
+      'version': 4,
+      'lands': [
+        {'name': 'Family', 'rides': [
+          {'id': 1, 'name': 'Family Ride 1', 'is_open': True,
+           'wait_time': 15, 'last_updated': self.last_updated.isoformat()}
+        ]},
+        {'name': 'Thrills', 'rides': [
+          {'id': 2, 'name': 'Thrill Ride 1', 'is_open': False,
+           'wait_time': 0, 'last_updated': self.last_updated.isoformat()}
+        ]}
+      ]
+    })
+
+  def test_park_queues_headers(self):
+    """Tests a strong ETag for the snapshot and Cache-Control are sent"""
+
+    response = self.client.get(self.url)
+
+    self.assertEqual(response['ETag'], '"1-4"')
+    self.assertIn('public', response['Cache-Control'])
+    self.assertIn('max-age', response['Cache-Control'])
+
+  def test_park_queues_not_modified(self):
+    """Tests clients with the current version get a 304 response"""
+
+    response = self.client.get(self.url, HTTP_IF_NONE_MATCH='"1-4"')
+    self.assertEqual(response.status_code, 304)
+
+    # An old version gets the new data
+    response = self.client.get(self.url, HTTP_IF_NONE_MATCH='"1-3"')
+    self.assertEqual(response.status_code, 200)
+
+  @patch('rides.views.get_queue_data', wraps=get_queue_data)
+  def test_park_queues_serialised_once(self, mock_get_queue_data):
+    """Tests the snapshot is only serialised once per version"""
+
+    first = self.client.get(self.url)
+    second = self.client.get(self.url)
+
+    self.assertEqual(mock_get_queue_data.call_count, 1)
+    self.assertEqual(first.content, second.content)
+
+    # A new snapshot is serialised again
+    Park.objects.filter(id=1).update(version=5)
+    self.client.get(self.url)
+    self.assertEqual(mock_get_queue_data.call_count, 2)
+
+  def test_park_queues_not_ingested(self):
+    """Tests a park that hasn't been ingested isn't found"""
+
+    response = self.client.get(reverse('park-queues', kwargs={'park_id': 2}))
+    self.assertEqual(response.status_code, 404)
@@ -8,5 +8,10 @@ urlpatterns = [
   path('account', views.account, name='account'),
   path('logout', views.logout, name='logout'),
   path('ride-info/<int:ride_id>', views.ride_info, name='ride-info'),
-  path('about', views.about, name='about')
+  path('about', views.about, name='about'),
+  path('api/parks/<int:park_id>/queues', views.park_queues,
+       name='park-queues'),
+  path('api/parks/<int:park_id>/events', views.park_events,
+       name='park-events'),
+  path('metrics', views.metrics, name='metrics')
 ]
\ No newline at end of file
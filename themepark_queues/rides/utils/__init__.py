@@ -1,2 +1,2 @@
-from .api_request import get_queue_data, save_queue_data
-from .firebase_access import add_notif
\ No newline at end of file
+from .api_request import get_queue_data, save_queue_data, \
+  serialise_queue_data
\ No newline at end of file
@@ -6,42 +6,229 @@ Purpose: Contains additional functions used to retrieve queue data from
   an API
 """
 
-from django.db.models import QuerySet
+from datetime import datetime
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+import hashlib
 import requests
-from ..models import Ride
+from requests.adapters import HTTPAdapter
+import threading
+from typing import NamedTuple, Optional
+from urllib3.util.retry import Retry
+from ..models import Ride, Park, RideWaitSample
+from ..signals import RideChange, rides_changed
+from .metrics import inc, timer
+from .rollups import update_rollups
+from .timing import timed
+
+# Fields of a Ride overwritten when a park is ingested again
+RIDE_UPDATE_FIELDS: list[str] = ['park_id', 'name', 'category', 'open_state',
+                                 'wait_time', 'last_updated']
+
+# Session shared by all requests to queue-times.com, created on first use
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+# ETag, Last-Modified and body hash of the last saved response for each
+# park
+_validators: dict[int, dict[str, str]] = {}
+_validators_lock = threading.Lock()
+
+# Counts of polls and how many were short-circuited
+_fetch_stats: dict[str, int] = {'polls': 0, 'not_modified': 0, 'unchanged': 0,
+                                'errors': 0}
 
 def save_queue_data(park_id: int) -> list[str]:
-  """Retrieves all current ride data for the park of park_id passed and
-  updates local DB. Returns the list of categories for that park"""
+  """Requests all current ride data for the park of park_id passed from
+  queue-times.com and updates local DB. Returns the list of categories for
+  that park"""
+
+  # Gets a list of all rides with attributes in dictionaries, None if
+  # the park's data hasn't changed since it was last saved
+  response: Optional[RidesResponse] = get_rides(park_id=park_id,
+                                                conditional=True)
+
+  if response is None:
+    # Nothing to write, but the stored snapshot is confirmed current
+    Park.objects.filter(id=park_id).update(last_ingested=timezone.now())
+    return get_ride_categories(park_id=park_id)
+
+  rides_req_lands: list[dict] = response.lands
 
-  # Gets a list of all rides with attributes in dictionaries
-  rides_req_lands: list[dict] = get_rides(park_id=park_id)
+  # Writes the whole park snapshot in a single transaction
+  with transaction.atomic():
+    # Locked before the rides are diffed, so concurrent ingestions of the
+    # park are serialised rather than both writing the same changes
+    park, created = Park.objects.select_for_update()\
+                                .get_or_create(id=park_id)
 
-  # List of all ride categories
-  ride_categories: list[str] = create_rides(park_id=park_id,
-                                       rides_lands=rides_req_lands)
+    # List of all ride categories and the rides which changed
+    ride_categories, changes = save_rides(park_id=park_id,
+                                          rides_lands=rides_req_lands)
+
+    # Records the snapshot so views can read it without calling the API,
+    # bumping the version used to key cached pages only if it changed
+    changed: bool = bool(changes) or created or \
+                    ride_categories != park.categories
+
+    Park.objects.filter(id=park_id).update(
+      categories=ride_categories,
+      last_ingested=timezone.now(),
+      version=F('version') + int(changed),
+      land_versions=bump_land_versions(changes=changes,
+                                       land_versions=park.land_versions)
+    )
+
+    # Only once the rides they describe are committed are the validators
+    # used to skip later polls as unchanged. Data fetched but not saved is
+    # never skipped
+    transaction.on_commit(lambda: remember_validators(
+      park_id=park_id, validators=response.validators))
 
   return ride_categories
 
 
-def get_queue_data(park_id: int) -> tuple[list[QuerySet], list[str]]:
-  """Retrieves up to date ride data from DB for all rides in park by
-  category"""
+def bump_land_versions(changes: list[RideChange],
+                       land_versions: Optional[dict[str, int]] = None
+                       ) -> dict[str, int]:
+  """Increments the version of each category/land a changed ride was
+  added to or moved out of, keeping the versions of unchanged lands"""
+
+  land_versions = dict(land_versions or {})
+
+  changed_lands: set[str] = {change.category for change in changes} | \
+                            {change.old_category for change in changes
+                             if change.old_category is not None}
+
+  for land in changed_lands:
+    land_versions[land] = land_versions.get(land, 0) + 1
 
-  # Saves ride data to local DB
-  ride_categories: list[str] = save_queue_data(park_id=park_id)
+  return land_versions
+
+
+@timed('ride_categories')
+def get_ride_categories(park_id: int) -> list[str]:
+  """Retrieves the list of categories stored by the last ingestion of
+  the park. Empty if the park has not been ingested yet"""
+
+  park: Optional[Park] = Park.objects.filter(id=park_id).first()
+
+  if park is None:
+    return []
+
+  return park.categories
+
+
+def get_queue_data(park_id: int) -> tuple[list[list[Ride]], list[str]]:
+  """Retrieves ride data from local DB for all rides in park by
+  category. The DB is kept up to date by the run_ingestor command"""
+
+  ride_categories: list[str] = get_ride_categories(park_id=park_id)
   
   # Compiles list of rides to show in tables
-  rides: list[QuerySet] = compile_rides_list(ride_categories=ride_categories)
+  rides: list[list[Ride]] = compile_rides_list(
+    ride_categories=ride_categories, park_id=park_id)
   
   return (rides, ride_categories)
 
 
-def get_rides(park_id: int) -> list[dict]:
-  """Sends GET request to queue-times.com for the specified park"""
+def get_session() -> requests.Session:
+  """Produces the session shared by all requests to queue-times.com, which
+  keeps connections alive and retries failed requests"""
+
+  global _session
+
+  with _session_lock:
+    if _session is None:
+      _session = create_session()
+
+  return _session
+
 
-  response = requests.get(f"https://queue-times.com/parks/{park_id}/"\
-                          "queue_times.json")
+def create_session() -> requests.Session:
+  """Creates a session with a connection pool big enough for the
+  ingestor's workers that retries connection errors and 5xx responses
+  with jittered backoff"""
+
+  retry = Retry(total=settings.QUEUE_TIMES_RETRIES,
+                backoff_factor=settings.QUEUE_TIMES_BACKOFF,
+                backoff_jitter=settings.QUEUE_TIMES_BACKOFF,
+                status_forcelist=[500, 502, 503, 504],
+                allowed_methods=['GET'],
+                raise_on_status=False)
+
+  adapter = HTTPAdapter(pool_maxsize=settings.INGESTOR_MAX_WORKERS,
+                        max_retries=retry)
+
+  session = requests.Session()
+  session.mount('https://', adapter)
+  session.mount('http://', adapter)
+
+  return session
+
+
+class RidesResponse(NamedTuple):
+  """Lands and rides of a park returned by queue-times.com"""
+
+  lands: list[dict]
+  # Body hash, ETag and Last-Modified of the response, remembered once its
+  # rides are saved
+  validators: dict[str, str]
+
+
+@timed('upstream')
+def get_rides(park_id: int,
+              conditional: bool = False) -> Optional[RidesResponse]:
+  """Sends GET request to queue-times.com for the specified park. With
+  conditional=True the request uses the validators of the last saved
+  response and None is returned if the park's data hasn't changed since
+  then"""
+
+  with _validators_lock:
+    validators: dict[str, str] = _validators.get(park_id, {})
+
+  headers: dict[str, str] = {}
+  if conditional:
+    if 'etag' in validators:
+      headers['If-None-Match'] = validators['etag']
+    if 'last_modified' in validators:
+      headers['If-Modified-Since'] = validators['last_modified']
+
+  record_fetch('polls')
+
+  try:
+    with timer('themepark_upstream_request_seconds'):
+      response = get_session().get(
+        f"{settings.QUEUE_TIMES_URL}/parks/{park_id}/queue_times.json",
+        headers=headers,
+        timeout=(settings.QUEUE_TIMES_CONNECT_TIMEOUT,
+                 settings.QUEUE_TIMES_READ_TIMEOUT))
+
+    if conditional and response.status_code == 304:
+      record_fetch('not_modified')
+      return None
+
+    # Raises for error responses still failing after retries
+    response.raise_for_status()
+  except requests.RequestException:
+    record_fetch('errors')
+    raise
+
+  body_hash: str = hashlib.sha256(response.content).hexdigest()
+
+  new_validators: dict[str, str] = {'hash': body_hash}
+  if response.headers.get('ETag'):
+    new_validators['etag'] = response.headers['ETag']
+  if response.headers.get('Last-Modified'):
+    new_validators['last_modified'] = response.headers['Last-Modified']
+
+  # Skips parsing a body identical to the last one saved
+  if conditional and validators.get('hash') == body_hash:
+    record_fetch('unchanged')
+    return None
 
   # Converts json response into a dictionary of all rides
   rides_req_dict: dict = response.json()
@@ -49,43 +236,264 @@ def get_rides(park_id: int) -> list[dict]:
   # Gets value of lands key into a list
   rides_req_lands: list[dict] = rides_req_dict['lands']
 
-  return rides_req_lands
+  return RidesResponse(lands=rides_req_lands, validators=new_validators)
+
+
+def remember_validators(park_id: int, validators: dict[str, str]) -> None:
+  """Stores the validators of the park's last saved response, sent with
+  the next conditional request"""
+
+  with _validators_lock:
+    _validators[park_id] = validators
+
+
+def forget_validators(park_id: int) -> None:
+  """Forgets the validators of the park's last response, so the next
+  conditional request always returns its data"""
+
+  with _validators_lock:
+    _validators.pop(park_id, None)
 
 
+def record_fetch(result: str) -> None:
+  """Counts a request to queue-times.com and whether it was short-circuited
+  by a 304 response, an unchanged body or failed"""
+
+  with _validators_lock:
+    _fetch_stats[result] += 1
+
+  inc(f'themepark_upstream_{result}_total')
+
+
+def get_fetch_stats() -> dict[str, int]:
+  """Produces the number of polls made by this process and how many of
+  them were not modified, unchanged or failed"""
+
+  with _validators_lock:
+    return dict(_fetch_stats)
+
+
+@timed('create_rides')
 def create_rides(park_id: int, rides_lands: list[dict]) -> list[str]:
   """Creates rides in park from json and saves in local DB and compiles a
   list of ride categories/lands"""
+
+  ride_categories, _ = save_rides(park_id=park_id, rides_lands=rides_lands)
+
+  return ride_categories
+
+
+@timed('save_rides')
+def save_rides(park_id: int,
+               rides_lands: list[dict]) -> tuple[list[str], list[RideChange]]:
+  """Saves only the rides in park whose data has changed and compiles a
+  list of ride categories/lands. rides_changed is sent with the changes
+  once they are committed"""
   
-  # Creates an object for each ride in the local DB
+  # Creates an object for each ride in the park
   ride_category: list[str] = []
+  rides: list[Ride] = []
   for i in range(len(rides_lands)):
     # Adds category name to list
     ride_category.append(rides_lands[i]['name'])
 
     for cur_ride in (rides_lands[i])['rides']:
 
-      ride = Ride(
+      rides.append(Ride(
         id = cur_ride['id'],
+        park_id = park_id,
         name = cur_ride['name'],
         category = ride_category[i],
         open_state = cur_ride['is_open'],
         wait_time = cur_ride['wait_time'],
         last_updated = cur_ride['last_updated']
-      )
-      ride.save()
+      ))
+
+  changed_rides, changes = diff_rides(rides=rides)
+
+  # Inserts or updates every changed ride in one statement rather than one
+  # query per ride, and appends their wait times to the history
+  if changed_rides:
+    with transaction.atomic():
+      Ride.objects.bulk_create(changed_rides,
+                               update_conflicts=True,
+                               unique_fields=['id'],
+                               update_fields=RIDE_UPDATE_FIELDS)
+      save_wait_samples(rides=changed_rides)
+
+      transaction.on_commit(lambda: rides_changed.send(
+        sender=Ride, park_id=park_id, changes=changes))
+      transaction.on_commit(lambda: inc('themepark_rides_written_total',
+                                        len(changed_rides)))
+
+  return (ride_category, changes)
+
+
+def diff_rides(rides: list[Ride]) -> tuple[list[Ride], list[RideChange]]:
+  """Compares incoming rides with the stored rides in one query. Produces
+  the rides which are new or have changed and a RideChange for each"""
+
+  if not rides:
+    return ([], [])
+
+  # Stored values of each ride's RIDE_UPDATE_FIELDS
+  stored: dict[int, tuple] = {
+    values[0]: values[1:] for values in
+    Ride.objects.filter(id__in=[ride.id for ride in rides])
+                .values_list('id', *RIDE_UPDATE_FIELDS)
+  }
+
+  changed_rides: list[Ride] = []
+  changes: list[RideChange] = []
+  for ride in rides:
+    last_updated: datetime = to_datetime(ride.last_updated)
+    incoming: tuple = (ride.park_id, ride.name, ride.category,
+                       ride.open_state, ride.wait_time, last_updated)
+    old: Optional[tuple] = stored.get(ride.id)
+
+    if old == incoming:
+      continue
+
+    changed_rides.append(ride)
+    changes.append(RideChange(
+      ride_id = ride.id,
+      park_id = ride.park_id,
+      name = ride.name,
+      category = ride.category,
+      old_wait_time = None if old is None else old[4],
+      wait_time = ride.wait_time,
+      old_open_state = None if old is None else old[3],
+      open_state = ride.open_state,
+      last_updated = last_updated,
+      old_category = None if old is None else old[2]
+    ))
+
+  return (changed_rides, changes)
+
+
+def to_datetime(value) -> datetime:
+  """Converts a last_updated value from the API to a datetime"""
+
+  if isinstance(value, str):
+    return parse_datetime(value)
+
+  return value
+
+
+def save_wait_samples(rides: list[Ride]) -> None:
+  """Appends the current wait time of each ride to its history and adds
+  the samples actually inserted to the ride's rollups. Samples already
+  recorded for a ride's last_updated time are skipped"""
+
+  # A ride listed twice in the snapshot is only sampled once
+  samples: list[RideWaitSample] = list({
+    (ride.id, to_datetime(ride.last_updated)): RideWaitSample(
+      ride_id = ride.id,
+      timestamp = to_datetime(ride.last_updated),
+      wait_time = ride.wait_time,
+      open_state = ride.open_state) for ride in rides
+  }.values())
+
+  # Samples already recorded aren't sent to be inserted again
+  recorded: set[tuple[int, datetime]] = set(
+    RideWaitSample.objects.filter(
+      ride_id__in=[sample.ride_id for sample in samples],
+      timestamp__in=[sample.timestamp for sample in samples])
+    .values_list('ride_id', 'timestamp'))
+
+  new_samples: list[RideWaitSample] = insert_new_samples(samples=[
+    sample for sample in samples
+    if (sample.ride_id, sample.timestamp) not in recorded
+  ])
+
+  update_rollups(samples=new_samples)
+
+  transaction.on_commit(lambda: inc('themepark_wait_samples_written_total',
+                                    len(new_samples)))
+
+
+def insert_new_samples(samples: list[RideWaitSample]
+                       ) -> list[RideWaitSample]:
+  """Inserts the samples, skipping any already recorded, and produces those
+  inserted. The database reports which rows it inserted, so a sample
+  inserted by a concurrent ingestion of the same ride is never counted in
+  the rollups twice. Each sample is of a different ride"""
+
+  if not samples:
+    return []
+
+  fields = [RideWaitSample._meta.get_field(name)
+            for name in ['ride', 'timestamp', 'wait_time', 'open_state']]
+  quote = connection.ops.quote_name
+  inserted_ride_ids: set[int] = set()
+
+  batch_size: int = connection.ops.bulk_batch_size(fields, samples)
+
+  with connection.cursor() as cursor:
+    for start in range(0, len(samples), batch_size):
+      batch: list[RideWaitSample] = samples[start:start + batch_size]
+      row: str = f"({', '.join(['%s'] * len(fields))})"
+
+      cursor.execute(
+        f"INSERT INTO {quote(RideWaitSample._meta.db_table)} "\
+        f"({', '.join(quote(field.column) for field in fields)}) "\
+        f"VALUES {', '.join([row] * len(batch))} "\
+        f"ON CONFLICT DO NOTHING RETURNING {quote(fields[0].column)}",
+        [field.get_db_prep_save(getattr(sample, field.attname), connection)
+         for sample in batch for field in fields])
+
+      inserted_ride_ids.update(ride_id for ride_id, in cursor.fetchall())
+
+  return [sample for sample in samples
+          if sample.ride_id in inserted_ride_ids]
+
+
+@timed('compile_rides')
+def compile_rides_list(ride_categories: list[str],
+                       park_id: int = 1) -> list[list[Ride]]:
+  """Compiles list of rides to show on tables on homepage. All rides in
+  the park are fetched in one query and grouped by category in Python"""
+
+  if not ride_categories:
+    return []
+
+  rides_by_category: dict[str, list[Ride]] = {
+    category: [] for category in ride_categories
+  }
 
-  return ride_category
+  for ride in Ride.objects.filter(park_id=park_id,
+                                  category__in=ride_categories)\
+                          .order_by('name'):
+    rides_by_category[ride.category].append(ride)
 
+  # Rides for each category in the same order as ride_categories
+  return [rides_by_category[category] for category in ride_categories]
 
-def compile_rides_list(ride_categories: list[str]) -> list[QuerySet]:
-  """Compiles list of rides to show on tables on homepage"""
 
-  # Creates a queryset for each ride category
-  rides: list[QuerySet] = []
-  for category in ride_categories:
-    rides.append(Ride.objects.filter(category = category).order_by('name'))
+def serialise_queue_data(park_id: int, version: int,
+                         rides_list: list[list[Ride]],
+                         ride_categories: list[str]) -> dict:
+  """Converts the rides of each category of a park snapshot to a JSON
+  serialisable dictionary laid out like the queue-times.com response"""
 
-  return rides
+  return {
+    'park_id': park_id,
+    'version': version,
+    'lands': [
+      {
+        'name': category,
+        'rides': [
+          {
+            'id': ride.id,
+            'name': ride.name,
+            'is_open': ride.open_state,
+            'wait_time': ride.wait_time,
+            'last_updated': ride.last_updated.isoformat()
+          } for ride in rides
+        ]
+      } for category, rides in zip(ride_categories, rides_list)
+    ]
+  }
 
 
 def main() -> None:
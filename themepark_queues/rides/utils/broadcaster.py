@@ -0,0 +1,232 @@
+"""
+Name: broadcaster.py
+Author: Ryan Gascoigne-Jones
+
+Purpose: Contains the in-process broadcaster which fans out ride change
+  events to every connected client. A single task per process polls the
+  version of each subscribed park, so connected clients never query the
+  DB themselves. Clients polling over WSGI are served the events cached
+  by the ingestor when each park's rides change
+"""
+
+from asgiref.sync import sync_to_async
+import asyncio
+from django.conf import settings
+from django.core.cache import caches
+import logging
+from typing import Optional
+from ..models import Park, Ride
+
+logger = logging.getLogger(__name__)
+
+# Wait time, open state and last update of a ride, which are published
+# when they change
+RideState = tuple[int, bool, str]
+
+
+class RideChangeBroadcaster:
+  """Publishes each change to a ride as an event to the queues of all
+  clients subscribed to the ride's park.
+
+  Park.version is only incremented in the transaction that writes the
+  park's rides, so once a new version is read the rides it covers are
+  committed. Polling by version rather than by row id can't skip rows
+  whose transactions commit out of order"""
+
+  def __init__(self, poll_interval: float, queue_size: int) -> None:
+    self.poll_interval = poll_interval
+    self.queue_size = queue_size
+    # Queues of connected clients by park_id
+    self.subscribers: dict[int, set[asyncio.Queue]] = {}
+    # Last version of each subscribed park read, and its rides' states
+    self.versions: dict[int, int] = {}
+    self.ride_states: dict[int, dict[int, RideState]] = {}
+    self.task: Optional[asyncio.Task] = None
+
+  async def subscribe(self, park_id: int) -> asyncio.Queue:
+    """Produces a queue receiving events for rides in the park, starting
+    the poller if it isn't already running"""
+
+    queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+    self.subscribers.setdefault(park_id, set()).add(queue)
+
+    # Nothing is awaited before the task is set, so concurrent subscribers
+    # can't start a second poller
+    if self.task is None or self.task.done():
+      self.task = asyncio.get_running_loop().create_task(self.poll())
+
+    return queue
+
+  def unsubscribe(self, park_id: int, queue: asyncio.Queue) -> None:
+    """Stops a queue receiving events"""
+
+    queues: set[asyncio.Queue] = self.subscribers.get(park_id, set())
+    queues.discard(queue)
+
+    if not queues:
+      self.subscribers.pop(park_id, None)
+      self.versions.pop(park_id, None)
+      self.ride_states.pop(park_id, None)
+
+  def publish(self, events: list[dict]) -> None:
+    """Adds each event to the queue of every client subscribed to its
+    park. A client too slow to keep up loses its oldest events"""
+
+    for event in events:
+      for queue in self.subscribers.get(event['park_id'], ()):
+        if queue.full():
+          queue.get_nowait()
+        queue.put_nowait(event)
+
+  async def poll(self) -> None:
+    """Publishes changes to the rides of subscribed parks every
+    poll_interval seconds while any client is connected"""
+
+    while self.subscribers:
+      try:
+        events: list[dict] = await self.get_events()
+      except Exception:
+        logger.exception("Polling for ride changes failed")
+        events = []
+
+      if events:
+        self.publish(events=events)
+
+      await asyncio.sleep(self.poll_interval)
+
+  async def get_events(self) -> list[dict]:
+    """Produces events for rides which changed in parks whose version has
+    moved on since the last poll. Parks seen for the first time only
+    record their rides, so clients only get changes from when they
+    connected"""
+
+    versions: dict[int, int] = await sync_to_async(get_park_versions)(
+      park_ids=list(self.subscribers))
+
+    changed_parks: list[int] = [park_id for park_id, version
+                                in versions.items()
+                                if version != self.versions.get(park_id)]
+    if not changed_parks:
+      return []
+
+    ride_states: dict[int, dict[int, RideState]] = await sync_to_async(
+      get_ride_states)(park_ids=changed_parks)
+
+    events: list[dict] = []
+
+    for park_id in changed_parks:
+      # The park may have lost its last client while the rides were read
+      if park_id not in self.subscribers:
+        continue
+
+      new_states: dict[int, RideState] = ride_states.get(park_id, {})
+
+      if park_id in self.versions:
+        old_states: dict[int, RideState] = self.ride_states.get(park_id, {})
+        events.extend(get_ride_events(park_id=park_id,
+                                      version=versions[park_id],
+                                      old_states=old_states,
+                                      new_states=new_states))
+
+      self.versions[park_id] = versions[park_id]
+      self.ride_states[park_id] = new_states
+
+    return events
+
+
+def get_park_versions(park_ids: list[int]) -> dict[int, int]:
+  """Retrieves the current version of each park"""
+
+  return dict(Park.objects.filter(id__in=park_ids)
+                          .values_list('id', 'version'))
+
+
+def get_ride_states(park_ids: list[int]) -> dict[int, dict[int, RideState]]:
+  """Retrieves the state of every ride in the parks by park_id"""
+
+  states: dict[int, dict[int, RideState]] = {}
+
+  for ride in Ride.objects.filter(park_id__in=park_ids)\
+                          .values('id', 'park_id', 'wait_time', 'open_state',
+                                  'last_updated'):
+    states.setdefault(ride['park_id'], {})[ride['id']] = (
+      ride['wait_time'], ride['open_state'],
+      ride['last_updated'].isoformat())
+
+  return states
+
+
+def get_snapshot_events(park_id: int) -> tuple[int, list[dict]]:
+  """Produces the park's version and an event with the current state of
+  every ride in the park"""
+
+  version: int = get_park_versions(park_ids=[park_id]).get(park_id, 0)
+
+  return version, get_ride_events(park_id=park_id, version=version,
+                                  old_states={},
+                                  new_states=get_ride_states(
+                                    park_ids=[park_id]).get(park_id, {}))
+
+
+def get_events_cache_key(park_id: int) -> str:
+  """Produces the cache key for the current ride events of a park"""
+
+  return f"ride_events:{park_id}"
+
+
+def cache_snapshot_events(sender, park_id: int, **kwargs) -> None:
+  """rides_changed receiver which caches the park's version and current
+  ride events once per change, so polling clients don't query the DB.
+  Failures are logged so they don't fail ingestion"""
+
+  try:
+    caches['ride_events'].set(get_events_cache_key(park_id=park_id),
+                              get_snapshot_events(park_id=park_id),
+                              timeout=None)
+  except Exception:
+    logger.exception(f"Caching ride events for park {park_id} failed")
+
+
+def get_cached_events(park_id: int, after_version: int) -> list[dict]:
+  """Retrieves the cached event of every ride in the park if its version is
+  newer than after_version. Only a park not cached since the cache was
+  emptied is read from the DB"""
+
+  key: str = get_events_cache_key(park_id=park_id)
+  snapshot: Optional[tuple[int, list[dict]]] = caches['ride_events'].get(key)
+
+  if snapshot is None:
+    snapshot = get_snapshot_events(park_id=park_id)
+    # Doesn't replace events the ingestor cached since the DB was read
+    caches['ride_events'].add(key, snapshot, timeout=None)
+
+  version, events = snapshot
+
+  return events if version > after_version else []
+
+
+def get_ride_events(park_id: int, version: int,
+                    old_states: dict[int, RideState],
+                    new_states: dict[int, RideState]) -> list[dict]:
+  """Produces an event for each ride whose wait time or open state differs
+  from its old state"""
+
+  return [
+    {
+      'version': version,
+      'park_id': park_id,
+      'ride_id': ride_id,
+      'wait_time': wait_time,
+      'open_state': open_state,
+      'last_updated': last_updated
+    } for ride_id, (wait_time, open_state, last_updated)
+      in sorted(new_states.items())
+    if old_states.get(ride_id, (None, None, None))[:2] != \
+       (wait_time, open_state)
+  ]
+
+
+# Shared by every connection to this process
+broadcaster = RideChangeBroadcaster(
+  poll_interval=settings.RIDE_EVENTS_POLL_INTERVAL,
+  queue_size=settings.RIDE_EVENTS_QUEUE_SIZE)
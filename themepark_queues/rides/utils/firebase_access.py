@@ -6,69 +6,107 @@ Purpose: Contains additional functions used to interact with remote DB
 """
 
 from django.conf import settings
-import requests
-from requests import Response
+import hashlib
 import logging
-import firebase_admin
-from firebase_admin import credentials, db # type: ignore
+import os
+import threading
+
+# firebase_admin and the Google Cloud libraries it pulls in are imported by
+# get_db() on first use, so workers which never write to the remote DB
+# don't pay their import time and memory
+_db = None
+_db_lock = threading.Lock()
 
 logging.getLogger().setLevel(logging.DEBUG)
 
-def add_notif(park_id: int,
-              ride_id: int,
-              ride_name: str,
-              user_email: str) -> None:
-  """Adds the notification request to the remote DB for the specific
-  ride_id for the given user_email"""
-
-  # Authenticating service account used to initialise connection with
-  # remote DB, but only if it has not already been done this runtime
-  if not firebase_admin._apps:
-    cred = credentials.Certificate(settings.FIREBASE_AUTH_KEY)
-    firebase_admin.initialize_app(cred, {
-      'databaseURL': settings.FIREBASE_DB_URL
-    })
-
-  ride_url: str = get_ride_url(park_id=park_id, ride_id=ride_id)
-  update_url: str = f"{ride_url}"
-
-  # Creates list of all emails subscribed
-  cur_emails: list[str] = add_to_email_list(ride_url=ride_url,
-                                            user_email=user_email)
-  
-  logging.debug(cur_emails)
-
-  ride_notif: dict = {
+def get_ride_notif(ride_id: int, ride_name: str, user_email: str) -> dict:
+  """Produces the paths, relative to a ride's notification, written to
+  subscribe user_email to it"""
+
+  # Subscribers are children keyed by a hash of their email, so adding one
+  # is a single write that doesn't need the current subscribers first
+  return {
     'ride_id': ride_id,
     'ride_name': ride_name,
-    'user_emails': cur_emails
+    f"subscribers/{get_email_key(user_email=user_email)}": user_email
   }
 
-  # Adds new user_email to list if already exists, otherwise create a new
-  # ride notification using ride_id as the key.
-  ref = db.reference(update_url)
-  fdb_response: Response = ref.update(ride_notif) # type: ignore
 
-  logging.debug(f"Notification created")
+def get_db():
+  """Produces the firebase_admin db module used to access the remote DB.
+  The service account is authenticated and the app initialised once, on
+  first use, even when called from many threads"""
+
+  global _db
+
+  if _db is None:
+    with _db_lock:
+      if _db is None:
+        import firebase_admin
+        from firebase_admin import credentials, db # type: ignore
+
+        # The emulator and stand-ins for it don't check credentials, so
+        # the service account key isn't needed
+        cred = None if uses_emulator() else \
+               credentials.Certificate(settings.FIREBASE_AUTH_KEY)
+        firebase_admin.initialize_app(cred, {
+          'databaseURL': settings.FIREBASE_DB_URL
+        })
+
+        _db = db
+
+  return _db
+
+
+def uses_emulator() -> bool:
+  """Checks whether the remote DB is a local emulator, set by
+  FIREBASE_DATABASE_EMULATOR_HOST or an http FIREBASE_DB_URL"""
+
+  return bool(os.environ.get('FIREBASE_DATABASE_EMULATOR_HOST')) or \
+         (settings.FIREBASE_DB_URL or '').startswith('http://')
+
+
+def get_email_key(user_email: str) -> str:
+  """Produces the key of a subscriber in the remote DB. Emails are hashed
+  as they can contain characters not allowed in keys"""
+
+  return hashlib.sha256(user_email.strip().lower().encode()).hexdigest()
+
+
+def convert_email_lists(notifications) -> dict:
+  """Produces a multi-path update of the remote DB notifications that
+  moves each ride's user_emails list to keyed subscribers"""
+
+  update: dict = {}
+
+  for park_id, rides in iterate_children(notifications):
+    for ride_id, ride_notif in iterate_children(rides):
+      user_emails: list = ride_notif.get('user_emails') or []
+      if not user_emails:
+        continue
+
+      for user_email in user_emails:
+        update[f"{park_id}/{ride_id}/subscribers/"\
+               f"{get_email_key(user_email=user_email)}"] = user_email
+
+      # Deletes the old list
+      update[f"{park_id}/{ride_id}/user_emails"] = None
+
+  return update
 
 
-def add_to_email_list(ride_url: str, user_email: str) -> list[str]:
-  """Adds new email address to list of current emails subscribed"""
+def iterate_children(node) -> list[tuple[str, dict]]:
+  """Produces the (key, value) pairs of a remote DB node. Nodes with
+  integer keys can be returned as lists, with None for missing keys"""
 
-  fetch_url: str = f"{ride_url}/user_emails"
-  # Gets list of current emails already signed up for notifications
-  ref = db.reference(fetch_url)
-  cur_emails: list[str] = ref.get() # type: ignore
+  if isinstance(node, list):
+    return [(str(key), value) for key, value in enumerate(node)
+            if value is not None]
 
-  # Checks if notification for ride_id exists already and if so
-  # retrieves the emails subscribed to it.
-  if cur_emails:
-    if user_email not in cur_emails:
-      cur_emails.append(user_email)
-  else:
-    cur_emails = [user_email]
+  if isinstance(node, dict):
+    return list(node.items())
 
-  return cur_emails
+  return []
 
 
 def get_notif_db_url() -> str:
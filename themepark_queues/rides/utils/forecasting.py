@@ -0,0 +1,158 @@
+"""
+Name: forecasting.py
+Author: Ryan Gascoigne-Jones
+
+Purpose: Forecasts the wait times of every ride in a park for the next few
+  hours from its wait time history. All rides are fitted together in one
+  vectorised pass over the park's history
+"""
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+from typing import Optional
+from ..models import RideForecast, RideWaitSample
+
+HISTORY_COLUMNS: list[str] = ['ride_id', 'timestamp', 'wait_time']
+FORECAST_COLUMNS: list[str] = ['ride_id', 'time', 'wait_time']
+
+
+def fit_park(park_id: int, now: Optional[datetime] = None) -> int:
+  """Fits forecasts for every ride in the park with history and saves
+  them. Returns the number of rides forecast"""
+
+  now = now or timezone.now()
+
+  history: pd.DataFrame = load_history(
+    park_id=park_id,
+    since=now - timedelta(days=settings.FORECAST_HISTORY_DAYS))
+
+  forecasts: pd.DataFrame = fit_forecasts(
+    history=history,
+    now=now,
+    hours=settings.FORECAST_HOURS,
+    step_minutes=settings.FORECAST_STEP_MINUTES,
+    trend_hours=settings.FORECAST_TREND_HOURS,
+    prior_samples=settings.FORECAST_PRIOR_SAMPLES)
+
+  return save_forecasts(park_id=park_id, forecasts=forecasts, fitted_at=now)
+
+
+def load_history(park_id: int, since: datetime) -> pd.DataFrame:
+  """Produces the wait times of the park's open rides since the given time
+  as columns of ride_id, timestamp and wait_time"""
+
+  samples = RideWaitSample.objects.filter(
+    ride__park_id=park_id, timestamp__gte=since,
+    open_state=True).values_list(*HISTORY_COLUMNS)
+
+  history = pd.DataFrame.from_records(
+    list(samples.iterator(chunk_size=10000)), columns=HISTORY_COLUMNS)
+
+  history['timestamp'] = pd.to_datetime(history['timestamp'], utc=True)
+  history['wait_time'] = history['wait_time'].astype(float)
+
+  return history
+
+
+def get_week_slots(timestamps: pd.Series) -> np.ndarray:
+  """Produces the hour of the week, from 0 on Monday, of each timestamp"""
+
+  return (timestamps.dt.dayofweek * 24 + timestamps.dt.hour).to_numpy()
+
+
+def fit_forecasts(history: pd.DataFrame,
+                  now: datetime,
+                  hours: int,
+                  step_minutes: int,
+                  trend_hours: float,
+                  prior_samples: float) -> pd.DataFrame:
+  """Forecasts each ride's wait time every step_minutes for the next hours.
+  A forecast is the ride's mean wait at that hour of the week, plus how far
+  its recent waits have been from their usual, which fades with time"""
+
+  if history.empty:
+    return pd.DataFrame(columns=FORECAST_COLUMNS)
+
+  history = history.assign(slot=get_week_slots(history['timestamp']))
+
+  ride_means: pd.Series = history.groupby('ride_id')['wait_time'].mean()
+
+  # Seasonal profile of each ride by hour of the week. Hours with few
+  # samples are pulled towards the ride's mean
+  slots: pd.DataFrame = history.groupby(['ride_id', 'slot'])['wait_time']\
+                               .agg(['sum', 'count'])
+  slot_ride_means: np.ndarray = ride_means.reindex(
+    slots.index.get_level_values('ride_id')).to_numpy()
+  profile = pd.Series(
+    (slots['sum'].to_numpy() + prior_samples * slot_ride_means)
+    / (slots['count'].to_numpy() + prior_samples),
+    index=slots.index)
+
+  # Recent trend is how far each ride's recent waits are from its profile
+  recent: pd.DataFrame = history[
+    history['timestamp'] >= pd.Timestamp(now) - pd.Timedelta(hours=trend_hours)]
+  recent_profile: np.ndarray = profile.reindex(
+    pd.MultiIndex.from_arrays([recent['ride_id'], recent['slot']])).to_numpy()
+  trends: pd.Series = pd.Series(
+    recent['wait_time'].to_numpy() - recent_profile,
+    index=recent['ride_id'].to_numpy()).groupby(level=0).mean()
+
+  # Every forecast step of every ride
+  ride_ids: np.ndarray = ride_means.index.to_numpy()
+  steps: np.ndarray = np.arange(1, hours * 60 // step_minutes + 1)
+  times = pd.Timestamp(now).floor(f"{step_minutes}min") \
+          + pd.to_timedelta(steps * step_minutes, unit='min')
+
+  grid_ride_ids: np.ndarray = np.repeat(ride_ids, len(times))
+  grid_times = pd.Series(np.tile(times, len(ride_ids)))
+  grid_slots: np.ndarray = get_week_slots(grid_times)
+  lead_hours: np.ndarray = np.tile(steps * step_minutes / 60, len(ride_ids))
+
+  seasonal: np.ndarray = profile.reindex(
+    pd.MultiIndex.from_arrays([grid_ride_ids, grid_slots])).to_numpy()
+  # Hours of the week without history use the ride's mean
+  seasonal = np.where(np.isnan(seasonal),
+                      ride_means.reindex(grid_ride_ids).to_numpy(), seasonal)
+
+  trend: np.ndarray = trends.reindex(grid_ride_ids).fillna(0).to_numpy() \
+                      * np.exp(-lead_hours / trend_hours)
+
+  return pd.DataFrame({
+    'ride_id': grid_ride_ids,
+    'time': grid_times,
+    'wait_time': np.clip(np.rint(seasonal + trend), 0, None).astype(int)
+  })
+
+
+def save_forecasts(park_id: int, forecasts: pd.DataFrame,
+                   fitted_at: datetime) -> int:
+  """Replaces the forecasts of the park's rides with one row per ride.
+  Returns the number of rides forecast"""
+
+  waits: dict[int, list[dict]] = {}
+
+  for ride_id, time, wait_time in zip(forecasts['ride_id'].to_numpy(),
+                                      forecasts['time'],
+                                      forecasts['wait_time'].to_numpy()):
+    waits.setdefault(int(ride_id), []).append({
+      'time': time.isoformat(),
+      'wait_time': int(wait_time)
+    })
+
+  with transaction.atomic():
+    RideForecast.objects.bulk_create(
+      [RideForecast(ride_id=ride_id, fitted_at=fitted_at, waits=ride_waits)
+       for ride_id, ride_waits in waits.items()],
+      update_conflicts=True,
+      unique_fields=['ride'],
+      update_fields=['fitted_at', 'waits'])
+
+    # Rides without recent history no longer have a forecast
+    RideForecast.objects.filter(ride__park_id=park_id)\
+                        .exclude(ride_id__in=list(waits)).delete()
+
+  return len(waits)
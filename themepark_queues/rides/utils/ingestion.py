@@ -0,0 +1,144 @@
+"""
+Name: ingestion.py
+Author: Ryan Gascoigne-Jones
+
+Purpose: Contains functions used by the ingestor to save ride data for
+  many parks concurrently, so one slow park doesn't delay the rest
+"""
+
+from concurrent.futures import ThreadPoolExecutor, Future, wait, \
+  FIRST_COMPLETED
+from django.db import connection
+import logging
+import threading
+import time
+from typing import NamedTuple, Optional
+from .api_request import save_queue_data
+from .metrics import inc, observe
+
+logger = logging.getLogger(__name__)
+
+
+class IngestResult(NamedTuple):
+  """Outcome of ingesting a single park"""
+
+  park_id: int
+  # Wall time in seconds
+  duration: float
+  # Categories saved, None if the ingestion failed
+  categories: Optional[list[str]]
+  error: Optional[str]
+
+
+def ingest_park(park_id: int) -> IngestResult:
+  """Saves current ride data for a park, returning the error rather than
+  raising on failure so one bad poll doesn't stop the ingestor"""
+
+  start: float = time.monotonic()
+
+  try:
+    ride_categories: list[str] = save_queue_data(park_id=park_id)
+  except Exception as e:
+    logger.exception(f"Ingestion of park {park_id} failed")
+    inc('themepark_ingest_failures_total', park=park_id)
+    return IngestResult(park_id=park_id,
+                        duration=time.monotonic() - start,
+                        categories=None,
+                        error=repr(e))
+
+  duration: float = time.monotonic() - start
+  observe('themepark_ingest_seconds', duration, park=park_id)
+
+  return IngestResult(park_id=park_id,
+                      duration=duration,
+                      categories=ride_categories,
+                      error=None)
+
+
+class ParkIngestor:
+  """Ingests parks concurrently on a thread pool kept for the life of the
+  ingestor. A park that is still being ingested, including one that timed
+  out, keeps its worker and isn't started again until it finishes, so two
+  ingestions of a park never overlap"""
+
+  def __init__(self, max_workers: int) -> None:
+    self.executor = ThreadPoolExecutor(max_workers=max_workers,
+                                       thread_name_prefix='ingestor')
+    # Futures of parks being ingested, removed once they finish
+    self.in_flight: dict[int, Future] = {}
+    self.lock = threading.Lock()
+
+  def ingest(self, park_ids: list[int], timeout: float) -> list[IngestResult]:
+    """Ingests parks, skipping any still running from an earlier call. A
+    park still running timeout seconds after it started is reported as
+    timed out and no longer waited for. Results are in the order of
+    park_ids"""
+
+    # Monotonic time each park started, set by the worker running it
+    started: dict[int, float] = {}
+    results: dict[int, IngestResult] = {}
+    pending: dict[Future, int] = {}
+
+    def run(park_id: int) -> IngestResult:
+      started[park_id] = time.monotonic()
+      try:
+        return ingest_park(park_id=park_id)
+      finally:
+        # Each worker thread has its own DB connection
+        connection.close()
+
+    for park_id in park_ids:
+      with self.lock:
+        if park_id in self.in_flight:
+          logger.warning(f"Skipping park {park_id}, which is still being "\
+                         f"ingested")
+          results[park_id] = IngestResult(park_id=park_id,
+                                          duration=0.0,
+                                          categories=None,
+                                          error="Still running")
+          continue
+
+        future: Future = self.executor.submit(run, park_id)
+        self.in_flight[park_id] = future
+
+      future.add_done_callback(
+        lambda _, park_id=park_id: self.finish(park_id=park_id))
+      pending[future] = park_id
+
+    while pending:
+      # Parks waiting for a worker haven't started, so they are checked
+      # again at least every second
+      deadlines: list[float] = [started[park_id] + timeout
+                                for park_id in pending.values()
+                                if park_id in started]
+      wait_for: float = min(deadlines, default=float('inf'))\
+                        - time.monotonic()
+      done, _ = wait(pending, timeout=min(max(wait_for, 0.0), 1.0),
+                     return_when=FIRST_COMPLETED)
+
+      for future in done:
+        results[pending.pop(future)] = future.result()
+
+      now: float = time.monotonic()
+      for future, park_id in list(pending.items()):
+        if park_id in started and now - started[park_id] >= timeout:
+          # Left to finish in the background, still holding its worker
+          pending.pop(future)
+          logger.error(f"Ingestion of park {park_id} timed out after "\
+                       f"{timeout}s")
+          inc('themepark_ingest_failures_total', park=park_id)
+          results[park_id] = IngestResult(park_id=park_id,
+                                          duration=now - started[park_id],
+                                          categories=None,
+                                          error="Timed out")
+
+    return [results[park_id] for park_id in park_ids]
+
+  def finish(self, park_id: int) -> None:
+    with self.lock:
+      self.in_flight.pop(park_id, None)
+
+  def shutdown(self) -> None:
+    """Waits for running parks to finish and stops the workers"""
+
+    self.executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,364 @@
+"""
+Name: metrics.py
+Author: Ryan Gascoigne-Jones
+
+Purpose: Contains in-process counters and histograms served in the
+  Prometheus text format at /metrics. Each process writes its values to
+  its own file in METRICS_DIR, which are summed when scraped, so the
+  counts of every Gunicorn worker and management command are included
+"""
+
+import atexit
+from bisect import bisect_left
+from contextlib import contextmanager
+from datetime import datetime
+from django.conf import settings
+from django.db.models import Max
+from django.utils import timezone
+import json
+import logging
+import os
+from pathlib import Path
+import tempfile
+import threading
+import time
+from typing import Iterator, Optional
+import uuid
+from ..models import NotificationJob, Park, Ride, SubscriptionOutbox
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds of histogram buckets
+BUCKETS: tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                              2.5, 5.0, 10.0)
+
+# Type and help text of each metric
+METRICS: dict[str, tuple[str, str]] = {
+  'themepark_upstream_polls_total': (
+    'counter', "Requests made to queue-times.com"),
+  'themepark_upstream_not_modified_total': (
+    'counter', "Requests to queue-times.com answered with a 304"),
+  'themepark_upstream_unchanged_total': (
+    'counter', "Responses from queue-times.com identical to the last"),
+  'themepark_upstream_errors_total': (
+    'counter', "Requests to queue-times.com which failed after retries"),
+  'themepark_upstream_request_seconds': (
+    'histogram', "Latency of requests to queue-times.com"),
+  'themepark_ingest_seconds': (
+    'histogram', "Duration of ingesting a park"),
+  'themepark_ingest_failures_total': (
+    'counter', "Ingestions of a park which failed or timed out"),
+  'themepark_rides_written_total': (
+    'counter', "Rides inserted or updated by ingestion"),
+  'themepark_wait_samples_written_total': (
+    'counter', "Wait time samples added to ride history"),
+  'themepark_firebase_seconds': (
+    'histogram', "Latency of writes to the firebase DB by operation"),
+  'themepark_outbox_flushed_total': (
+    'counter', "Subscriptions written to the firebase DB"),
+  'themepark_outbox_flush_failures_total': (
+    'counter', "Flushes of the subscription outbox which failed"),
+  'themepark_notifications_sent_total': (
+    'counter', "Reopening notifications sent"),
+  'themepark_notification_send_failures_total': (
+    'counter', "Reopening notifications which failed to send"),
+  'themepark_view_seconds': (
+    'histogram', "Latency of views by URL name"),
+  'themepark_view_responses_total': (
+    'counter', "Responses of views by URL name and status class"),
+  'themepark_park_ingest_age_seconds': (
+    'gauge', "Time since the park was last ingested"),
+  'themepark_park_data_age_seconds': (
+    'gauge', "Time since the latest upstream last_updated of the park's rides"),
+  'themepark_outbox_depth': (
+    'gauge', "Subscriptions waiting to be written to the firebase DB"),
+  'themepark_notification_queue_depth': (
+    'gauge', "Reopening notifications waiting to be sent")
+}
+
+# Metric name and sorted label pairs mapped to a counter's value, or a
+# histogram's count in each bucket (the last for values above BUCKETS)
+# followed by the sum of its values
+Key = tuple[str, tuple[tuple[str, str], ...]]
+_values: dict[Key, list[float]] = {}
+_lock = threading.Lock()
+# Monotonic time this process's values are next written to its file
+_next_flush: float = 0.0
+# Held while the values are written, so an older copy can't replace a
+# newer one
+_flush_lock = threading.Lock()
+# Thread writing this process's values every METRICS_FLUSH_INTERVAL
+_flusher: Optional[threading.Thread] = None
+# Names this process's file, so a process reusing the pid of one that
+# exited doesn't overwrite its values
+_process_id: str = uuid.uuid4().hex
+
+
+def get_key(name: str, labels: dict) -> Key:
+  if not labels:
+    return (name, ())
+
+  return (name, tuple(sorted([(key, str(value))
+                              for key, value in labels.items()])))
+
+
+def inc(name: str, value: float = 1, **labels) -> None:
+  """Increases the counter name with labels by value"""
+
+  key: Key = get_key(name=name, labels=labels)
+
+  with _lock:
+    totals: Optional[list[float]] = _values.get(key)
+    if totals is None:
+      _values[key] = [value]
+    else:
+      totals[0] += value
+
+  maybe_flush()
+
+
+def observe(name: str, seconds: float, **labels) -> None:
+  """Adds a duration to the histogram name with labels"""
+
+  key: Key = get_key(name=name, labels=labels)
+
+  with _lock:
+    totals: Optional[list[float]] = _values.get(key)
+    if totals is None:
+      totals = _values[key] = [0] * (len(BUCKETS) + 2)
+
+    totals[bisect_left(BUCKETS, seconds)] += 1
+    totals[-1] += seconds
+
+  maybe_flush()
+
+
+@contextmanager
+def timer(name: str, **labels) -> Iterator[None]:
+  """Adds the duration of the enclosed code to the histogram name, whether
+  or not it raises"""
+
+  start: float = time.perf_counter()
+
+  try:
+    yield
+  finally:
+    observe(name, time.perf_counter() - start, **labels)
+
+
+def get_metrics_file() -> Optional[Path]:
+  if not settings.METRICS_DIR:
+    return None
+
+  return Path(settings.METRICS_DIR) / \
+    f"metrics-{os.getpid()}-{_process_id}.json"
+
+
+def maybe_flush() -> None:
+  """Writes this process's values to its file at most once every
+  METRICS_FLUSH_INTERVAL seconds, and starts the thread which keeps
+  writing them once the process is idle"""
+
+  global _next_flush
+
+  if not settings.METRICS_DIR:
+    return
+
+  with _lock:
+    now: float = time.monotonic()
+    if now < _next_flush:
+      return
+
+    _next_flush = now + settings.METRICS_FLUSH_INTERVAL
+
+  start_flusher()
+  flush()
+
+
+def start_flusher() -> None:
+  """Starts the daemon thread writing this process's values every
+  METRICS_FLUSH_INTERVAL seconds if it isn't running"""
+
+  global _flusher
+
+  with _lock:
+    if _flusher is not None:
+      return
+
+    _flusher = threading.Thread(target=run_flusher, name='metrics-flusher',
+                                daemon=True)
+
+  _flusher.start()
+
+
+def run_flusher() -> None:
+  """Writes this process's values every METRICS_FLUSH_INTERVAL seconds, so
+  those recorded before a worker goes idle are still scraped"""
+
+  while True:
+    time.sleep(settings.METRICS_FLUSH_INTERVAL)
+    flush()
+
+
+def flush() -> None:
+  """Writes this process's values to its file in METRICS_DIR. The file is
+  replaced in one step from a temporary file of its own, so it is never
+  read half written"""
+
+  path: Optional[Path] = get_metrics_file()
+  if path is None:
+    return
+
+  with _flush_lock:
+    with _lock:
+      content: str = json.dumps([[name, labels, totals]
+                                 for (name, labels), totals
+                                 in _values.items()])
+
+    try:
+      path.parent.mkdir(parents=True, exist_ok=True)
+      # Isn't matched by the metrics-*.json files collected
+      with tempfile.NamedTemporaryFile('w', dir=path.parent,
+                                       prefix=f".{path.stem}-",
+                                       suffix='.tmp',
+                                       delete=False) as temp_file:
+        temp_file.write(content)
+
+      os.replace(temp_file.name, path)
+    except OSError:
+      logger.exception(f"Writing metrics to {path} failed")
+
+
+def reset_after_fork() -> None:
+  """Forked workers start without the values of the process they were
+  forked from, which are still written to its own file"""
+
+  global _lock, _next_flush, _flush_lock, _flusher, _process_id
+
+  _lock = threading.Lock()
+  _values.clear()
+  _next_flush = 0.0
+  _flush_lock = threading.Lock()
+  # Threads aren't forked, so the child starts its own
+  _flusher = None
+  _process_id = uuid.uuid4().hex
+
+
+os.register_at_fork(after_in_child=reset_after_fork)
+atexit.register(flush)
+
+
+def collect() -> dict[Key, list[float]]:
+  """Sums the values of every process with a file in METRICS_DIR, or
+  produces this process's values if it isn't set"""
+
+  if not settings.METRICS_DIR:
+    with _lock:
+      return {key: list(totals) for key, totals in _values.items()}
+
+  # This process's file is brought up to date first
+  flush()
+
+  collected: dict[Key, list[float]] = {}
+
+  for path in Path(settings.METRICS_DIR).glob('metrics-*.json'):
+    try:
+      rows: list = json.loads(path.read_text())
+    except (OSError, ValueError):
+      # The process may have been replaced since the directory was listed
+      continue
+
+    for name, labels, totals in rows:
+      key: Key = (name, tuple(tuple(label) for label in labels))
+      summed: Optional[list[float]] = collected.get(key)
+
+      if summed is None or len(summed) != len(totals):
+        collected[key] = list(totals)
+      else:
+        collected[key] = [a + b for a, b in zip(summed, totals)]
+
+  return collected
+
+
+def get_gauges() -> dict[Key, list[float]]:
+  """Produces the freshness of each park's data and the depth of the
+  worker queues from the local DB"""
+
+  now: datetime = timezone.now()
+  gauges: dict[Key, list[float]] = {}
+
+  for park_id, last_ingested in Park.objects.values_list('id',
+                                                         'last_ingested'):
+    if last_ingested is not None:
+      gauges[('themepark_park_ingest_age_seconds',
+              (('park', str(park_id)),))] = [
+        (now - last_ingested).total_seconds()]
+
+  for row in Ride.objects.values('park_id')\
+                         .annotate(latest=Max('last_updated')):
+    gauges[('themepark_park_data_age_seconds',
+            (('park', str(row['park_id'])),))] = [
+      (now - row['latest']).total_seconds()]
+
+  gauges[('themepark_outbox_depth', ())] = [
+    SubscriptionOutbox.objects.count()]
+  gauges[('themepark_notification_queue_depth', ())] = [
+    NotificationJob.objects.count()]
+
+  return gauges
+
+
+def format_labels(labels: tuple[tuple[str, str], ...],
+                  le: Optional[str] = None) -> str:
+  pairs: list[tuple[str, str]] = list(labels)
+  if le is not None:
+    pairs.append(('le', le))
+
+  if not pairs:
+    return ''
+
+  escaped: list[str] = []
+  for key, value in pairs:
+    value = str(value).replace('\\', '\\\\').replace('"', '\\"')\
+                      .replace('\n', '\\n')
+    escaped.append(f'{key}="{value}"')
+
+  return '{' + ','.join(escaped) + '}'
+
+
+def render_metrics() -> str:
+  """Produces every metric in the Prometheus text exposition format"""
+
+  values: dict[Key, list[float]] = collect()
+  values.update(get_gauges())
+
+  lines: list[str] = []
+
+  for name, (metric_type, help_text) in METRICS.items():
+    series: list[tuple[Key, list[float]]] = sorted(
+      (key, totals) for key, totals in values.items() if key[0] == name)
+
+    if not series:
+      continue
+
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} {metric_type}")
+
+    for (_, labels), totals in series:
+      if metric_type != 'histogram':
+        lines.append(f"{name}{format_labels(labels)} {totals[0]}")
+        continue
+
+      cumulative: float = 0
+      for bound, count in zip(BUCKETS, totals):
+        cumulative += count
+        lines.append(f"{name}_bucket{format_labels(labels, le=str(bound))} "\
+                     f"{cumulative}")
+
+      cumulative += totals[len(BUCKETS)]
+      lines.append(f"{name}_bucket{format_labels(labels, le='+Inf')} "\
+                   f"{cumulative}")
+      lines.append(f"{name}_sum{format_labels(labels)} {totals[-1]}")
+      lines.append(f"{name}_count{format_labels(labels)} {cumulative}")
+
+  return '\n'.join(lines) + '\n'
@@ -0,0 +1,251 @@
+"""
+Name: notifications.py
+Author: Ryan Gascoigne-Jones
+
+Purpose: Detects rides that reopened in an ingested snapshot, queues one
+  notification job for each of their subscribers and sends queued jobs
+  with the sender set by NOTIFICATION_SENDER
+"""
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+import logging
+import threading
+import time
+from typing import Callable
+from ..models import NotificationJob, Subscription
+from ..signals import RideChange
+from .metrics import inc
+
+logger = logging.getLogger(__name__)
+
+_stats_lock = threading.Lock()
+_notification_stats: dict[str, float] = {
+  'reopened': 0,
+  'enqueued': 0,
+  'last_enqueue_latency_seconds': 0.0,
+  'max_enqueue_latency_seconds': 0.0,
+  'sent': 0,
+  'send_failures': 0,
+  'last_send_seconds': 0.0,
+  'max_delivery_latency_seconds': 0.0
+}
+
+
+def enqueue_reopen_notifications(sender, park_id: int,
+                                 changes: list[RideChange],
+                                 **kwargs) -> None:
+  """rides_changed receiver which queues notifications of the park's
+  reopened rides. Failures are logged so they don't fail ingestion"""
+
+  if not settings.REOPEN_NOTIFICATIONS:
+    return
+
+  try:
+    create_reopen_jobs(park_id=park_id, changes=changes)
+  except Exception:
+    logger.exception(f"Queueing reopen notifications for park {park_id} "\
+                     "failed")
+
+
+def get_reopened_rides(changes: list[RideChange]) -> list[RideChange]:
+  """Produces the changed rides that went from closed to open. Rides that
+  weren't stored before haven't reopened"""
+
+  return [change for change in changes
+          if change.old_open_state is False and change.open_state]
+
+
+def create_reopen_jobs(park_id: int,
+                       changes: list[RideChange]) -> list[NotificationJob]:
+  """Queues one notification job for each subscriber of the rides in the
+  park that reopened, listing every one of their rides that reopened"""
+
+  reopened: dict[int, RideChange] = {
+    change.ride_id: change for change in get_reopened_rides(changes=changes)
+  }
+
+  if not reopened:
+    return []
+
+  # Finds the subscribers of every reopened ride in one query
+  subscribers = Subscription.objects.filter(
+    park_id=park_id, ride_id__in=reopened).order_by(
+    'user__email', 'ride_id').values_list('user__email', 'ride_id')
+
+  user_rides: dict[str, list[RideChange]] = {}
+  for user_email, ride_id in subscribers:
+    user_rides.setdefault(user_email, []).append(reopened[ride_id])
+
+  jobs: list[NotificationJob] = [
+    NotificationJob(park_id=park_id,
+                    user_email=user_email,
+                    rides=[{'ride_id': change.ride_id,
+                            'ride_name': change.name} for change in rides],
+                    reopened_at=min(change.last_updated for change in rides))
+    for user_email, rides in user_rides.items()
+  ]
+
+  NotificationJob.objects.bulk_create(jobs)
+
+  record_enqueue(reopened=list(reopened.values()), jobs=jobs)
+
+  return jobs
+
+
+def record_enqueue(reopened: list[RideChange],
+                   jobs: list[NotificationJob]) -> None:
+  """Counts reopened rides and queued jobs, and the latency from the
+  upstream last_updated of the reopened rides to their jobs being queued"""
+
+  now = timezone.now()
+
+  with _stats_lock:
+    _notification_stats['reopened'] += len(reopened)
+    _notification_stats['enqueued'] += len(jobs)
+
+    if not jobs:
+      return
+
+    latency: float = max((now - job.reopened_at).total_seconds()
+                         for job in jobs)
+    _notification_stats['last_enqueue_latency_seconds'] = latency
+    _notification_stats['max_enqueue_latency_seconds'] = max(
+      _notification_stats['max_enqueue_latency_seconds'], latency)
+
+
+def get_sender() -> Callable[[list[NotificationJob]],
+                              list[NotificationJob]]:
+  """Produces the function set by NOTIFICATION_SENDER which sends each job
+  in a batch and returns the jobs which failed. It raises if none of the
+  batch could be attempted, e.g. the mail server is down"""
+
+  return import_string(settings.NOTIFICATION_SENDER)
+
+
+def send_email_notifications(jobs: list[NotificationJob]
+                             ) -> list[NotificationJob]:
+  """Emails each job's subscriber the rides that reopened, over a single
+  connection to the mail server. Each job is sent separately, so one
+  rejected address doesn't fail the others"""
+
+  failed: list[NotificationJob] = []
+
+  # Raises if the mail server can't be reached
+  with get_connection(fail_silently=False) as connection:
+    for job in jobs:
+      ride_names: list[str] = [ride['ride_name'] for ride in job.rides]
+
+      subject: str = f"{', '.join(ride_names)} "\
+                     f"{'has' if len(ride_names) == 1 else 'have'} reopened"
+      body: str = "Rides you subscribed to have reopened:\n\n" +\
+                  "\n".join(ride_names)
+
+      try:
+        EmailMessage(subject, body, to=[job.user_email],
+                     connection=connection).send()
+      except Exception:
+        logger.exception(f"Sending notification {job.id} to "\
+                         f"{job.user_email} failed")
+        failed.append(job)
+
+  return failed
+
+
+def drain_notifications(batch_size: int) -> int:
+  """Sends up to batch_size of the oldest queued notification jobs and
+  removes those sent from the queue. Returns the number sent.
+
+  Jobs which fail are kept to be retried and their attempts counted, with
+  jobs with the fewest attempts sent first. Jobs reaching
+  NOTIFICATION_MAX_ATTEMPTS are kept but no longer sent. A batch which
+  fails as a whole is retried without counting, as no job was at fault"""
+
+  jobs: list[NotificationJob] = []
+  start: float = time.monotonic()
+
+  try:
+    with transaction.atomic():
+      # Jobs being sent by another worker are skipped rather than sent
+      # twice
+      jobs = list(NotificationJob.objects
+                  .select_for_update(skip_locked=True)
+                  .filter(attempts__lt=settings.NOTIFICATION_MAX_ATTEMPTS)
+                  .order_by('attempts', 'id')[:batch_size])
+
+      if not jobs:
+        return 0
+
+      failed: list[NotificationJob] = get_sender()(jobs)
+      failed_ids: set[int] = {job.id for job in failed}
+      sent: list[NotificationJob] = [job for job in jobs
+                                     if job.id not in failed_ids]
+
+      NotificationJob.objects.filter(id__in=[job.id for job in sent]).delete()
+      NotificationJob.objects.filter(id__in=failed_ids)\
+                             .update(attempts=F('attempts') + 1)
+  except Exception:
+    record_send(sent=[], failures=len(jobs),
+                duration=time.monotonic() - start)
+    raise
+
+  for job in failed:
+    if job.attempts + 1 >= settings.NOTIFICATION_MAX_ATTEMPTS:
+      logger.error(f"Giving up sending notification {job.id} to "\
+                   f"{job.user_email} after {job.attempts + 1} attempts")
+
+  record_send(sent=sent, failures=len(failed),
+              duration=time.monotonic() - start)
+
+  return len(sent)
+
+
+def record_send(sent: list[NotificationJob], failures: int,
+                duration: float) -> None:
+  """Counts the jobs of a batch which were sent and which failed, how long
+  sending took and the latency from the upstream last_updated of their
+  rides to them being sent"""
+
+  now = timezone.now()
+
+  with _stats_lock:
+    _notification_stats['last_send_seconds'] = duration
+
+    if failures:
+      _notification_stats['send_failures'] += failures
+      inc('themepark_notification_send_failures_total', failures)
+
+    if not sent:
+      return
+
+    _notification_stats['sent'] += len(sent)
+    inc('themepark_notifications_sent_total', len(sent))
+    _notification_stats['max_delivery_latency_seconds'] = max(
+      _notification_stats['max_delivery_latency_seconds'],
+      max((now - job.reopened_at).total_seconds() for job in sent))
+
+
+def retry_dead_notifications() -> int:
+  """Queues notification jobs which reached NOTIFICATION_MAX_ATTEMPTS to be
+  sent again. Returns the number requeued"""
+
+  return NotificationJob.objects.filter(
+    attempts__gte=settings.NOTIFICATION_MAX_ATTEMPTS).update(attempts=0)
+
+
+def get_notification_stats() -> dict[str, float]:
+  """Produces the number of queued notification jobs, how many are no
+  longer retried and the counts and latencies of this process"""
+
+  with _stats_lock:
+    stats: dict[str, float] = dict(_notification_stats)
+
+  stats['depth'] = NotificationJob.objects.count()
+  stats['dead'] = NotificationJob.objects.filter(
+    attempts__gte=settings.NOTIFICATION_MAX_ATTEMPTS).count()
+
+  return stats
@@ -0,0 +1,60 @@
+"""
+Name: page_cache.py
+Author: Ryan Gascoigne-Jones
+
+Purpose: Contains functions to cache rendered pages by park and snapshot
+  version, so cached pages are replaced exactly when a new snapshot of the
+  park is ingested
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from typing import Optional
+from ..models import Park
+
+
+def get_snapshot_version(park_id: int) -> int:
+  """Retrieves the version of the latest ingested snapshot of the park,
+  0 if it has not been ingested yet"""
+
+  version: Optional[int] = Park.objects.filter(id=park_id)\
+                                       .values_list('version', flat=True)\
+                                       .first()
+
+  return version or 0
+
+
+def get_snapshot_versions(park_id: int) -> tuple[int, dict[str, int]]:
+  """Retrieves the version of the latest ingested snapshot of the park and
+  the version of each of its categories/lands, which keys its cached ride
+  table. Lands without a version are version 0"""
+
+  versions: Optional[tuple[int, dict[str, int]]] = Park.objects\
+    .filter(id=park_id).values_list('version', 'land_versions').first()
+
+  if versions is None:
+    return (0, {})
+
+  return versions
+
+
+def get_page_cache_key(page: str, park_id: int, version: int) -> str:
+  """Produces the cache key for a page rendered from a park snapshot"""
+
+  return f"page:{page}:{park_id}:{version}"
+
+
+def get_cached_page(page: str, park_id: int, version: int) -> Optional[bytes]:
+  """Retrieves the rendered page for the park snapshot if it is cached"""
+
+  return cache.get(get_page_cache_key(page=page, park_id=park_id,
+                                      version=version))
+
+
+def set_cached_page(page: str, park_id: int, version: int,
+                    content: bytes) -> None:
+  """Caches the rendered page for the park snapshot. A new snapshot version
+  uses a new key, so pages only expire so old versions don't build up"""
+
+  cache.set(get_page_cache_key(page=page, park_id=park_id, version=version),
+            content, timeout=settings.PAGE_CACHE_TIMEOUT)
@@ -0,0 +1,188 @@
+"""
+Name: rollups.py
+Author: Ryan Gascoigne-Jones
+
+Purpose: Keeps hourly and daily rollups of each ride's wait times up to
+  date as samples are ingested, and rebuilds and checks them against the
+  raw samples
+"""
+
+from django.db import transaction
+from django.db.models import Count, Max, Min, Q, Sum
+from django.db.models.functions import TruncDay, TruncHour
+from django.utils import timezone
+from datetime import datetime
+from typing import Iterable, Optional
+from ..models import RideWaitRollup, RideWaitSample
+
+PERIODS: list[str] = [RideWaitRollup.HOUR, RideWaitRollup.DAY]
+
+# Fields of a rollup overwritten when samples are added to it
+ROLLUP_UPDATE_FIELDS: list[str] = ['samples', 'open_samples', 'wait_sum',
+                                   'min_wait', 'max_wait', 'histogram']
+
+RollupKey = tuple[int, str, datetime]
+
+
+def get_period_start(timestamp: datetime, period: str) -> datetime:
+  """Produces the start of the hour or day a timestamp is in"""
+
+  local: datetime = timezone.localtime(timestamp)
+
+  if period == RideWaitRollup.HOUR:
+    return local.replace(minute=0, second=0, microsecond=0)
+
+  return local.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_sample(rollup: RideWaitRollup, wait_time: int,
+               open_state: bool) -> None:
+  """Adds a sample to a rollup"""
+
+  rollup.samples += 1
+
+  if not open_state:
+    return
+
+  rollup.open_samples += 1
+  rollup.wait_sum += wait_time
+  rollup.min_wait = wait_time if rollup.min_wait is None \
+                    else min(rollup.min_wait, wait_time)
+  rollup.max_wait = wait_time if rollup.max_wait is None \
+                    else max(rollup.max_wait, wait_time)
+  rollup.histogram[str(wait_time)] = rollup.histogram.get(str(wait_time),
+                                                          0) + 1
+
+
+def add_to_rollups(rollups: dict[RollupKey, RideWaitRollup],
+                   samples: Iterable[RideWaitSample]) -> set[RollupKey]:
+  """Adds each sample to the rollups of its hour and day, creating any
+  that don't exist yet. Produces the keys of the rollups added to"""
+
+  added: set[RollupKey] = set()
+
+  for sample in samples:
+    for period in PERIODS:
+      key: RollupKey = (sample.ride_id, period,
+                        get_period_start(sample.timestamp, period))
+
+      if key not in rollups:
+        rollups[key] = RideWaitRollup(ride_id=key[0], period=key[1],
+                                      start=key[2], histogram={})
+
+      add_sample(rollup=rollups[key], wait_time=sample.wait_time,
+                 open_state=sample.open_state)
+      added.add(key)
+
+  return added
+
+
+def update_rollups(samples: list[RideWaitSample]) -> None:
+  """Adds newly recorded samples to the rollups of their hour and day. The
+  affected rollups are read and written with one query each"""
+
+  if not samples:
+    return
+
+  starts: set[datetime] = {get_period_start(sample.timestamp, period)
+                           for sample in samples for period in PERIODS}
+
+  with transaction.atomic():
+    rollups: dict[RollupKey, RideWaitRollup] = {
+      (rollup.ride_id, rollup.period, rollup.start): rollup
+      for rollup in RideWaitRollup.objects.select_for_update().filter(
+        ride_id__in={sample.ride_id for sample in samples},
+        start__in=starts)
+    }
+
+    added: set[RollupKey] = add_to_rollups(rollups=rollups, samples=samples)
+
+    RideWaitRollup.objects.bulk_create(
+      [rollups[key] for key in added],
+      update_conflicts=True,
+      unique_fields=['ride', 'period', 'start'],
+      update_fields=ROLLUP_UPDATE_FIELDS)
+
+
+def rebuild_rollups(park_id: Optional[int] = None) -> int:
+  """Recomputes the rollups of every ride, or the rides of one park, from
+  their raw samples. Returns the number of rollups written"""
+
+  samples = RideWaitSample.objects.only('ride_id', 'timestamp', 'wait_time',
+                                        'open_state')
+  rollups_to_delete = RideWaitRollup.objects.all()
+
+  if park_id is not None:
+    samples = samples.filter(ride__park_id=park_id)
+    rollups_to_delete = rollups_to_delete.filter(ride__park_id=park_id)
+
+  rollups: dict[RollupKey, RideWaitRollup] = {}
+
+  with transaction.atomic():
+    add_to_rollups(rollups=rollups,
+                   samples=samples.order_by('ride_id', 'timestamp')
+                                  .iterator(chunk_size=10000))
+
+    rollups_to_delete.delete()
+    RideWaitRollup.objects.bulk_create(rollups.values(), batch_size=1000)
+
+  return len(rollups)
+
+
+def check_rollups(park_id: Optional[int] = None) -> list[str]:
+  """Compares the rollups of every ride, or the rides of one park, with
+  aggregates of their raw samples computed by the DB. Produces a
+  description of each difference"""
+
+  differences: list[str] = []
+
+  for period, trunc in ((RideWaitRollup.HOUR, TruncHour),
+                        (RideWaitRollup.DAY, TruncDay)):
+    samples = RideWaitSample.objects.all()
+    rollups = RideWaitRollup.objects.filter(period=period)
+
+    if park_id is not None:
+      samples = samples.filter(ride__park_id=park_id)
+      rollups = rollups.filter(ride__park_id=park_id)
+
+    is_open = Q(open_state=True)
+    expected: dict[tuple[int, datetime], dict] = {
+      (row['ride_id'], row['start']): row for row in samples
+        .annotate(start=trunc('timestamp'))
+        .values('ride_id', 'start')
+        .annotate(samples=Count('id'),
+                  open_samples=Count('id', filter=is_open),
+                  wait_sum=Sum('wait_time', filter=is_open, default=0),
+                  min_wait=Min('wait_time', filter=is_open),
+                  max_wait=Max('wait_time', filter=is_open))
+        .order_by()
+    }
+    stored: dict[tuple[int, datetime], RideWaitRollup] = {
+      (rollup.ride_id, rollup.start): rollup for rollup in rollups
+    }
+
+    for ride_id, start in sorted(expected.keys() | stored.keys()):
+      name: str = f"{period} rollup of ride {ride_id} at {start.isoformat()}"
+      row: Optional[dict] = expected.get((ride_id, start))
+      rollup: Optional[RideWaitRollup] = stored.get((ride_id, start))
+
+      if row is None:
+        differences.append(f"{name} has no samples")
+        continue
+      if rollup is None:
+        differences.append(f"{name} is missing")
+        continue
+
+      for field in ('samples', 'open_samples', 'wait_sum', 'min_wait',
+                    'max_wait'):
+        if getattr(rollup, field) != row[field]:
+          differences.append(f"{name}: {field} is "\
+                             f"{getattr(rollup, field)} not {row[field]}")
+
+      # Percentiles are only right if the histogram holds every sample
+      if sum(rollup.histogram.values()) != rollup.open_samples or \
+         sum(int(wait_time) * count for wait_time, count
+             in rollup.histogram.items()) != rollup.wait_sum:
+        differences.append(f"{name}: histogram doesn't match its samples")
+
+  return differences
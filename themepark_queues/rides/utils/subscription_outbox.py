@@ -0,0 +1,226 @@
+"""
+Name: subscription_outbox.py
+Author: Ryan Gascoigne-Jones
+
+Purpose: Queues ride notification subscriptions in the local DB so that
+  requests don't wait on the remote DB, and writes them to the remote DB
+  in batches from the flush_subscriptions worker
+"""
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Min
+from django.utils import timezone
+from datetime import datetime
+import logging
+import threading
+import time
+from typing import Optional
+from ..models import Ride, Subscription, SubscriptionOutbox
+from .firebase_access import get_db, get_notif_db_url, get_ride_notif
+from .metrics import inc, timer
+from .timing import timed
+
+logger = logging.getLogger(__name__)
+
+_stats_lock = threading.Lock()
+_flush_stats: dict[str, float] = {
+  'flushes': 0,
+  'failures': 0,
+  'flushed': 0,
+  'last_flush_seconds': 0.0,
+  'max_flush_seconds': 0.0,
+  'max_delay_seconds': 0.0
+}
+
+
+@timed('subscribe')
+def subscribe(user, park_id: int, ride: Ride) -> bool:
+  """Subscribes user to notifications of ride reopening. The subscription
+  is only queued to be written to the remote DB when it is new. Returns
+  whether it was new"""
+
+  with transaction.atomic():
+    _, created = Subscription.objects.get_or_create(user=user,
+                                                    park_id=park_id,
+                                                    ride=ride)
+
+    if created:
+      enqueue_notif(park_id=park_id,
+                    ride_id=ride.id,
+                    ride_name=ride.name,
+                    user_email=user.email)
+
+  return created
+
+
+def enqueue_notif(park_id: int,
+                  ride_id: int,
+                  ride_name: str,
+                  user_email: str) -> SubscriptionOutbox:
+  """Queues the notification request for the specific ride_id for the
+  given user_email to be written to the remote DB"""
+
+  return SubscriptionOutbox.objects.create(park_id=park_id,
+                                           ride_id=ride_id,
+                                           ride_name=ride_name,
+                                           user_email=user_email)
+
+
+def flush_outbox(batch_size: int) -> int:
+  """Writes up to batch_size of the oldest queued subscriptions to the
+  remote DB in one multi-path update and removes them from the outbox.
+  Returns the number written.
+
+  If the update fails, the rows are written one at a time up to the first
+  that fails, so a subscription the remote DB rejects can't hold back the
+  rest of its batch. Only that row's attempts are counted, and rows with
+  the fewest attempts are flushed first. Rows reaching
+  SUBSCRIPTION_OUTBOX_MAX_ATTEMPTS are kept but no longer flushed"""
+
+  rows: list[SubscriptionOutbox] = []
+  written: list[SubscriptionOutbox] = []
+  start: float = time.monotonic()
+
+  try:
+    with transaction.atomic():
+      # Rows being flushed by another worker are skipped rather than
+      # written twice
+      rows = list(SubscriptionOutbox.objects
+                  .select_for_update(skip_locked=True)
+                  .filter(
+                    attempts__lt=settings.SUBSCRIPTION_OUTBOX_MAX_ATTEMPTS)
+                  .order_by('attempts', 'id')[:batch_size])
+
+      if not rows:
+        return 0
+
+      try:
+        write_subscriptions(rows=rows)
+        written = rows
+      except Exception:
+        if len(rows) == 1:
+          raise
+
+        logger.warning(f"Writing {len(rows)} subscriptions failed, "\
+                       f"retrying one at a time")
+
+        for row in rows:
+          write_subscriptions(rows=[row])
+          written.append(row)
+
+      SubscriptionOutbox.objects.filter(
+        id__in=[row.id for row in written]).delete()
+  except Exception:
+    # Rows written before the failure are removed now the transaction has
+    # rolled back, and the row which failed is counted
+    SubscriptionOutbox.objects.filter(
+      id__in=[row.id for row in written]).delete()
+
+    failed_rows: list[SubscriptionOutbox] = rows[len(written):][:1]
+    if failed_rows:
+      count_failed_attempt(row=failed_rows[0])
+
+    record_flush(rows=written, duration=time.monotonic() - start,
+                 failed=True)
+    raise
+
+  record_flush(rows=written, duration=time.monotonic() - start, failed=False)
+
+  return len(written)
+
+
+@timed('firebase')
+def write_subscriptions(rows: list[SubscriptionOutbox]) -> None:
+  """Writes the subscriptions of rows to the remote DB in one update"""
+
+  with timer('themepark_firebase_seconds', operation='outbox_flush'):
+    get_db().reference(get_notif_db_url()).update(
+      get_outbox_update(rows=rows))
+
+
+def count_failed_attempt(row: SubscriptionOutbox) -> None:
+  """Counts a failed attempt at writing the row, logging it once it will no
+  longer be retried"""
+
+  SubscriptionOutbox.objects.filter(id=row.id)\
+                            .update(attempts=F('attempts') + 1)
+
+  if row.attempts + 1 >= settings.SUBSCRIPTION_OUTBOX_MAX_ATTEMPTS:
+    logger.error(f"Giving up writing subscription {row.id} of "\
+                 f"{row.user_email} to ride {row.ride_id} after "\
+                 f"{row.attempts + 1} attempts")
+
+
+def retry_dead_subscriptions() -> int:
+  """Queues subscriptions which reached SUBSCRIPTION_OUTBOX_MAX_ATTEMPTS to
+  be flushed again. Returns the number requeued"""
+
+  return SubscriptionOutbox.objects.filter(
+    attempts__gte=settings.SUBSCRIPTION_OUTBOX_MAX_ATTEMPTS)\
+    .update(attempts=0)
+
+
+def get_outbox_update(rows: list[SubscriptionOutbox]) -> dict:
+  """Produces a multi-path update of the remote DB notifications that
+  subscribes each row's user_email to its ride"""
+
+  update: dict = {}
+
+  for row in rows:
+    ride_notif: dict = get_ride_notif(ride_id=row.ride_id,
+                                      ride_name=row.ride_name,
+                                      user_email=row.user_email)
+
+    for path, value in ride_notif.items():
+      update[f"{row.park_id}/{row.ride_id}/{path}"] = value
+
+  return update
+
+
+def record_flush(rows: list[SubscriptionOutbox], duration: float,
+                 failed: bool) -> None:
+  """Counts a flush of the outbox, its latency and the longest time one of
+  the rows it wrote waited to be written"""
+
+  now = timezone.now()
+
+  with _stats_lock:
+    _flush_stats['flushes'] += 1
+    _flush_stats['last_flush_seconds'] = duration
+    _flush_stats['max_flush_seconds'] = max(_flush_stats['max_flush_seconds'],
+                                            duration)
+
+    if failed:
+      _flush_stats['failures'] += 1
+      inc('themepark_outbox_flush_failures_total')
+
+    # Rows written before a failure are still counted
+    if not rows:
+      return
+
+    _flush_stats['flushed'] += len(rows)
+    inc('themepark_outbox_flushed_total', len(rows))
+    _flush_stats['max_delay_seconds'] = max(
+      _flush_stats['max_delay_seconds'],
+      max((now - row.created_at).total_seconds() for row in rows))
+
+
+def get_outbox_stats() -> dict[str, float]:
+  """Produces the number of subscriptions waiting in the outbox, how many
+  are no longer retried, how long the oldest has waited and the flush
+  latency of this process"""
+
+  oldest: Optional[datetime] = SubscriptionOutbox.objects.aggregate(
+    oldest=Min('created_at'))['oldest']
+
+  with _stats_lock:
+    stats: dict[str, float] = dict(_flush_stats)
+
+  stats['depth'] = SubscriptionOutbox.objects.count()
+  stats['dead'] = SubscriptionOutbox.objects.filter(
+    attempts__gte=settings.SUBSCRIPTION_OUTBOX_MAX_ATTEMPTS).count()
+  stats['oldest_seconds'] = (timezone.now() - oldest).total_seconds() \
+                            if oldest is not None else 0.0
+
+  return stats
@@ -0,0 +1,121 @@
+"""
+Name: timing.py
+Author: Ryan Gascoigne-Jones
+
+Purpose: Records how long each stage of a sampled request takes and the DB
+  queries it makes. Stages outside a sampled request cost one context
+  variable lookup
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+import functools
+import time
+from typing import Callable, Iterator, Optional, TypeVar
+
+F = TypeVar('F', bound=Callable)
+
+
+class RequestTimings:
+  """Durations and DB queries of the stages of one request"""
+
+  def __init__(self) -> None:
+    self.start: float = time.perf_counter()
+    self.queries: int = 0
+    self.query_seconds: float = 0.0
+    # Stage name mapped to [seconds, queries, calls]
+    self.stages: dict[str, list[float]] = {}
+
+  def count_query(self, execute, sql, params, many, context):
+    """DB execute wrapper which counts and times each query"""
+
+    start: float = time.perf_counter()
+
+    try:
+      return execute(sql, params, many, context)
+    finally:
+      self.queries += 1
+      self.query_seconds += time.perf_counter() - start
+
+  def add_stage(self, name: str, seconds: float, queries: int) -> None:
+    """Adds a call of a stage. Stages called more than once are summed"""
+
+    totals: list[float] = self.stages.setdefault(name, [0.0, 0, 0])
+    totals[0] += seconds
+    totals[1] += queries
+    totals[2] += 1
+
+  def get_total_seconds(self) -> float:
+    return time.perf_counter() - self.start
+
+  def get_server_timing(self) -> str:
+    """Produces the Server-Timing header value of the request. Nested
+    stages are included in the stages that call them"""
+
+    metrics: list[str] = [
+      f'{name};dur={seconds * 1000:.1f};desc="{int(queries)} queries"'
+      for name, (seconds, queries, _) in self.stages.items()
+    ]
+    metrics.append(f'db;dur={self.query_seconds * 1000:.1f};'\
+                   f'desc="{self.queries} queries"')
+    metrics.append(f'total;dur={self.get_total_seconds() * 1000:.1f}')
+
+    return ', '.join(metrics)
+
+  def as_dict(self) -> dict:
+    """Produces the timings for a structured log line"""
+
+    return {
+      'total_ms': round(self.get_total_seconds() * 1000, 1),
+      'queries': self.queries,
+      'db_ms': round(self.query_seconds * 1000, 1),
+      'stages': {
+        name: {'ms': round(seconds * 1000, 1), 'queries': int(queries),
+               'calls': int(calls)}
+        for name, (seconds, queries, calls) in self.stages.items()
+      }
+    }
+
+
+# Timings of the sampled request being handled, None when not sampled
+request_timings: ContextVar[Optional[RequestTimings]] = ContextVar(
+  'request_timings', default=None)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+  """Times the enclosed code as a stage of the sampled request"""
+
+  timings: Optional[RequestTimings] = request_timings.get()
+
+  if timings is None:
+    yield
+    return
+
+  start: float = time.perf_counter()
+  queries: int = timings.queries
+
+  try:
+    yield
+  finally:
+    timings.add_stage(name=name, seconds=time.perf_counter() - start,
+                      queries=timings.queries - queries)
+
+
+def timed(name: str) -> Callable[[F], F]:
+  """Decorator which times each call of a function as a stage of the
+  sampled request"""
+
+  def decorator(func: F) -> F:
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+      if request_timings.get() is None:
+        return func(*args, **kwargs)
+
+      with stage(name):
+        return func(*args, **kwargs)
+
+    return wrapper # type: ignore
+
+  return decorator
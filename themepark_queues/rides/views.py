@@ -1,36 +1,82 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import HttpResponse, HttpRequest
+from django.http import HttpResponse, HttpRequest, Http404, \
+  HttpResponseForbidden, StreamingHttpResponse
+from django.http.response import HttpResponseBase
+from django.core.handlers.asgi import ASGIRequest
+from asgiref.sync import sync_to_async
 from django.template import loader
-from django.db.models import QuerySet
 from .forms import CreateUserForm, LoginUserForm
 from django.contrib import auth
 from django.contrib.auth.decorators import login_required
-from .models import Ride
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, require_GET
+from .models import Ride, RideForecast, Subscription
+from django.conf import settings
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare
+import asyncio
 import json
+from typing import AsyncIterator, Optional
 
 # Utility functions
-from .utils import get_queue_data, add_notif, save_queue_data
+from .utils import get_queue_data, serialise_queue_data
+from .utils.broadcaster import broadcaster, get_cached_events
+from .utils.metrics import render_metrics
+from .utils.subscription_outbox import subscribe
+from .utils.timing import stage
+from .utils.page_cache import get_snapshot_version, get_snapshot_versions, \
+  get_cached_page, set_cached_page
+
 
 def home(request: HttpRequest) -> HttpResponse:
-  """Provides data for tables of rides seperated by ride category"""
+  """Provides data for tables of rides seperated by ride category.
+  Anonymous users are served a page cached until the next snapshot of the
+  park is ingested"""
 
   template = loader.get_template('home.html')
 
   ## DYNAMIC_TODO: Make this change when a different park is requested
   park_id: int = 1
 
-  rides: tuple[list[QuerySet], list[str]] = get_queue_data(park_id=park_id)
+  # Read before the rides, so a land's table is never cached under a
+  # version newer than its rides
+  snapshot_version, land_versions = get_snapshot_versions(park_id=park_id)
+
+  # Anonymous users all see the same page
+  if not request.user.is_authenticated:
+    page: Optional[bytes] = get_cached_page(page='home', park_id=park_id,
+                                            version=snapshot_version)
+    if page is not None:
+      return HttpResponse(page)
+
+  rides: tuple[list[list[Ride]], list[str]] = get_queue_data(park_id=park_id)
 
-  land_names: list[str] = ["Family", "Thrills"]
+  # The table of each land is cached by its version, so only tables whose
+  # rides changed are rendered again after an ingestion
+  lands: list[dict] = [
+    {'name': land_name,
+     'version': land_versions.get(land_name, 0),
+     'rides': land_rides}
+    for land_rides, land_name in zip(rides[0], rides[1])
+  ]
 
   context: dict = {
     'title': 'Homepage',
-    # First item in tuple is the list of Querysets for rides of different categories
-    'rides_list': rides[0],
-    'land_names': json.dumps(land_names)
+    'lands': lands,
+    # Keys the cached ride tables shared with logged in users, who still
+    # get their own navbar
+    'park_id': park_id,
+    'page_cache_timeout': settings.PAGE_CACHE_TIMEOUT
   }
 
-  return render(request, 'home.html', context)
+  with stage('render'):
+    response: HttpResponse = render(request, 'home.html', context)
+
+  if not request.user.is_authenticated:
+    set_cached_page(page='home', park_id=park_id, version=snapshot_version,
+                    content=response.content)
+
+  return response
 
 
 def register(request: HttpRequest) -> HttpResponse:
@@ -84,7 +130,14 @@ def login(request: HttpRequest) -> HttpResponse:
 @login_required(login_url="login")
 def account(request: HttpRequest) -> HttpResponse:
 
-  return render(request, 'account.html')
+  context: dict = {
+    # Rides the user is subscribed to, from the local subscription index
+    'subscriptions': Subscription.objects.filter(user=request.user)
+                                         .select_related('ride')
+                                         .order_by('ride__name')
+  }
+
+  return render(request, 'account.html', context)
 
 
 @login_required(login_url="login")
@@ -97,47 +150,176 @@ def logout(request) -> HttpResponse:
 
 def ride_info(request: HttpRequest, ride_id: int) -> HttpResponse:
   """Provides info about a specific ride and enables user to subscribe to
-  email notifications for reopening. Handles PUT requests to firebase DB to
-  store email notification data."""
-
-  # DYNAMIC_TODO: Change to use dynamic park_id
-  save_queue_data(park_id=1)
+  email notifications for reopening. Subscriptions are queued locally and
+  written to the firebase DB by the flush_subscriptions worker."""
 
-  ### IMPROVE_TODO: Get live data to the ride_info page instead of just
-  ### taking last updated home page data. (maybe request data for
-  ### individual ride directly from queue-times.com?)
+  # The ride is only read from the local DB, which is kept up to date by
+  # the run_ingestor command
   ride: Ride = get_object_or_404(Ride, id=ride_id)
 
-  ## IMPROVE_TODO: Handle when user is already subscribed
-  ## - Hold subscribed state somewhere to check.
-  ## This is currently handled by not adding duplicate email addresses to
-  ## remote DB.
   subscribed: bool = False
 
-  if request.method == "POST":
-    if request.user.is_authenticated:
-
-      ## IMPROVE_TODO: This type hint issue should be addressed
-      user_email: str = request.user.email # type: ignore
+  if request.user.is_authenticated:
+    if request.method == "POST":
 
-      # IMPROVE_TODO: Maybe return status code to display on website
-      # (maybe just log this and return None)
+      # Responds once the subscription is committed locally rather than
+      # waiting on the remote DB, which is only written for new
+      # subscriptions
       ## DYNAMIC_TODO: Make park_id change depending on park
-      add_notif(park_id=1,
-                ride_id=ride_id,
-                ride_name=ride.name,
-                user_email=user_email)
+      subscribe(user=request.user, park_id=1, ride=ride)
 
       subscribed = True
 
+    else:
+      # Subscribed state is read from the local index, not the remote DB
+      subscribed = Subscription.objects.filter(user=request.user,
+                                               park_id=1,
+                                               ride=ride).exists()
+
+  # Forecasts are fitted ahead of time by the fit_forecasts command
+  forecast: Optional[RideForecast] = RideForecast.objects.filter(
+    ride=ride).first()
+
   context = {
     'ride': ride,
     'subscribed': subscribed,
+    'forecast': forecast.get_upcoming_waits(now=timezone.now())
+                if forecast is not None else [],
   }
 
-  return render(request, 'ride_info.html', context)
+  with stage('render'):
+    return render(request, 'ride_info.html', context)
 
 
 def about(request: HttpRequest) -> HttpResponse:
 
-  return render(request, 'about.html')
\ No newline at end of file
+  return render(request, 'about.html')
+
+
+def get_park_queues_etag(request: HttpRequest,
+                         park_id: int) -> Optional[str]:
+  """Produces the ETag of a park's queue data, which changes with each new
+  snapshot version"""
+
+  version: int = get_snapshot_version(park_id=park_id)
+
+  # No ETag for a park that hasn't been ingested
+  if not version:
+    return None
+
+  return f"{park_id}-{version}"
+
+
+@require_GET
+@cache_control(public=True, max_age=settings.API_CACHE_MAX_AGE)
+@condition(etag_func=get_park_queues_etag)
+def park_queues(request: HttpRequest, park_id: int) -> HttpResponse:
+  """Provides the current snapshot of a park's lands and rides as JSON.
+  It is serialised once per snapshot version, and clients that already
+  have the current version get a 304 response"""
+
+  snapshot_version: int = get_snapshot_version(park_id=park_id)
+
+  if not snapshot_version:
+    raise Http404("Park has not been ingested")
+
+  body: Optional[bytes] = get_cached_page(page='park_queues', park_id=park_id,
+                                          version=snapshot_version)
+
+  if body is None:
+    rides: tuple[list[list[Ride]], list[str]] = get_queue_data(
+      park_id=park_id)
+
+    body = json.dumps(serialise_queue_data(
+      park_id=park_id, version=snapshot_version, rides_list=rides[0],
+      ride_categories=rides[1])).encode()
+
+    # Only cached if a new snapshot wasn't ingested while it was serialised
+    if get_snapshot_version(park_id=park_id) == snapshot_version:
+      set_cached_page(page='park_queues', park_id=park_id,
+                      version=snapshot_version, content=body)
+
+  return HttpResponse(body, content_type='application/json')
+
+
+async def park_events(request: HttpRequest,
+                      park_id: int) -> HttpResponseBase:
+  """Streams wait time and open state changes of rides in the park as
+  Server-Sent Events when served through asgi.py. Under WSGI, where a
+  worker can't be held by each connection, the cached state of the rides
+  is sent if the park has changed since the client's Last-Event-ID and the
+  response ends, so the browser polls by reconnecting"""
+
+  if not isinstance(request, ASGIRequest):
+    try:
+      last_version: int = int(request.headers.get('Last-Event-ID', 0))
+    except ValueError:
+      last_version = 0
+
+    events: list[dict] = await sync_to_async(get_cached_events)(
+      park_id=park_id, after_version=last_version)
+
+    response: HttpResponseBase = HttpResponse(
+      f"retry: {settings.RIDE_EVENTS_WSGI_RETRY * 1000}\n\n" + ''.join(
+        format_event(event=event) for event in events),
+      content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+
+    return response
+
+  queue: asyncio.Queue = await broadcaster.subscribe(park_id=park_id)
+
+  async def stream() -> AsyncIterator[str]:
+    # Closes the stream after a while, browsers reconnect automatically
+    loop = asyncio.get_running_loop()
+    close_at: float = loop.time() + settings.RIDE_EVENTS_MAX_DURATION
+
+    try:
+      yield f"retry: {settings.RIDE_EVENTS_RETRY * 1000}\n\n"
+
+      while loop.time() < close_at:
+        try:
+          event: dict = await asyncio.wait_for(
+            queue.get(), timeout=settings.RIDE_EVENTS_HEARTBEAT)
+        except asyncio.TimeoutError:
+          # Keeps idle connections open through proxies
+          yield ": heartbeat\n\n"
+          continue
+
+        yield format_event(event=event)
+    finally:
+      broadcaster.unsubscribe(park_id=park_id, queue=queue)
+
+  response = StreamingHttpResponse(stream(),
+                                   content_type='text/event-stream')
+  response['Cache-Control'] = 'no-cache'
+  # Stops nginx buffering events
+  response['X-Accel-Buffering'] = 'no'
+
+  return response
+
+
+def format_event(event: dict) -> str:
+  """Formats a ride change event as a Server-Sent Event. Its id is the park
+  version, sent back by reconnecting browsers as Last-Event-ID"""
+
+  return f"id: {event['version']}\nevent: ride\n"\
+         f"data: {json.dumps(event)}\n\n"
+
+
+@require_GET
+@cache_control(no_store=True)
+def metrics(request: HttpRequest) -> HttpResponse:
+  """Provides the metrics of every process in the Prometheus text format.
+  Requires the bearer token METRICS_TOKEN when it is set, and isn't served
+  at all without one if METRICS_REQUIRE_TOKEN is set"""
+
+  if not settings.METRICS_TOKEN:
+    if settings.METRICS_REQUIRE_TOKEN:
+      return HttpResponseForbidden()
+  elif not constant_time_compare(request.headers.get('Authorization', ''),
+                                 f"Bearer {settings.METRICS_TOKEN}"):
+    return HttpResponseForbidden()
+
+  return HttpResponse(render_metrics(),
+                      content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 
 from pathlib import Path
 import os
+import tempfile
 from dotenv import load_dotenv
 from django.core.management.utils import get_random_secret_key
 
@@ -55,6 +56,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
+    "rides.middleware.MetricsMiddleware",
+    "rides.middleware.ServerTimingMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -149,4 +152,144 @@ FIREBASE_DB_URL = os.getenv('FIREBASE_DB_URL')
 
 # Loads firebase authentication SDK
 FIREBASE_AUTH_KEY = os.path.join(BASE_DIR,
-  "themepark-queues-notifications-firebase-adminsdk.json")
\ No newline at end of file
+  "themepark-queues-notifications-firebase-adminsdk.json")
+
+# Parks polled by the run_ingestor command mapped to their poll interval
+# in seconds
+## DYNAMIC_TODO: Add other parks once they are supported by the views
+INGESTOR_PARKS = {
+  1: 60,
+}
+
+# Poll interval in seconds for parks passed to run_ingestor with --park
+INGESTOR_DEFAULT_INTERVAL = 60
+
+# Maximum number of parks run_ingestor polls at once
+INGESTOR_MAX_WORKERS = 8
+
+# Seconds after which a park still being polled is reported as timed out.
+# Above the slowest fetch with retries, (3.05s connect + 10s read) * 4
+# attempts + backoff = ~56s, so only hung polls time out
+INGESTOR_PARK_TIMEOUT = 90
+
+# Seconds pages and ride tables cached by snapshot version are kept. Old
+# versions are never read again, so this only stops them building up
+PAGE_CACHE_TIMEOUT = 300
+
+# Base URL ride data is requested from
+QUEUE_TIMES_URL = os.getenv('QUEUE_TIMES_URL', "https://queue-times.com")
+
+# Seconds to wait for a connection to and a response from queue-times.com
+QUEUE_TIMES_CONNECT_TIMEOUT = 3.05
+QUEUE_TIMES_READ_TIMEOUT = 10
+
+# Retries of failed requests to queue-times.com, and the backoff factor and
+# maximum random jitter in seconds between them
+QUEUE_TIMES_RETRIES = 3
+QUEUE_TIMES_BACKOFF = 0.5
+
+# Seconds clients may reuse park queue data from the JSON API before
+# revalidating it
+API_CACHE_MAX_AGE = 30
+
+# Seconds between each process's checks for new ride changes to push to
+# clients connected to the ride events stream
+RIDE_EVENTS_POLL_INTERVAL = 2
+
+# Seconds browsers wait before reconnecting to a closed events stream
+RIDE_EVENTS_RETRY = 5
+
+# Seconds between the polls of browsers when the events stream is served
+# over WSGI, each of which gets the ride events cached by the ingestor
+RIDE_EVENTS_WSGI_RETRY = 30
+
+# The ingestor stores each park's current ride events in the ride_events
+# cache as they change, so it must be shared with every Gunicorn worker.
+# Other cached data is only read by the process which cached it
+CACHES = {
+  'default': {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'
+  },
+  'ride_events': {
+    'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+    'LOCATION': os.getenv('RIDE_EVENTS_CACHE_DIR', os.path.join(
+      tempfile.gettempdir(), 'themepark_queues_ride_events'))
+  }
+}
+
+# Events held for each connected client before its oldest are dropped
+RIDE_EVENTS_QUEUE_SIZE = 500
+
+# Seconds between keep-alive comments sent on an idle events stream
+RIDE_EVENTS_HEARTBEAT = 15
+
+# Seconds before an events stream is closed, after which clients reconnect
+RIDE_EVENTS_MAX_DURATION = 600
+
+# Seconds the flush_subscriptions worker waits when the outbox is empty
+SUBSCRIPTION_OUTBOX_INTERVAL = 2
+
+# Maximum subscriptions written to the remote DB in one multi-path update
+SUBSCRIPTION_OUTBOX_BATCH_SIZE = 100
+
+# Failed writes of a subscription to the remote DB after which it is kept
+# in the outbox but no longer retried, until requeued with
+# flush_subscriptions --retry-dead
+SUBSCRIPTION_OUTBOX_MAX_ATTEMPTS = 10
+
+# Queues notifications to subscribers of rides that reopen when they are
+# ingested, sent by the send_notifications worker
+REOPEN_NOTIFICATIONS = True
+
+# Notifications are printed by the send_notifications worker rather than
+# sent
+EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
+DEFAULT_FROM_EMAIL = 'notifications@localhost'
+
+# Function which sends each batch of queued notifications, returning the
+# notifications which failed
+NOTIFICATION_SENDER = 'rides.utils.notifications.send_email_notifications'
+
+# Seconds the send_notifications worker waits when none are queued
+NOTIFICATION_INTERVAL = 5
+
+# Maximum notifications sent in one batch
+NOTIFICATION_BATCH_SIZE = 100
+
+# Failed sends of a notification after which it is kept in the queue but
+# no longer retried, until requeued with send_notifications --retry-dead
+NOTIFICATION_MAX_ATTEMPTS = 5
+
+# Days of wait time history forecasts are fitted to
+FORECAST_HISTORY_DAYS = 56
+
+# Hours ahead rides are forecast, in steps of FORECAST_STEP_MINUTES
+FORECAST_HOURS = 4
+FORECAST_STEP_MINUTES = 30
+
+# Hours of recent waits used for a ride's trend, which fades over the same
+# time
+FORECAST_TREND_HOURS = 2
+
+# Samples an hour of the week needs before its mean counts as much as the
+# ride's overall mean
+FORECAST_PRIOR_SAMPLES = 5
+
+# Fraction of requests timed by ServerTimingMiddleware, sending their
+# stage durations and DB queries in a Server-Timing header and a log line
+SERVER_TIMING_SAMPLE_RATE = 1.0
+
+# Directory each process writes its metrics to, summed when /metrics is
+# scraped. Must be shared by every Gunicorn worker and management command,
+# and emptied when the app is deployed. None serves this process only
+METRICS_DIR = None
+
+# Seconds between each process writing its metrics to METRICS_DIR
+METRICS_FLUSH_INTERVAL = 5
+
+# Bearer token required to scrape /metrics
+METRICS_TOKEN = None
+
+# Refuses to serve /metrics when METRICS_TOKEN isn't set, rather than
+# serving it to anyone
+METRICS_REQUIRE_TOKEN = False